@@ -0,0 +1,82 @@
+"""Import time benchmark
+
+Measures the time taken by a fresh interpreter to import pyslo.sli, and
+checks that no metric provider SDK is loaded by the import. Each run is a
+separate process so nothing is already in sys.modules.
+
+Usage::
+
+    python benchmarks/import_time.py --repeat 5 --max-seconds 1.0
+
+Exits with status 1 if the median import time is over --max-seconds or a
+provider SDK was imported.
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Modules that must not be loaded by importing the module under test
+PROVIDER_MODULES = ['google.cloud.monitoring_v3', 'grpc']
+
+SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': seconds,
+    'loaded': [name for name in {providers!r} if name in sys.modules]
+    }}))
+'''
+
+
+def measure_import(module='pyslo.sli', repeat=5):
+    """Import a module in fresh interpreters
+
+    Args:
+        module: name of the module to import
+        repeat: number of interpreters to start
+
+    Returns:
+        A tuple of the list of import times in seconds, one per run, and the
+        list of provider modules that were loaded by the import.
+    """
+    times = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', SCRIPT.format(module=module, providers=PROVIDER_MODULES)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True
+            ).stdout
+        result = json.loads(output)
+        times.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return times, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--module', default='pyslo.sli')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    times, loaded = measure_import(args.module, args.repeat)
+    median = statistics.median(times)
+    print(f'import {args.module}: median {median:.3f}s, min {min(times):.3f}s '
+          f'over {args.repeat} runs')
+    failed = False
+    if loaded:
+        print(f'FAIL: provider modules loaded by the import: {loaded}')
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f'FAIL: median import time is over {args.max_seconds}s')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
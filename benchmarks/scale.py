@@ -0,0 +1,284 @@
+"""SLI scale benchmarks
+
+Times ingestion of TimeSeries pages with StackdriverMetricClient.to_df,
+the whole fetch pipeline of timeseries_dataframe against an in-process
+FakeMetricServiceServer, whose pages are serialized before timing so
+that the client's requests, protobuf parsing and decoding are measured
+rather than the server, simple and grouped bool aggregation, grouped
+aggregation with ParallelAggregator, and the error budget of a grouped
+SLI, over synthetic metrics of increasing size, and records the peak
+memory allocated by each. Peak memory of the parallel case excludes its
+worker processes. Data comes from benchmarks/synthetic.py, so runs are
+reproducible and need neither credentials nor network access.
+
+Usage::
+
+    python benchmarks/scale.py --max-points 1e6 --thresholds benchmarks/thresholds.json
+
+Sizes are powers of ten from --min-points to --max-points. Building
+protobufs is slow, so ingestion stops at --max-ingest-points. Each
+threshold is a budget of fixed overhead plus a cost per point, for time
+and for peak memory, and may require a speedup over another case, see
+check_speedup. Exits with status 1 if any case is over budget.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from synthetic import SyntheticMetric
+from pyslo import sli
+from pyslo.aggregator import ParallelAggregator
+from pyslo.metric_client import ValueType
+from pyslo.metric_client.stackdriver import StackdriverMetricClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceServer
+
+# Fake servers of the fetch case, stopped on exit
+SERVERS = []
+# Aggregators of the parallel case, whose worker processes are stopped on exit
+AGGREGATORS = []
+
+
+def make_metric_client(client=None):
+    """A StackdriverMetricClient of the synthetic metric
+
+    Args:
+        client: Optional. MetricServiceClient to fetch with. default = None,
+                a client that fails if used
+    """
+    metric_client = StackdriverMetricClient('benchmark', client=client or object())
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    return metric_client
+
+
+def make_sli(metric, group_by=True):
+    """An Sli over the dataframe of a synthetic metric
+    """
+    sli_instance = sli.Sli()
+    sli_instance.slo = 0.99
+    sli_instance.metric_data = metric.dataframe()
+    if group_by:
+        sli_instance.group_by_resource_labels = ['project_id', 'environment_name']
+        sli_instance.group_by_metric_labels = ['image_version']
+    return sli_instance
+
+
+def setup_ingest(metric):
+    metric_client = make_metric_client()
+    pages = metric.pages()
+    return lambda: [metric_client.to_df(page) for page in pages]
+
+
+def setup_fetch(metric):
+    server = FakeMetricServiceServer(metric.time_series(), page_size=10)
+    server.start()
+    SERVERS.append(server)
+    metric_client = make_metric_client(server.client())
+    duration = metric.points_per_series * metric.step
+
+    def run():
+        return metric_client.timeseries_dataframe(end=metric.end, duration=duration)
+    # The server serializes the pages on the first fetch, so that measured
+    # fetches only serve bytes and the time is the client's
+    run()
+    return run
+
+
+def setup_simple(metric):
+    sli_instance = make_sli(metric, group_by=False)
+    return sli_instance.calc_bool_simple
+
+
+def setup_grouped(metric):
+    sli_instance = make_sli(metric)
+    return sli_instance.calc_bool_agg
+
+
+def setup_parallel(metric):
+    sli_instance = make_sli(metric)
+    sli_instance.aggregator = ParallelAggregator(min_rows=0)
+    AGGREGATORS.append(sli_instance.aggregator)
+    return sli_instance.calc_bool_agg
+
+
+def setup_error_budget(metric):
+    sli_instance = make_sli(metric)
+
+    def run():
+        sli_instance.calc_bool_agg()
+        return sli_instance.error_budget()
+    return run
+
+
+# name: (setup, whether the case builds protobufs)
+CASES = {
+    'ingest': (setup_ingest, True),
+    'fetch': (setup_fetch, True),
+    'simple': (setup_simple, False),
+    'grouped': (setup_grouped, False),
+    'parallel': (setup_parallel, False),
+    'error_budget': (setup_error_budget, False),
+}
+
+
+def measure(setup, metric, repeat=3):
+    """Time a case and measure its peak memory
+
+    The setup, e.g. building the dataframe, is neither timed nor counted
+    in the peak memory. Peak memory is measured in a separate run, as
+    tracing allocations slows the code down.
+
+    Args:
+        setup:  function of the metric returning the function to measure
+        metric: SyntheticMetric
+        repeat: number of timed runs
+
+    Returns:
+        A dictionary of the best time in seconds and the peak of memory
+        allocated during a run in bytes
+    """
+    run = setup(metric)
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def budget(threshold, n_points):
+    """Time and memory budgets of a case for a number of points
+
+    Returns:
+        A tuple of seconds and bytes
+    """
+    seconds = threshold['seconds'] + threshold['ns_per_point'] * n_points / 10**9
+    peak_bytes = threshold['bytes'] + threshold['bytes_per_point'] * n_points
+    return seconds, peak_bytes
+
+
+def check(result, thresholds):
+    """Compare a result to its threshold
+
+    Returns:
+        A list of failure messages, empty if within budget or there is no
+        threshold for the case
+    """
+    if result['case'] not in thresholds:
+        return []
+    seconds, peak_bytes = budget(thresholds[result['case']], result['points'])
+    failures = []
+    name = f"{result['case']} at {result['points']} points"
+    if result['seconds'] > seconds:
+        failures.append(f"{name}: {result['seconds']:.3f}s is over {seconds:.3f}s")
+    if result['peak_bytes'] > peak_bytes:
+        failures.append(f"{name}: {result['peak_bytes']} bytes is over {peak_bytes:.0f}")
+    return failures
+
+
+def check_speedup(result, results, thresholds):
+    """Compare a result to the speedup its threshold requires over another case
+
+    A threshold with a speedup entry, e.g.
+    {"speedup": {"over": "grouped", "min": 1.5, "min_points": 1000000, "min_cpus": 4}},
+    requires the case to take at most 1 / min of the time of the other case
+    at the same number of points. It is skipped below min_points, on
+    machines with fewer than min_cpus cores, or if the other case was not run.
+
+    Returns:
+        A list of failure messages, see check
+    """
+    speedup = thresholds.get(result['case'], {}).get('speedup')
+    if speedup is None or result['points'] < speedup.get('min_points', 0):
+        return []
+    if (os.cpu_count() or 1) < speedup.get('min_cpus', 2):
+        return []
+    for other in results:
+        if other['case'] == speedup['over'] and other['points'] == result['points']:
+            ratio = other['seconds'] / max(result['seconds'], 1e-9)
+            if ratio < speedup['min']:
+                return [
+                    f"{result['case']} at {result['points']} points: {ratio:.2f}x "
+                    f"{speedup['over']} is under {speedup['min']}x"
+                    ]
+    return []
+
+
+def sizes(min_points, max_points):
+    size = int(min_points)
+    while size <= max_points:
+        yield size
+        size *= 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-points', type=float, default=1e4)
+    parser.add_argument('--max-points', type=float, default=1e6)
+    parser.add_argument('--max-ingest-points', type=float, default=1e6)
+    parser.add_argument('--points-per-series', type=int, default=1440)
+    parser.add_argument('--good-ratio', type=float, default=0.99)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='case to run, may be repeated. default = every case')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--thresholds', default=None,
+                        help='json file of budgets per case to fail on')
+    parser.add_argument('--output', default=None, help='json file to write results to')
+    args = parser.parse_args()
+
+    thresholds = {}
+    if args.thresholds is not None:
+        with open(args.thresholds) as thresholds_file:
+            thresholds = json.load(thresholds_file)
+
+    results = []
+    failures = []
+    for n_points in sizes(args.min_points, args.max_points):
+        metric = SyntheticMetric.with_points(
+            n_points, args.points_per_series, good_ratio=args.good_ratio, seed=args.seed
+            )
+        for case in args.case or CASES:
+            setup, builds_protobufs = CASES[case]
+            if builds_protobufs and metric.n_points > args.max_ingest_points:
+                continue
+            result = {'case': case, 'points': metric.n_points, 'series': metric.n_series}
+            result.update(measure(setup, metric, args.repeat))
+            print(f"{case:<14}{result['points']:>12} points {result['seconds']:>10.3f}s "
+                  f"{result['peak_bytes'] / 2**20:>10.1f}MiB", flush=True)
+            results.append(result)
+            failures += check(result, thresholds)
+            failures += check_speedup(result, results, thresholds)
+            for server in SERVERS:
+                server.stop()
+            SERVERS.clear()
+            for aggregator in AGGREGATORS:
+                aggregator.shutdown()
+            AGGREGATORS.clear()
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Deterministic synthetic timeseries
+
+SyntheticMetric generates a BOOL metric with a configurable number of
+series, label cardinality, points per series and ratio of good points,
+either as a DataFrame shaped like StackdriverMetricClient.timeseries_dataframe
+or as the TimeSeries protobuf pages the Stackdriver API returns. The same
+seed always gives the same data, and both forms hold the same points.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CARDINALITY = {
+    'resource__project_id': 3,
+    'resource__environment_name': 20,
+    'metric__image_version': 5,
+}
+
+
+class SyntheticMetric():
+    """Synthetic BOOL metric
+
+    Attributes:
+        n_series:           number of series
+        points_per_series:  number of points in each series
+        cardinality:        dictionary of the number of distinct values of each label,
+                            keyed by prepended label name, e.g. resource__project_id
+        good_ratio:         probability of a point being good. default = 0.99
+        seed:               random seed. default = 0
+        end:                end timestamp of the newest points, in seconds since the
+                            epoch. default = 1584627000
+        step:               seconds between points. default = 60
+    """
+
+    def __init__(self, n_series, points_per_series, cardinality=None, good_ratio=0.99, seed=0):
+        self.n_series = n_series
+        self.points_per_series = points_per_series
+        self.cardinality = dict(DEFAULT_CARDINALITY if cardinality is None else cardinality)
+        self.good_ratio = good_ratio
+        self.seed = seed
+        self.end = 1584627000
+        self.step = 60
+        self._label_codes = None
+        self._values = None
+
+    @classmethod
+    def with_points(cls, n_points, points_per_series=1440, **kwargs):
+        """A metric with about n_points points, a day of minutely points per series
+        """
+        points_per_series = min(points_per_series, n_points)
+        return cls(max(n_points // points_per_series, 1), points_per_series, **kwargs)
+
+    @property
+    def n_points(self):
+        return self.n_series * self.points_per_series
+
+    def label_codes(self):
+        """Code of the value of each label for each series
+
+        Returns:
+            A dictionary of int32 numpy arrays, one entry per series, keyed by label
+        """
+        if self._label_codes is None:
+            rng = np.random.default_rng(self.seed)
+            self._label_codes = {
+                label: rng.integers(0, cardinality, self.n_series, dtype=np.int32)
+                for label, cardinality in self.cardinality.items()
+                }
+        return self._label_codes
+
+    def label_values(self, label):
+        """Values of a label, indexed by code
+        """
+        name = label.split('__', 1)[1]
+        return [f'{name}-{code}' for code in range(self.cardinality[label])]
+
+    def values(self):
+        """Point values, series after series, newest point first
+
+        Returns:
+            An int64 numpy array of 0 and 1
+        """
+        if self._values is None:
+            rng = np.random.default_rng(self.seed + 1)
+            self._values = (rng.random(self.n_points) < self.good_ratio).astype(np.int64)
+        return self._values
+
+    def end_seconds(self):
+        """End time of each point in seconds, in the order of values
+        """
+        offsets = np.arange(self.points_per_series, dtype=np.int64) * self.step
+        return np.tile(self.end - offsets, self.n_series)
+
+    def dataframe(self):
+        """The points as a dataframe
+
+        Returns:
+            A dataframe with start_timestamp, end_timestamp and value columns,
+            plus a pandas Categorical column per label.
+        """
+        timestamps = pd.to_datetime(self.end_seconds() * 10**9, unit='ns', utc=True)
+        data = pd.DataFrame({
+            'start_timestamp': timestamps,
+            'end_timestamp': timestamps,
+            'value': self.values()
+            })
+        series_id = np.repeat(
+            np.arange(self.n_series, dtype=np.int32), self.points_per_series
+            )
+        for label, codes in self.label_codes().items():
+            data[label] = pd.Categorical.from_codes(
+                codes[series_id], self.label_values(label)
+                )
+        return data
+
+    def time_series(self):
+        """The points as a list of TimeSeries protobufs, one per series
+
+        Returns:
+            A list of google.cloud.monitoring_v3.types.TimeSeries
+        """
+        from google.cloud import monitoring_v3  # pylint: disable=import-outside-toplevel
+        values = self.values().reshape(self.n_series, self.points_per_series)
+        end_seconds = self.end_seconds()[:self.points_per_series]
+        label_values = {label: self.label_values(label) for label in self.cardinality}
+        time_series = []
+        for series in range(self.n_series):
+            result = monitoring_v3.types.TimeSeries()  # pylint: disable=no-member
+            result.metric_kind = monitoring_v3.enums.MetricDescriptor.MetricKind.GAUGE
+            result.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+            for label, codes in self.label_codes().items():
+                kind, name = label.split('__', 1)
+                labels = result.resource.labels if kind == 'resource' else result.metric.labels
+                labels[name] = label_values[label][codes[series]]
+            for seconds, value in zip(end_seconds, values[series]):
+                point = result.points.add()
+                point.interval.end_time.seconds = int(seconds)
+                point.interval.start_time.seconds = int(seconds)
+                point.value.bool_value = bool(value)
+            time_series.append(result)
+        return time_series
+
+    def pages(self, page_size=100):
+        """The TimeSeries split into pages, as served by the API
+
+        Returns:
+            A list of lists of google.cloud.monitoring_v3.types.TimeSeries
+        """
+        time_series = self.time_series()
+        return [time_series[i:i + page_size] for i in range(0, len(time_series), page_size)]
@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
 # pip install -r requirements.txt
 python setup.py install
-pytest
\ No newline at end of file
+pytest && \
+python benchmarks/import_time.py --max-seconds 2 && \
+python benchmarks/scale.py --max-points 1e5 --thresholds benchmarks/thresholds.json
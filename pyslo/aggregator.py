@@ -0,0 +1,552 @@
+"""Aggregator
+
+Aggregators reduce timeseries metric data to good and valid event counts,
+optionally grouped by label columns. The Aggregator class can be inherited
+by alternative backends, which are plugged into Sli through its aggregator
+attribute.
+
+PartialCounts merges aggregates of successive chunks of data, so a window
+can be reduced without holding all of its points in memory. With max_bytes
+set, the running counts are spilled to disk when they outgrow it.
+
+Currently available:
+    - FactorizedAggregator
+        Default. Factorizes the group by labels into integer group codes once
+        and computes the good and valid counts with bincount reductions.
+    - PandasAggregator
+        A single pandas groupby, kept as a reference implementation.
+    - ParallelAggregator
+        Splits the rows of large frames between a pool of processes, which
+        read the columns from shared memory rather than a pickled copy of
+        the frame, factorize and count their rows, and merges their counts.
+"""
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+
+class Aggregator():
+    """Parent object for aggregation backends.
+
+    Derivatives implement aggregate. The factorize helper is shared so that
+    every backend groups, orders and drops missing labels the same way.
+    """
+
+    # Above this many label combinations group codes could overflow int64
+    MAX_GROUP_CODE = 2**62
+
+    def aggregate(self, data, group_by_labels, value_column='value'):
+        """Count good and valid events per group
+
+        Args:
+            data:               dataframe of timeseries metric data
+            group_by_labels:    list of label columns to group by. May be empty,
+                                in which case a single row is returned.
+            value_column:       the column holding the good event values
+
+        Returns:
+            A dataframe with a column per group by label, plus count_good (sum of
+            value_column) and count_valid (number of non null values).
+            Groups are sorted by label, and groups with a missing label are dropped,
+            in the same way as a pandas groupby.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def factorize(data, group_by_labels):
+        """Map each row of data to an integer group code
+
+        Args:
+            data:               dataframe of timeseries metric data
+            group_by_labels:    list of label columns to group by
+
+        Returns:
+            A tuple of an int64 numpy array holding the group code of each row,
+            -1 where any label is missing, and a dataframe of the label values of
+            each group, in group code order. Groups are sorted by label.
+        """
+        n_rows = data.shape[0]
+        if len(group_by_labels) == 0:
+            return np.zeros(n_rows, dtype=np.int64), pd.DataFrame(index=range(1))
+
+        columns = [Aggregator.factorize_column(data[label]) for label in group_by_labels]
+        shape = [max(len(uniques), 1) for _, uniques in columns]
+        missing = np.zeros(n_rows, dtype=bool)
+        for codes, _ in columns:
+            missing |= codes < 0
+        if np.prod(shape, dtype=float) >= Aggregator.MAX_GROUP_CODE:
+            return Aggregator.factorize_sparse(data, group_by_labels, columns, missing)
+
+        # Combine the per column codes into a single mixed radix code, which
+        # sorts in the same order as the labels.
+        group_codes = np.zeros(n_rows, dtype=np.int64)
+        for (codes, _), size in zip(columns, shape):
+            group_codes *= size
+            group_codes += codes
+        group_codes[missing] = -1
+
+        n_groups = int(np.prod(shape, dtype=np.int64))
+        if n_groups <= 4 * n_rows:
+            occupied = np.bincount(group_codes + 1, minlength=n_groups + 1)[1:]
+            present = np.flatnonzero(occupied)
+            lookup = np.full(n_groups + 1, -1, dtype=np.int64)
+            lookup[present + 1] = np.arange(len(present))
+            group_codes = lookup[group_codes + 1]
+        else:
+            present = np.unique(group_codes[~missing])
+            valid = ~missing
+            group_codes[valid] = np.searchsorted(present, group_codes[valid])
+
+        label_codes = np.unravel_index(present, shape)
+        keys = pd.DataFrame({
+            label: np.asarray(uniques.take(codes))
+            for label, (_, uniques), codes in zip(group_by_labels, columns, label_codes)
+            })
+        return group_codes, keys
+
+    @staticmethod
+    def factorize_sparse(data, group_by_labels, columns, missing):
+        """Factorize when the combined code space could overflow int64
+
+        Combined codes are compressed with pandas.factorize after each column,
+        and the label values are read from the first row of each group.
+        """
+        group_codes = np.zeros(data.shape[0], dtype=np.int64)
+        for codes, uniques in columns:
+            group_codes, _ = pd.factorize(group_codes, sort=True)
+            group_codes = group_codes.astype(np.int64) * max(len(uniques), 1) + codes
+        group_codes[missing] = -1
+
+        # Factorize in order of appearance so the first row of each group is cheap
+        # to find, then renumber the groups in sorted order.
+        codes, uniques = pd.factorize(group_codes)
+        running_max = np.maximum.accumulate(codes)
+        first_rows = np.flatnonzero(np.concatenate(([True], running_max[1:] > running_max[:-1])))
+        order = np.argsort(uniques, kind='stable')
+        order = order[uniques[order] >= 0]
+        rank = np.full(len(uniques), -1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        first_rows = first_rows[order]
+
+        keys = pd.DataFrame({
+            label: np.asarray(uniques.take(label_codes[first_rows]))
+            for label, (label_codes, uniques) in zip(group_by_labels, columns)
+            })
+        return rank[codes], keys
+
+    @staticmethod
+    def factorize_column(column):
+        """Integer codes for a single label column
+
+        Categorical columns use their existing codes, other columns are
+        factorized with sorted codes.
+
+        Args:
+            column: pandas series
+
+        Returns:
+            A tuple of the codes, -1 for missing values, and a pandas Index of
+            the label value of each code.
+        """
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            return column.cat.codes.to_numpy().astype(np.int64), column.cat.categories
+        codes, uniques = pd.factorize(column, sort=True)
+        return codes.astype(np.int64), pd.Index(uniques)
+
+    @staticmethod
+    def counts_frame(keys, count_good, count_valid, value_dtype):
+        """Assemble the aggregate dataframe from the group keys and counts
+
+        Args:
+            keys:           dataframe of group label values
+            count_good:     array of good event counts per group
+            count_valid:    array of valid event counts per group
+            value_dtype:    dtype of the value column that was summed. Integer and
+                            boolean sums are returned as int64.
+
+        Returns:
+            A dataframe of the keys with count_good and count_valid columns.
+        """
+        if pd.api.types.is_integer_dtype(value_dtype) or pd.api.types.is_bool_dtype(value_dtype):
+            count_good = np.rint(count_good).astype(np.int64)
+        slo_data = keys.copy()
+        slo_data['count_good'] = count_good
+        slo_data['count_valid'] = np.asarray(count_valid, dtype=np.int64)
+        return slo_data
+
+
+class FactorizedAggregator(Aggregator):
+    """Single pass aggregation using factorized group codes and bincount
+    """
+
+    def aggregate(self, data, group_by_labels, value_column='value'):
+        """Count good and valid events per group, see Aggregator.aggregate
+        """
+        group_codes, keys = self.factorize(data, group_by_labels)
+        count_good, count_valid = self.reduce(
+            group_codes, data[value_column].to_numpy(), keys.shape[0]
+            )
+        return self.counts_frame(keys, count_good, count_valid, data[value_column].dtype)
+
+    @staticmethod
+    def reduce(group_codes, values, n_groups):
+        """Sum and count values per group code
+
+        Args:
+            group_codes:    int64 array of group codes, -1 for rows in no group
+            values:         numpy array of values
+            n_groups:       number of groups
+
+        Returns:
+            A tuple of float64 sums and int64 counts of non null values, per group.
+        """
+        # Shift codes by one so rows in no group land in bin 0 and are sliced off
+        bins = group_codes + 1
+        values = values.astype(np.float64, copy=False)
+        not_null = ~np.isnan(values)
+        if not not_null.all():
+            bins = np.where(not_null, bins, 0)
+            values = np.where(not_null, values, 0)
+        count_good = np.bincount(bins, weights=values, minlength=n_groups + 1)[1:]
+        count_valid = np.bincount(bins, minlength=n_groups + 1)[1:]
+        return count_good, count_valid
+
+
+class PandasAggregator(Aggregator):
+    """Aggregation using a single pandas groupby
+    """
+
+    def aggregate(self, data, group_by_labels, value_column='value'):
+        """Count good and valid events per group, see Aggregator.aggregate
+        """
+        if len(group_by_labels) == 0:
+            values = data[value_column]
+            return self.counts_frame(
+                pd.DataFrame(index=range(1)), [values.sum()], [values.count()], values.dtype
+                )
+        # Categorical columns are grouped on their codes, so empty categories
+        # are not listed and groups come out sorted in category order.
+        group_keys = [
+            data[label].cat.codes.rename(label)
+            if isinstance(data[label].dtype, pd.CategoricalDtype) else data[label]
+            for label in group_by_labels
+            ]
+        counts = data[value_column].groupby(group_keys, sort=True).agg(
+            ['sum', 'count']
+            ).reset_index()
+        categorical = [
+            label for label in group_by_labels
+            if isinstance(data[label].dtype, pd.CategoricalDtype)
+            ]
+        counts = counts[~(counts[categorical] < 0).any(axis=1)]
+        keys = pd.DataFrame({
+            label: np.asarray(data[label].cat.categories.take(counts[label].to_numpy()))
+            if label in categorical else counts[label].to_numpy()
+            for label in group_by_labels
+            })
+        return self.counts_frame(
+            keys, counts['sum'].to_numpy(), counts['count'].to_numpy(), data[value_column].dtype
+            )
+
+
+def share_column(column, memories):
+    """Describe a column so that worker processes can read a row range of it
+
+    Numpy columns, and the codes of Categorical columns, are copied into
+    shared memory at their own width. Other columns, e.g. of strings, are
+    sliced and pickled to each worker.
+
+    Args:
+        column:     pandas series
+        memories:   list the SharedMemory created is appended to, for the
+                    caller to unlink
+
+    Returns:
+        A tuple of the shared memory name, or None, the array if not shared,
+        and the categories of a Categorical column, or None
+    """
+    categories = None
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        array, categories = column.cat.codes.to_numpy(), column.cat.categories
+    else:
+        array = column.to_numpy()
+    if array.dtype.kind not in 'biufmM':
+        return None, array, categories
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    memories.append(memory)
+    np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf), array)
+    return memory.name, (array.shape, array.dtype), categories
+
+
+def aggregate_shared(columns, group_by_labels, value_column, start, stop):
+    """Count good and valid events per group in a row range of shared columns
+
+    Run by the worker processes of ParallelAggregator, which factorize the
+    labels of their own rows.
+
+    Args:
+        columns:            dict of column name to the description returned by
+                            share_column, with unshared arrays already sliced
+        group_by_labels:    list of label columns to group by
+        value_column:       the column holding the good event values
+        start:              first row of the range
+        stop:               row after the last of the range
+
+    Returns:
+        A tuple of a dataframe of the label values of each group in the range,
+        and the float64 sums and int64 counts of non null values per group
+    """
+    memories = []
+    try:
+        data = {}
+        for name, (memory_name, array, categories) in columns.items():
+            if memory_name is not None:
+                memories.append(shared_memory.SharedMemory(name=memory_name))
+                shape, dtype = array
+                array = np.ndarray(shape, dtype=dtype, buffer=memories[-1].buf)[start:stop]
+            if categories is not None:
+                array = pd.Categorical.from_codes(array, categories)
+            data[name] = array
+        data = pd.DataFrame(data, copy=False)
+        group_codes, keys = Aggregator.factorize(data, group_by_labels)
+        count_good, count_valid = FactorizedAggregator.reduce(
+            group_codes, data[value_column].to_numpy(), keys.shape[0]
+            )
+        del data
+        return keys, count_good, count_valid
+    finally:
+        for memory in memories:
+            memory.close()
+
+
+class ParallelAggregator(Aggregator):
+    """Aggregation split by row range across a pool of processes
+
+    The label and value columns are shared with the workers, without
+    converting them, see share_column. Each worker factorizes and reduces
+    a row range, as FactorizedAggregator does, and the groups found by
+    the workers are merged by label value. Frames smaller than min_rows
+    are aggregated by FactorizedAggregator in the calling process.
+
+    Counts are the same as FactorizedAggregator's, though sums of
+    non integer values may differ in rounding as they are added in a
+    different order.
+
+    Attributes:
+        processes:  number of worker processes. default = os.cpu_count()
+        min_rows:   frames with fewer rows are not split. default = 10**6
+    """
+
+    def __init__(self, processes=None, min_rows=10**6):
+        self.processes = processes or os.cpu_count()
+        self.min_rows = min_rows
+        self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    @property
+    def executor(self):
+        """Pool of worker processes, started on first use
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    def shutdown(self):
+        """Stop the worker processes
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def aggregate(self, data, group_by_labels, value_column='value'):
+        """Count good and valid events per group, see Aggregator.aggregate
+        """
+        n_rows = data.shape[0]
+        if n_rows == 0 or n_rows < self.min_rows or self.processes < 2:
+            return FactorizedAggregator().aggregate(data, group_by_labels, value_column)
+
+        memories = []
+        try:
+            columns = {
+                name: share_column(data[name], memories)
+                for name in list(group_by_labels) + [value_column]
+                }
+            edges = np.linspace(0, n_rows, self.processes + 1).astype(np.int64)
+            tasks = []
+            for start, stop in zip(edges[:-1], edges[1:]):
+                if stop > start:
+                    task_columns = {
+                        name: (memory_name, array if memory_name else array[start:stop], categories)
+                        for name, (memory_name, array, categories) in columns.items()
+                        }
+                    tasks.append((task_columns, group_by_labels, value_column, int(start), int(stop)))
+            partials = list(self.executor.map(aggregate_shared, *zip(*tasks)))
+        finally:
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+
+        # Groups are merged by label value, restoring the categories of
+        # Categorical labels so that they sort in category order.
+        keys = pd.concat([keys for keys, _, _ in partials], ignore_index=True)
+        for label in group_by_labels:
+            if isinstance(data[label].dtype, pd.CategoricalDtype):
+                keys[label] = pd.Categorical(keys[label], categories=data[label].cat.categories)
+        group_codes, keys = self.factorize(keys, group_by_labels)
+        count_good = np.bincount(
+            group_codes, weights=np.concatenate([good for _, good, _ in partials]),
+            minlength=keys.shape[0]
+            )
+        count_valid = np.bincount(
+            group_codes, weights=np.concatenate([valid for _, _, valid in partials]),
+            minlength=keys.shape[0]
+            )
+        return self.counts_frame(
+            keys, count_good, np.rint(count_valid), data[value_column].dtype
+            )
+
+
+class PartialCounts():
+    """Running good and valid counts per group
+
+    Aggregates of successive chunks of metric data are merged as they
+    arrive, so memory grows with the number of groups rather than the
+    number of points.
+
+    If max_bytes is set and the merged counts grow beyond it, they are
+    hash partitioned by group and each partition appended to its own file
+    under spill_path. result then merges one partition at a time, so only
+    the final counts and the spills of a single partition are held at once.
+
+    Attributes:
+        group_by_labels:    list of label columns the partial aggregates are grouped by
+        counts:             dataframe of the merged counts not yet spilled, None until
+                            the first update
+        max_bytes:          Optional. Size of counts, as reported by
+                            DataFrame.memory_usage(deep=True), above which they are
+                            spilled. default = None, never spill
+        spill_path:         Optional. Directory in which a temporary spill directory
+                            is created. default = None, the system temporary directory
+        partitions:         number of files the spilled groups are hashed into.
+                            default = 16
+        spills:             number of times counts were spilled
+    """
+
+    def __init__(self, group_by_labels, max_bytes=None, spill_path=None, partitions=16):
+        self.group_by_labels = group_by_labels
+        self.counts = None
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.partitions = partitions
+        self.spills = 0
+        self._spill_dir = None
+
+    def update(self, partial):
+        """Merge a partial aggregate into the running counts
+
+        Args:
+            partial: dataframe with a column per group by label, plus count_good
+                     and count_valid, as returned by Aggregator.aggregate
+
+        Returns:
+            The merged counts
+        """
+        if self.counts is None:
+            self.counts = partial
+        else:
+            self.counts = PartialCounts.merge(
+                [self.counts, partial], self.group_by_labels
+                )
+        if self.max_bytes is not None and len(self.group_by_labels) > 0 and \
+                self.counts.memory_usage(deep=True).sum() > self.max_bytes:
+            self.spill()
+        return self.counts
+
+    def partition(self, counts):
+        """Split counts into partitions by a hash of their group labels
+
+        Args:
+            counts: dataframe of counts
+
+        Returns:
+            A list of dataframes, one per partition
+        """
+        hashes = pd.util.hash_pandas_object(counts[self.group_by_labels], index=False)
+        partition = hashes.to_numpy() % np.uint64(self.partitions)
+        return [counts[partition == i] for i in range(self.partitions)]
+
+    def spill(self):
+        """Append the running counts to the partition files and clear them
+        """
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='pyslo-', dir=self.spill_path)
+        for i, partition in enumerate(self.partition(self.counts)):
+            if partition.shape[0] > 0:
+                partition.to_pickle(os.path.join(self._spill_dir, f'{i}-{self.spills}.pkl'))
+        self.spills += 1
+        self.counts = None
+
+    def result(self):
+        """The merged counts, including any spilled to disk
+
+        Spill files are deleted once read.
+
+        Returns:
+            A dataframe of the summed counts, sorted by group, or None if
+            nothing was counted
+        """
+        if self._spill_dir is None:
+            return self.counts
+        in_memory = [None] * self.partitions
+        if self.counts is not None:
+            in_memory = self.partition(self.counts)
+        try:
+            results = []
+            for i in range(self.partitions):
+                partials = [
+                    pd.read_pickle(os.path.join(self._spill_dir, f'{i}-{spill}.pkl'))
+                    for spill in range(self.spills)
+                    if os.path.exists(os.path.join(self._spill_dir, f'{i}-{spill}.pkl'))
+                    ]
+                if in_memory[i] is not None:
+                    partials.append(in_memory[i])
+                if len(partials) > 0:
+                    results.append(PartialCounts.merge(partials, self.group_by_labels))
+        finally:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+            self.spills = 0
+        self.counts = PartialCounts.merge(results, self.group_by_labels)
+        return self.counts
+
+    @staticmethod
+    def merge(partials, group_by_labels):
+        """Sum the counts of several partial aggregates by group
+
+        Args:
+            partials:           list of dataframes as returned by Aggregator.aggregate
+            group_by_labels:    list of label columns the partials are grouped by
+
+        Returns:
+            A dataframe of the summed counts, sorted by group.
+        """
+        data = pd.concat(partials, ignore_index=True)
+        group_codes, keys = Aggregator.factorize(data, group_by_labels)
+        bins = group_codes + 1
+        n_bins = keys.shape[0] + 1
+        count_good = np.bincount(
+            bins, weights=data['count_good'].to_numpy(np.float64), minlength=n_bins)[1:]
+        count_valid = np.bincount(
+            bins, weights=data['count_valid'].to_numpy(np.float64), minlength=n_bins)[1:]
+        return Aggregator.counts_frame(
+            keys, count_good, np.rint(count_valid), data['count_good'].dtype
+            )
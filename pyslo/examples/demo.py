@@ -1,4 +1,4 @@
-from google.cloud import monitoring_v3
+from pyslo.metric_client import ValueType
 from pyslo.metric_client.stackdriver import StackdriverMetricClient
 from pyslo.sli import Sli
 
@@ -7,7 +7,7 @@ PROJECT = '<MY_GCP_PROJECT>'
 metric_client = StackdriverMetricClient(project=PROJECT)
 metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
 metric_client.resource_type = 'cloud_composer_environment'
-metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+metric_client.value_type = ValueType.BOOL
 
 sli = Sli(metric_client)
 
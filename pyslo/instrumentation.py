@@ -0,0 +1,276 @@
+"""Instrumentation
+
+Timed spans and counters for the stages of fetching and calculating an
+SLI, so that a slow run can be attributed to the API, decoding, dataframe
+construction or aggregation. An Instrumentation is attached through the
+instrumentation attribute of MetricClient, to every client or to one, and
+of Sli.
+
+Spans emitted:
+    - timeseries_dataframe
+        A period fetched by a metric client, counting rows. Stackdriver
+        fetches nest api, decode and frame spans, counting pages, series,
+        points and bytes of TimeSeries.
+    - get_metric_data, calculate, calculate_streaming, calculate_chunked,
+      calculate_rollup, calculate_aligned, calculate_lattice, aggregate
+        Sli stages, counting rows and groups.
+
+Currently available:
+    - Instrumentation
+        Default. Does nothing, and costs an attribute lookup and a method call
+        per stage.
+    - CallbackInstrumentation
+        Calls a function with each finished Span, optionally with the peak
+        memory allocated during the span.
+    - OpenTelemetryInstrumentation
+        Records spans with an OpenTelemetry tracer. Requires::
+
+            pip install opentelemetry-api
+
+Typical usage example::
+
+    from pyslo.instrumentation import CallbackInstrumentation
+
+    MetricClient.instrumentation = CallbackInstrumentation(print, trace_memory=True)
+"""
+
+import time
+import threading
+import tracemalloc
+
+
+def require_opentelemetry():
+    """Import opentelemetry.trace
+
+    Returns:
+        The opentelemetry.trace module
+
+    Raises:
+        ImportError if opentelemetry-api is not installed
+    """
+    try:
+        from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise ImportError(
+            "opentelemetry-api is required: pip install opentelemetry-api"
+            ) from error
+    return trace
+
+
+class NullSpan():
+    """Span of an Instrumentation that records nothing
+
+    Attributes:
+        recording:  False, so that counters which are costly to compute, e.g.
+                    serialized sizes, can be skipped
+    """
+
+    recording = False
+
+    def count(self, name, value=1):
+        """Ignore a counter
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span():
+    """A timed stage and its counters
+
+    Attributes:
+        name:           name of the stage, e.g. decode
+        attributes:     dict of attributes given when the span was started
+        counters:       dict of counter values, e.g. {'series': 5, 'points': 600}
+        start:          time.perf_counter() when the span was entered
+        duration:       seconds between entering and leaving the span
+        peak_bytes:     peak bytes traced by tracemalloc during the span, above
+                        those traced when it started, if the instrumentation
+                        traces memory, else None
+        recording:      True
+    """
+
+    recording = True
+
+    def __init__(self, instrumentation, name, attributes):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.attributes = attributes
+        self.counters = dict()
+        self.start = None
+        self.duration = None
+        self.peak_bytes = None
+        self.start_bytes = None
+        self.context = None
+
+    def count(self, name, value=1):
+        """Add to a counter
+
+        Args:
+            name:   name of the counter, e.g. rows
+            value:  Optional. amount added. default = 1
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        self.instrumentation.on_start(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.perf_counter() - self.start
+        self.instrumentation.on_end(self)
+        return False
+
+    def __repr__(self):
+        return (
+            f'Span(name={self.name!r}, duration={self.duration}, '
+            f'counters={self.counters}, peak_bytes={self.peak_bytes})'
+            )
+
+
+class Instrumentation():
+    """Parent object of instrumentation backends, which records nothing
+
+    Derivatives set enabled and implement on_start and on_end.
+
+    Attributes:
+        enabled:    if False, span returns NULL_SPAN. default = False
+    """
+
+    enabled = False
+
+    def span(self, name, **attributes):
+        """A context manager timing a stage
+
+        Args:
+            name:       name of the stage
+            attributes: attributes of the stage, e.g. client='StackdriverMetricClient'
+
+        Returns:
+            A Span, or NULL_SPAN if not enabled
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def on_start(self, span):
+        """Called when a span is entered
+        """
+
+    def on_end(self, span):
+        """Called when a span is left, with its duration and counters set
+        """
+
+
+class CallbackInstrumentation(Instrumentation):
+    """Calls a function with each finished Span
+
+    Nested spans finish, and are passed to callback, before their parent.
+
+    Attributes:
+        callback:       function taking a Span
+        trace_memory:   if True, the peak bytes allocated during each span, above
+                        those allocated when it started, are measured with
+                        tracemalloc. If tracemalloc is not already tracing it is
+                        started when a span opens and stopped when the last open
+                        span ends. Peaks are process wide, so include allocations
+                        of other threads, and tracing slows allocations down.
+                        Measuring needs tracemalloc.reset_peak, new in Python 3.9,
+                        so on older versions memory is not traced and peak_bytes
+                        stays None. default = False
+    """
+
+    enabled = True
+
+    def __init__(self, callback, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self._open = []
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    def traces_memory(self):
+        """True if the peak memory of spans is measured
+
+        Without tracemalloc.reset_peak every span would report the highest
+        peak since tracing started, so memory is only traced if it exists.
+        """
+        return self.trace_memory and hasattr(tracemalloc, 'reset_peak')
+
+    def on_start(self, span):
+        if not self.traces_memory():
+            return
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            current, _ = self.reset_peak()
+            span.start_bytes = current
+            span.peak_bytes = 0
+            self._open.append(span)
+
+    def on_end(self, span):
+        if self.traces_memory():
+            with self._lock:
+                self.reset_peak()
+                self._open.remove(span)
+                if not self._open and self._started_tracing:
+                    tracemalloc.stop()
+                    self._started_tracing = False
+        self.callback(span)
+
+    def reset_peak(self):
+        """Fold the traced peak into the open spans and start a new peak
+
+        tracemalloc has a single peak, so it is reset whenever a span starts
+        or ends, and each open span keeps the highest peak seen since it
+        started, less the bytes traced when it started.
+
+        Returns:
+            The current and peak traced bytes before the reset
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for span in self._open:
+            span.peak_bytes = max(span.peak_bytes, peak - span.start_bytes)
+        tracemalloc.reset_peak()
+        return current, peak
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """Records spans with an OpenTelemetry tracer
+
+    Each Span becomes an OpenTelemetry span, current while it is open so
+    that nested stages are its children, with the counters set as
+    attributes when it ends.
+
+    Attributes:
+        tracer:     an opentelemetry.trace.Tracer. default = the tracer named
+                    pyslo of the global tracer provider
+
+    Raises:
+        ImportError if opentelemetry-api is not installed
+    """
+
+    enabled = True
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            tracer = require_opentelemetry().get_tracer('pyslo')
+        self.tracer = tracer
+
+    def on_start(self, span):
+        span.context = self.tracer.start_as_current_span(span.name, attributes=span.attributes)
+        span.context.__enter__()  # pylint: disable=no-member
+
+    def on_end(self, span):
+        current = require_opentelemetry().get_current_span()
+        for name, value in span.counters.items():
+            current.set_attribute(name, value)
+        span.context.__exit__(None, None, None)
@@ -1,3 +1,10 @@
 # pylint: disable=missing-module-docstring
 
 from .metric_client import *
+
+
+def __getattr__(name):
+    if name == 'MetricDescriptor':
+        from . import metric_client  # pylint: disable=import-outside-toplevel
+        return metric_client.MetricDescriptor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,481 @@
+"""Metric client caches
+
+ResultCache is an in-process, memory bounded LRU cache of dataframes with a
+time to live. Assigning one to MetricClient.result_cache shares it between
+every metric client, or it can be assigned to individual clients.
+
+DiskCacheMetricClient wraps another MetricClient and keeps the points it
+has fetched on local disk as parquet files, one per cache key and day. Later calls
+only fetch the parts of the requested period that are not already covered,
+plus a margin for points that arrive late.
+
+Parquet support requires pyarrow, which can be installed with::
+
+    pip install pyslo[parquet]
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import pandas as pd
+from .metric_client import MetricClient
+from .metric_client import NoMetricDataAvailable
+
+
+def require_parquet():
+    """Check that a parquet engine is installed
+
+    Raises:
+        ImportError if pyarrow is not installed
+    """
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError as error:
+        raise ImportError(
+            "pyarrow is required for parquet storage: pip install pyslo[parquet]"
+            ) from error
+
+
+class ResultCache():
+    """Memory bounded LRU cache of dataframes with a time to live
+
+    Concurrent requests for a key that is being fetched wait for that fetch
+    rather than fetching again.
+
+    Attributes:
+        max_bytes:      total size in bytes of the cached dataframes, as reported
+                        by DataFrame.memory_usage, above which the least recently
+                        used are evicted. default = 256MB
+        ttl:            seconds a cached dataframe is served for. default = 300
+        clock:          function returning the current time in seconds.
+                        default = time.monotonic
+        hits:           number of requests served from the cache, including those
+                        that waited for an in-flight fetch
+        misses:         number of requests that had to fetch
+        total_bytes:    current size of the cached dataframes
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = time.monotonic
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, fetch):
+        """Return the dataframe cached for key, calling fetch on a miss
+
+        Args:
+            key:    hashable cache key
+            fetch:  function with no arguments returning a dataframe
+
+        Returns:
+            A shallow copy of the cached dataframe, so columns can be added or
+            replaced without changing the cached one.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0].copy(deep=False)
+            if entry is not None:
+                self.evict(key)
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not owner:
+            return future.result().copy(deep=False)
+
+        try:
+            data = fetch()
+        except Exception as error:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            self.put(key, data)
+        future.set_result(data)
+        return data.copy(deep=False)
+
+    def put(self, key, data):
+        """Add a dataframe and evict the least recently used above max_bytes
+
+        Must be called with the lock held. Dataframes larger than max_bytes
+        are not cached.
+        """
+        n_bytes = int(data.memory_usage(index=True, deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.evict(key)
+        self._entries[key] = (data, n_bytes, self.clock() + self.ttl)
+        self.total_bytes += n_bytes
+        while self.total_bytes > self.max_bytes:
+            self.evict(next(iter(self._entries)))
+
+    def evict(self, key):
+        """Remove a key. Must be called with the lock held.
+        """
+        _, n_bytes, _ = self._entries.pop(key)
+        self.total_bytes -= n_bytes
+
+    def clear(self):
+        """Remove every cached dataframe and reset the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class DiskCacheMetricClient(MetricClient):
+    """Persistent on-disk cache around another metric client
+
+    Points are stored per cache key of the wrapped client, e.g. the project,
+    filter string and value type for a StackdriverMetricClient, in a
+    directory holding a parquet file per UTC day of point end times.
+    Alongside the points the cache records which intervals have been
+    fetched and when. A fetched interval is trusted up to refetch_margin
+    seconds before the time it was fetched, so points that are written late
+    by the backend are picked up by the next call.
+
+    Only the days overlapping a requested period are read, and only the
+    days overlapping a fetched interval are written. Periods are half open,
+    holding the points that end after their start and up to and including
+    their end.
+
+    Attributes:
+        metric_client:      the MetricClient whose results are cached
+        path:               directory the cache files are written to
+        refetch_margin:     seconds before the fetch time of an interval that are
+                            fetched again. default = 300
+        retention:          Optional. seconds of points kept before the current
+                            time. Older days are deleted when the cache is written.
+                            default = None, points are kept
+        clock:              function returning the current time in seconds since
+                            the epoch. default = time.time
+    """
+
+    DAY = 86400
+
+    def __init__(self, metric_client, path, refetch_margin=300, retention=None):
+        require_parquet()
+        self.metric_client = metric_client
+        self.path = path
+        self.refetch_margin = refetch_margin
+        self.retention = retention
+        self.clock = time.time
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def value_type(self):
+        return self.metric_client.value_type
+
+    @value_type.setter
+    def value_type(self, value_type):
+        self.metric_client.value_type = value_type
+
+    def cache_key(self):
+        return self.metric_client.cache_key()
+
+    def preflight(self, end, end_nanos=0, duration=3600):
+        return self.metric_client.preflight(end=end, end_nanos=end_nanos, duration=duration)
+
+    def cache_dir(self):
+        """Directory of the day files and coverage for the current cache key
+
+        Returns:
+            The directory path, created if missing
+
+        Raises:
+            ValueError if the wrapped client cannot be cached
+        """
+        key = self.cache_key()
+        if key is None:
+            raise ValueError(f"{type(self.metric_client).__name__} does not provide a cache_key")
+        directory = os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest())
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    @staticmethod
+    def days(start, end):
+        """Days holding the points of a period
+
+        Args:
+            start:  start of the period in seconds since the epoch
+            end:    end of the period in seconds since the epoch
+
+        Returns:
+            A range of days since the epoch
+        """
+        return range(
+            int(start // DiskCacheMetricClient.DAY), int(end // DiskCacheMetricClient.DAY) + 1
+            )
+
+    @staticmethod
+    def point_days(data):
+        """Day since the epoch of the end time of each point
+
+        Args:
+            data: dataframe of points
+
+        Returns:
+            An int64 pandas series
+        """
+        epoch = pd.Timestamp(0, unit='s', tz='UTC')
+        return (data['end_timestamp'] - epoch) // pd.Timedelta(days=1)
+
+    def day_path(self, day):
+        """Path of the parquet file of a day
+
+        Args:
+            day: day since the epoch
+
+        Returns:
+            A path in cache_dir named after the date, e.g. 2020-03-19.parquet
+        """
+        date = pd.Timestamp(day * DiskCacheMetricClient.DAY, unit='s').strftime('%Y-%m-%d')
+        return os.path.join(self.cache_dir(), f'{date}.parquet')
+
+    def load_coverage(self):
+        """Load the list of [start, end, fetched_at] intervals cached
+        """
+        coverage_path = os.path.join(self.cache_dir(), 'coverage.json')
+        if not os.path.exists(coverage_path):
+            return []
+        with open(coverage_path) as coverage_file:
+            return json.load(coverage_file)['coverage']
+
+    def load(self, start, end):
+        """Load the cached points of the days overlapping a period
+
+        Args:
+            start:  start of the period in seconds since the epoch
+            end:    end of the period in seconds since the epoch
+
+        Returns:
+            A dataframe of every point of those days, or None if none are cached
+        """
+        paths = [self.day_path(day) for day in DiskCacheMetricClient.days(start, end)]
+        frames = [pd.read_parquet(path) for path in paths if os.path.exists(path)]
+        if len(frames) == 0:
+            return None
+        return self.concat_frames(frames)
+
+    def save(self, data, coverage, start, end):
+        """Write the days overlapping a period and the coverage
+
+        data must hold every cached point of those days, as returned by load.
+        Days without points have their file removed. Days and coverage older
+        than retention are deleted.
+
+        Args:
+            data:       dataframe of points, or None
+            coverage:   list of [start, end, fetched_at] coverage intervals
+            start:      start of the period in seconds since the epoch
+            end:        end of the period in seconds since the epoch
+        """
+        days = DiskCacheMetricClient.days(start, end)
+        point_days = None if data is None else DiskCacheMetricClient.point_days(data)
+        for day in days:
+            path = self.day_path(day)
+            in_day = None if data is None else data[(point_days == day).to_numpy()]
+            if in_day is not None and in_day.shape[0] > 0:
+                in_day.to_parquet(path, index=False)
+            elif os.path.exists(path):
+                os.remove(path)
+        if self.retention is not None:
+            coverage = self.prune(coverage, self.clock() - self.retention)
+        with open(os.path.join(self.cache_dir(), 'coverage.json'), 'w') as coverage_file:
+            json.dump({'key': self.cache_key(), 'coverage': coverage}, coverage_file)
+
+    def prune(self, coverage, cutoff):
+        """Delete the day files before the day of cutoff, and their coverage
+
+        Args:
+            coverage:   list of [start, end, fetched_at] coverage intervals
+            cutoff:     time in seconds since the epoch
+
+        Returns:
+            The coverage of the days kept
+        """
+        first_day = int(cutoff // DiskCacheMetricClient.DAY)
+        for name in os.listdir(self.cache_dir()):
+            if not name.endswith('.parquet'):
+                continue
+            date = pd.Timestamp(name[:-len('.parquet')], tz='UTC')
+            if date.value // (DiskCacheMetricClient.DAY * 10**9) < first_day:
+                os.remove(os.path.join(self.cache_dir(), name))
+        first = first_day * DiskCacheMetricClient.DAY
+        return [
+            [max(c_start, first), c_end, c_fetched]
+            for c_start, c_end, c_fetched in coverage if c_end > first
+            ]
+
+    def timeseries_dataframe(self, end, end_nanos=0, duration=3600):
+        """Return the period from the cache, fetching only what is missing
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period to retrieve in seconds
+
+        Returns:
+            A pandas dataframe of the points whose end_timestamp is after the
+            start of the period and up to and including its end
+        """
+        end = end + end_nanos / 10**9
+        start = end - duration
+        coverage = self.load_coverage()
+        data = self.load(start, end)
+        fetched_at = self.clock()
+        trusted = [
+            [c_start, min(c_end, c_fetched - self.refetch_margin)]
+            for c_start, c_end, c_fetched in coverage
+            ]
+        gaps = DiskCacheMetricClient.gaps(start, end, trusted)
+        for gap_start, gap_end in gaps:
+            data = self.fetch_gap(data, gap_start, gap_end)
+            coverage = DiskCacheMetricClient.add_coverage(
+                coverage, [gap_start, gap_end, fetched_at], self.refetch_margin
+                )
+        if len(gaps) > 0:
+            self.save(data, coverage, gaps[0][0], gaps[-1][1])
+
+        if data is None:
+            raise NoMetricDataAvailable
+        window = DiskCacheMetricClient.within(data, start, end)
+        if not window.any():
+            raise NoMetricDataAvailable
+        return data[window].reset_index(drop=True)
+
+    @staticmethod
+    def within(data, start, end):
+        """Mask of the points ending after start and up to and including end
+
+        Args:
+            data:   dataframe of points
+            start:  start of the period in seconds since the epoch
+            end:    end of the period in seconds since the epoch
+
+        Returns:
+            A boolean numpy array
+        """
+        lower = pd.Timestamp(start, unit='s', tz='UTC')
+        upper = pd.Timestamp(end, unit='s', tz='UTC')
+        return ((data['end_timestamp'] > lower) & (data['end_timestamp'] <= upper)).to_numpy()
+
+    def fetch_gap(self, data, gap_start, gap_end):
+        """Fetch an interval from the wrapped client and merge it into data
+
+        Cached points ending within (gap_start, gap_end] are replaced by the
+        fetched points, so refetched points are not duplicated.
+
+        Args:
+            data:       dataframe of cached points, or None
+            gap_start:  start of the interval in seconds since the epoch
+            gap_end:    end of the interval in seconds since the epoch
+
+        Returns:
+            The merged dataframe, or None if there are still no points
+        """
+        seconds = int(gap_end)
+        nanos = int(round((gap_end - seconds) * 10**9))
+        try:
+            fetched = self.metric_client.timeseries_dataframe(
+                end=seconds, end_nanos=nanos, duration=gap_end - gap_start
+                )
+        except NoMetricDataAvailable:
+            fetched = None
+        frames = []
+        if data is not None:
+            frames.append(data[~DiskCacheMetricClient.within(data, gap_start, gap_end)])
+        if fetched is not None:
+            frames.append(fetched[DiskCacheMetricClient.within(fetched, gap_start, gap_end)])
+        frames = [frame for frame in frames if frame.shape[0] > 0]
+        if len(frames) == 0:
+            return None
+        return self.concat_frames(frames)
+
+    @staticmethod
+    def gaps(start, end, covered):
+        """The parts of [start, end] not covered by any interval
+
+        Args:
+            start:      start of the period
+            end:        end of the period
+            covered:    list of [start, end] intervals
+
+        Returns:
+            A list of [start, end] intervals, in time order
+        """
+        gaps = []
+        cursor = start
+        for c_start, c_end in sorted(covered):
+            if c_end <= cursor:
+                continue
+            if c_start > cursor:
+                gaps.append([cursor, min(c_start, end)])
+            cursor = max(cursor, c_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append([cursor, end])
+        return [gap for gap in gaps if gap[1] > gap[0]]
+
+    @staticmethod
+    def add_coverage(coverage, interval, margin=0):
+        """Add a fetched interval to the coverage list
+
+        Existing intervals are clipped where the new interval overlaps them.
+        Adjacent intervals that are both settled, i.e. fetched at least margin
+        seconds after their end, are merged.
+
+        Args:
+            coverage:   list of [start, end, fetched_at] intervals
+            interval:   [start, end, fetched_at] of the new interval
+            margin:     Optional. The refetch margin in seconds. default = 0
+
+        Returns:
+            A new list of [start, end, fetched_at] intervals sorted by start
+        """
+        start, end, _ = interval
+        clipped = []
+        for c_start, c_end, c_fetched in coverage:
+            if c_start < start:
+                clipped.append([c_start, min(c_end, start), c_fetched])
+            if c_end > end:
+                clipped.append([max(c_start, end), c_end, c_fetched])
+        clipped = [c for c in clipped if c[1] > c[0]] + [list(interval)]
+        clipped.sort()
+
+        merged = [clipped[0]]
+        for c_start, c_end, c_fetched in clipped[1:]:
+            last = merged[-1]
+            settled = last[2] - margin >= last[1] and c_fetched - margin >= c_end
+            if last[1] == c_start and settled:
+                merged[-1] = [last[0], c_end, max(last[2], c_fetched)]
+            else:
+                merged.append([c_start, c_end, c_fetched])
+        return merged
@@ -0,0 +1,3 @@
+# pylint: disable=missing-module-docstring
+
+from .file_metric_client import FileMetricClient
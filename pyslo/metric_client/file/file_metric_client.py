@@ -0,0 +1,208 @@
+"""File backed MetricClient
+
+Reads metric data previously written to local Parquet or Arrow IPC files,
+e.g. to recompute SLIs over long windows without going back to the
+metric provider. Files are laid out as a hive partitioned dataset::
+
+    <path>/metric=<metric>/date=<YYYY-MM-DD>/part-<uuid>-<n>.parquet
+
+Requires pyarrow, which can be installed with::
+
+    pip install pyslo[parquet]
+"""
+
+import uuid
+import pandas as pd
+from ..cache import require_parquet
+from ..metric_client import MetricClient
+from ..metric_client import NoMetricDataAvailable
+
+
+class FileMetricClient(MetricClient):
+    """Metric client reading a memory mapped, partitioned dataset
+
+    The metric and date partitions, the window, and the columns needed are
+    pushed down into the scan, so only the files of the window's days are
+    opened and only the requested columns are read from them.
+
+    Attributes:
+        path:               root directory of the dataset
+        metric:             the metric partition to read, e.g. the Stackdriver
+                            metric type
+        format:             'parquet' or 'ipc' (Arrow IPC/Feather). default = 'parquet'
+        memory_map:         bool. Memory map the files rather than reading them
+                            into buffers. default = True
+        supports_projection:    True. timeseries_dataframe accepts label_columns.
+
+    Args:
+        path:               root directory of the dataset
+        metric:             Optional. The metric partition to read
+        format:             Optional. default = 'parquet'
+    """
+
+    supports_projection = True
+
+    # Columns read whatever the projection
+    TIME_COLUMNS = ['start_timestamp', 'end_timestamp']
+
+    def __init__(self, path, metric=None, format='parquet'):  # pylint: disable=redefined-builtin
+        require_parquet()
+        self.path = path
+        self.metric = metric
+        self.format = format
+        self.memory_map = True
+
+    def cache_key(self):
+        """Identify the data this client retrieves, for caching
+
+        Returns:
+            A string made of the path, metric and value type
+        """
+        return f'{self.path}|{self.metric}|{self.value_type}'
+
+    def dataset(self):
+        """Open the dataset
+
+        Returns:
+            A pyarrow.dataset.Dataset, partitioned by metric and date
+        """
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+        import pyarrow.fs  # pylint: disable=import-outside-toplevel
+        return pyarrow.dataset.dataset(
+            self.path,
+            format=self.format,
+            partitioning=FileMetricClient.partitioning(),
+            filesystem=pyarrow.fs.LocalFileSystem(use_mmap=self.memory_map)
+            )
+
+    @staticmethod
+    def partitioning():
+        """Hive partitioning by metric and date, both as strings
+        """
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+        return pyarrow.dataset.partitioning(
+            pyarrow.schema([('metric', pyarrow.string()), ('date', pyarrow.string())]),
+            flavor='hive'
+            )
+
+    def scanner(self, end, end_nanos=0, duration=3600, label_columns=None):
+        """Build a scanner of the points in a period
+
+        Args:
+            end:            the end of the period, as the time in seconds since the epoch
+            end_nanos:      Optional. Integer number of nano seconds added to end
+            duration:       Optional. Length of the period to retrieve in seconds
+            label_columns:  Optional. List of label columns to read. Timestamps, value
+                            and histogram bucket columns are always read.
+                            default = None, every column
+
+        Returns:
+            A pyarrow.dataset.Scanner
+        """
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+        dataset = self.dataset()
+        end = pd.Timestamp(end, unit='s', tz='UTC') + pd.Timedelta(end_nanos, unit='ns')
+        start = end - pd.Timedelta(duration, unit='s')
+
+        field = pyarrow.dataset.field
+        timestamp = dataset.schema.field('end_timestamp').type
+        predicate = (
+            (field('date') >= start.strftime('%Y-%m-%d')) &
+            (field('date') <= end.strftime('%Y-%m-%d')) &
+            (field('end_timestamp') >= pyarrow.scalar(start, type=timestamp)) &
+            (field('end_timestamp') <= pyarrow.scalar(end, type=timestamp))
+            )
+        if self.metric is not None:
+            predicate = predicate & (field('metric') == self.metric)
+
+        names = [name for name in dataset.schema.names if name not in ('metric', 'date')]
+        if label_columns is not None:
+            bucket_prefix = MetricClient.prepend_key('', 'bucket')
+            names = [
+                name for name in names
+                if name in FileMetricClient.TIME_COLUMNS or name == 'value' or
+                name.startswith(bucket_prefix) or name in label_columns
+                ]
+        return dataset.scanner(columns=names, filter=predicate)
+
+    def timeseries_dataframe(self, end, end_nanos=0, duration=3600, label_columns=None):
+        """Read the points of a period
+
+        Args:
+            end:            the end of the period, as the time in seconds since the epoch
+            end_nanos:      Optional. Integer number of nano seconds added to end
+            duration:       Optional. Length of the period to retrieve in seconds
+            label_columns:  Optional. List of label columns to read, see scanner
+
+        Returns:
+            A dataframe of the points whose end_timestamp is within the period,
+            with a pandas Categorical column per label.
+        """
+        table = self.scanner(end, end_nanos, duration, label_columns).to_table()
+        if table.num_rows == 0:
+            raise NoMetricDataAvailable
+        return FileMetricClient.to_df(table)
+
+    def timeseries_chunks(self, end, end_nanos=0, duration=3600, label_columns=None):
+        """Read the points of a period one record batch at a time
+
+        Args:
+            end:            the end of the period, as the time in seconds since the epoch
+            end_nanos:      Optional. Integer number of nano seconds added to end
+            duration:       Optional. Length of the period to retrieve in seconds
+            label_columns:  Optional. List of label columns to read, see scanner
+
+        Yields:
+            Dataframes of points, as returned by timeseries_dataframe
+        """
+        for batch in self.scanner(end, end_nanos, duration, label_columns).to_batches():
+            if batch.num_rows > 0:
+                yield FileMetricClient.to_df(batch)
+
+    @staticmethod
+    def to_df(table):
+        """Convert an Arrow table or record batch to a dataframe
+
+        Label columns become pandas Categoricals with sorted categories, as
+        returned by the other clients, so groups sort by label.
+
+        Args:
+            table: pyarrow.Table or pyarrow.RecordBatch
+
+        Returns:
+            A dataframe
+        """
+        data = table.to_pandas(strings_to_categorical=True)
+        for column in data.columns:
+            if isinstance(data[column].dtype, pd.CategoricalDtype):
+                categories = data[column].cat.categories
+                if not categories.is_monotonic_increasing:
+                    data[column] = data[column].cat.reorder_categories(categories.sort_values())
+        return data
+
+    def write(self, data):
+        """Add points to the dataset, partitioned by day of end_timestamp
+
+        Args:
+            data: dataframe of points, e.g. as returned by another client's
+                  timeseries_dataframe
+        """
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+        if self.metric is None:
+            raise ValueError("metric must be set to write to the dataset")
+        data = data.assign(
+            metric=self.metric,
+            date=data['end_timestamp'].dt.strftime('%Y-%m-%d')
+            )
+        pyarrow.dataset.write_dataset(
+            pyarrow.Table.from_pandas(data, preserve_index=False),
+            self.path,
+            format=self.format,
+            partitioning=FileMetricClient.partitioning(),
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.{self.format}',
+            existing_data_behavior='overwrite_or_ignore'
+            )
@@ -7,15 +7,59 @@ Currently supported:
     - StackDriver
         Client library is in alpha. Using version v3:-
             https://googleapis.dev/python/monitoring/latest/gapic/v3/api.html
+    - Prometheus
+        Range queries over the HTTP API, using only the standard library.
 
 Planned implementations:
     - Azure Metric Service
-    - Prometheus
 """
 
-from google.cloud import monitoring_v3
+import asyncio
+import functools
+from enum import IntEnum
+import numpy as np
+import pandas as pd
+from ..instrumentation import Instrumentation
+
+
+class ValueType(IntEnum):
+    """Value type of a metric, independent of the metric provider
+
+    Values match google.cloud.monitoring_v3.enums.MetricDescriptor.ValueType,
+    so either can be assigned to MetricClient.value_type and they compare equal.
+    """
+    VALUE_TYPE_UNSPECIFIED = 0
+    BOOL = 1
+    INT64 = 2
+    DOUBLE = 3
+    STRING = 4
+    DISTRIBUTION = 5
+    MONEY = 6
+
+
+class MetricKind(IntEnum):
+    """Kind of a metric, independent of the metric provider
+
+    Values match google.cloud.monitoring_v3.enums.MetricDescriptor.MetricKind.
+    GAUGE points are instantaneous, DELTA points count the events of their own
+    interval and CUMULATIVE points count every event since a fixed start time.
+    """
+    METRIC_KIND_UNSPECIFIED = 0
+    GAUGE = 1
+    DELTA = 2
+    CUMULATIVE = 3
+
 
-MetricDescriptor = monitoring_v3.enums.MetricDescriptor
+def __getattr__(name):
+    # MetricDescriptor used to be imported from monitoring_v3 here. It is kept
+    # for compatibility, but only imports the Stackdriver SDK when accessed.
+    if name == 'MetricDescriptor':
+        from google.cloud import monitoring_v3  # pylint: disable=import-outside-toplevel
+        if hasattr(monitoring_v3, 'enums'):
+            return monitoring_v3.enums.MetricDescriptor
+        from google.api import metric_pb2  # pylint: disable=import-outside-toplevel
+        return metric_pb2.MetricDescriptor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class NoMetricDataAvailable(Exception):
@@ -26,17 +70,312 @@ class NoMetricDataAvailable(Exception):
     """
 
 
+class Preflight():
+    """Summary of the series a fetch would return, without their points
+
+    Attributes:
+        series:             number of series
+        cardinality:        dict of the number of distinct values of each label, keyed
+                            by the prepended label name
+        estimated_points:   estimated number of points in the period
+        estimated_bytes:    estimated memory in bytes of the fetched dataframe
+    """
+
+    # Bytes per row of the value and two timestamp columns
+    POINT_BYTES = 24
+    # Bytes per row of each categorical label column
+    LABEL_BYTES = 4
+
+    def __init__(self, series, cardinality, estimated_points):
+        self.series = series
+        self.cardinality = cardinality
+        self.estimated_points = estimated_points
+        self.estimated_bytes = int(
+            estimated_points * (self.POINT_BYTES + self.LABEL_BYTES * len(cardinality))
+            )
+
+    def estimated_groups(self, group_by_labels):
+        """Upper bound of the number of groups for a set of labels
+
+        Args:
+            group_by_labels: list of prepended label names
+
+        Returns:
+            The smaller of the number of series and the product of the label
+            cardinalities.
+        """
+        groups = 1
+        for label in group_by_labels:
+            groups *= max(self.cardinality.get(label, 1), 1)
+        return min(groups, self.series)
+
+    def __repr__(self):
+        return (
+            f'Preflight(series={self.series}, estimated_points={self.estimated_points}, '
+            f'estimated_bytes={self.estimated_bytes}, cardinality={self.cardinality})'
+            )
+
+
 class MetricClient():
     """Parent object for source specific metric clients.
 
     Attributes:
         project:       id of the GCP project hosting Stackdriver
+        result_cache:  Optional pyslo.metric_client.cache.ResultCache used by
+                       cached_dataframe. Set on MetricClient to share one cache
+                       between all clients. default = None
+        supports_projection:    True if timeseries_dataframe and timeseries_chunks
+                       accept a label_columns argument, the list of label columns
+                       to read. default = False
+        instrumentation:    pyslo.instrumentation.Instrumentation that fetches are
+                       timed and counted with. Set on MetricClient to instrument
+                       every client. default = Instrumentation(), which records nothing
+        metric_kind:   kind of the metric, as a MetricKind. Points of CUMULATIVE
+                       DISTRIBUTION metrics are differenced per series by
+                       Sli.calc_distribution. StackdriverMetricClient sets it from
+                       the series it decodes. default = None, points count their
+                       own interval as for DELTA metrics, with a warning
 
     """
 
     value_type = None
+    metric_kind = None
+    result_cache = None
+    supports_projection = False
+    instrumentation = Instrumentation()
+
+    @staticmethod
+    def prepend_key(key, prepend):
+        """Prepends a key
+
+        Args:
+            key: string value of the dictionary key
+            prepend: string value to be prepended to the key
+
+        Returns:
+            A string
+        """
+        return f'{prepend}__{key}'
+
+    @staticmethod
+    def bucket_key(upper_bound):
+        """Column name of a histogram bucket
+
+        DISTRIBUTION metrics have a column per bucket holding the number of
+        samples in it, named after the bucket's upper bound, e.g. bucket__0.25,
+        with bucket__inf for the overflow bucket.
+
+        Args:
+            upper_bound: float upper bound of the bucket
+
+        Returns:
+            A string
+        """
+        return MetricClient.prepend_key(repr(float(upper_bound)), 'bucket')
+
+    @staticmethod
+    def bucket_columns(data):
+        """Bucket columns of a dataframe and their upper bounds
+
+        Args:
+            data: dataframe of DISTRIBUTION metric data
+
+        Returns:
+            A tuple of the list of bucket column names, in bucket order, and a
+            numpy array of their upper bounds.
+        """
+        prefix = MetricClient.prepend_key('', 'bucket')
+        columns = [column for column in data.columns if column.startswith(prefix)]
+        upper_bounds = np.array([float(column[len(prefix):]) for column in columns])
+        order = np.argsort(upper_bounds, kind='stable')
+        return [columns[i] for i in order], upper_bounds[order]
+
+    @staticmethod
+    def epoch_nanos(timestamps):
+        """Nanoseconds since the epoch of a datetime column
+
+        Unlike DatetimeIndex.asi8, which counts in the unit of the column,
+        e.g. microseconds for datetime64[us] with pandas 2, the result is
+        always in nanoseconds, so it can be compared with pandas.Timestamp.value.
+
+        Args:
+            timestamps: pandas series or index of datetimes
+
+        Returns:
+            An int64 numpy array
+        """
+        index = pd.DatetimeIndex(timestamps)
+        if hasattr(index, 'as_unit'):
+            index = index.as_unit('ns')
+        return index.asi8
+
+    def cache_key(self):
+        """Identify the data this client retrieves, for caching
+
+        Clients whose results can be cached should override this.
+
+        Returns:
+            A string that is the same for any two clients retrieving the same
+            data, or None if results cannot be cached.
+        """
+        return None
+
+    def cached_dataframe(self, fetch, end, end_nanos=0, duration=3600):
+        """Fetch a period through result_cache, if one is set
+
+        The cache key is made of cache_key, end, end_nanos and duration.
+        Clients call this from timeseries_dataframe. The fetch is timed as a
+        timeseries_dataframe span of instrumentation, counting rows.
+
+        Args:
+            fetch:      function taking end, end_nanos and duration keyword arguments
+                        and returning a dataframe
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period to retrieve in seconds
+
+        Returns:
+            A pandas dataframe
+        """
+        with self.instrumentation.span(
+                'timeseries_dataframe', client=type(self).__name__, duration=duration) as span:
+            key = self.cache_key()
+            if self.result_cache is None or key is None:
+                data = fetch(end=end, end_nanos=end_nanos, duration=duration)
+            else:
+                data = self.result_cache.get(
+                    (key, end, end_nanos, duration),
+                    functools.partial(fetch, end=end, end_nanos=end_nanos, duration=duration)
+                    )
+            span.count('rows', data.shape[0])
+        return data
+
+    @staticmethod
+    def concat_frames(frames):
+        """Concatenate dataframes, keeping label columns categorical
+
+        Args:
+            frames: list of dataframes as returned by timeseries_dataframe
+
+        Returns:
+            A single dataframe. Categorical columns have the union of the
+            categories of each frame.
+        """
+        frames = list(frames)
+        for column in frames[0].columns:
+            dtypes = [frame[column].dtype for frame in frames if column in frame]
+            if not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+                continue
+            categories = pd.api.types.union_categoricals(
+                [frame[column] for frame in frames if column in frame], sort_categories=True
+                ).categories
+            frames = [
+                frame.assign(**{column: frame[column].cat.set_categories(categories)})
+                if column in frame else frame
+                for frame in frames
+                ]
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def join_series_table(points, series):
+        """Join the series labels onto the points table
+
+        Args:
+            points: dataframe of points with a series_id column, see StackdriverMetricClient.to_series_table
+            series: dataframe of labels indexed by series_id, see StackdriverMetricClient.to_series_table
+
+        Returns:
+            A dataframe of the points without the series_id column, with a
+            pandas Categorical column per label.
+        """
+        data = points.drop(columns='series_id')
+        series_id = points['series_id'].to_numpy()
+        for key in series.columns:
+            labels = pd.Categorical(series[key])
+            data[key] = pd.Categorical.from_codes(labels.codes[series_id], labels.categories)
+        return data
+
+    @staticmethod
+    def label_keys(series_labels):
+        """Ordered union of the label keys of several series
+
+        Args:
+            series_labels: list of label dictionaries, one per series
+
+        Returns:
+            A list of label keys in the order they are first seen.
+        """
+        keys = dict()
+        for labels in series_labels:
+            keys.update(dict.fromkeys(labels))
+        return list(keys)
 
     def timeseries_dataframe(self):
         """Retrieve data from time series db and return as a pandas dataframe
         """
         return
+
+    async def atimeseries_dataframe(self, end, end_nanos=0, duration=3600):
+        """Async counterpart of timeseries_dataframe
+
+        Clients with an async transport should override this. By default
+        timeseries_dataframe is run in the event loop's default executor.
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period to retrieve in seconds
+
+        Returns:
+            A pandas dataframe
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.timeseries_dataframe, end=end, end_nanos=end_nanos, duration=duration
+            ))
+
+    def preflight(self, end, end_nanos=0, duration=3600):
+        """Summarise the series a fetch of the period would return
+
+        Clients whose backend can list series without their points should
+        override this.
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period in seconds
+
+        Returns:
+            A Preflight, or None if the client does not support it
+        """
+        return None
+
+    def aligned_counts(self, end, end_nanos=0, duration=3600, alignment_period=3600,
+                       resource_labels=(), metric_labels=()):
+        """Retrieve good and valid counts of a BOOL metric counted by the backend
+
+        Clients whose backend can align and count points server side should
+        override this.
+
+        Returns:
+            A dataframe with a column per group by label, plus end_timestamp,
+            count_good and count_valid.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support aligned counts")
+
+    def timeseries_chunks(self, end, end_nanos=0, duration=3600):
+        """Retrieve data from time series db as a sequence of dataframes
+
+        Clients that can page through results should override this so that
+        only one chunk needs to be held in memory at a time. By default the
+        whole period is returned as a single chunk.
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period to retrieve in seconds
+
+        Returns:
+            A generator of pandas dataframes
+        """
+        yield self.timeseries_dataframe(end=end, end_nanos=end_nanos, duration=duration)
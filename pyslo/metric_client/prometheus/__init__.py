@@ -0,0 +1,5 @@
+# pylint: disable=missing-module-docstring
+
+from .prometheus_metric_client import PrometheusMetricClient
+from .prometheus_metric_client import PrometheusException
+from .prometheus_metric_client import MatrixDecoder
@@ -0,0 +1,378 @@
+"""Prometheus specific MetricClient
+
+Range queries are made against the Prometheus HTTP API, see
+https://prometheus.io/docs/prometheus/latest/querying/api/#range-queries
+"""
+
+import re
+import json
+import math
+import queue
+import codecs
+import http.client
+import urllib.parse
+import numpy as np
+import pandas as pd
+from ..metric_client import MetricClient
+from ..metric_client import NoMetricDataAvailable
+from ..metric_client import ValueType
+
+
+class PrometheusException():
+    """Class to hold exceptions related to the Prometheus client specifically
+    """
+
+    class QueryFailed(Exception):
+        """Query Failed exception
+        Used when Prometheus returns an error, or a response that is not a
+        complete matrix
+        """
+
+
+class ConnectionPool():
+    """Pool of keep-alive HTTP connections to a single host
+
+    Connections are reused across requests as long as the server keeps
+    them open. A request on a reused connection that the server has since
+    closed is retried once on a new connection.
+
+    Attributes:
+        size:       maximum number of idle connections kept. default = 4
+        timeout:    socket timeout in seconds. default = 60
+        created:    number of connections opened so far
+
+    Args:
+        url:        base url of the server, e.g. http://localhost:9090
+    """
+
+    def __init__(self, url, size=4, timeout=60):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+        self.created = 0
+        self._idle = queue.LifoQueue()
+
+    def connect(self):
+        """Open a new connection
+
+        Returns:
+            An http.client.HTTPConnection, or HTTPSConnection for https urls
+        """
+        if self.scheme == 'https':
+            connection_class = http.client.HTTPSConnection
+        else:
+            connection_class = http.client.HTTPConnection
+        self.created += 1
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, path, params):
+        """Send a GET request on a pooled connection
+
+        The response must be passed to release once it has been read.
+
+        Args:
+            path:   path below the base url, e.g. /api/v1/query_range
+            params: dictionary of query string parameters
+
+        Returns:
+            A tuple of the connection and its http.client.HTTPResponse
+        """
+        target = f'{self.base_path}{path}?{urllib.parse.urlencode(params)}'
+        headers = {'Accept': 'application/json'}
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+        else:
+            try:
+                connection.request('GET', target, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the idle connection
+                connection.close()
+                connection = self.connect()
+        try:
+            connection.request('GET', target, headers=headers)
+            return connection, connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    def release(self, connection, response):
+        """Return a connection to the pool, or close it
+
+        Connections are only reused when their response was read to the end
+        and the server did not ask for the connection to be closed.
+        """
+        if response.isclosed() and not response.will_close and self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        """Close every idle connection
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class MatrixDecoder():
+    """Incremental decoder of a query_range matrix response
+
+    Text is fed as it is read from the response. Each series object in the
+    result array is decoded as soon as it is complete, so the whole
+    response body is never held in memory.
+    """
+
+    RESULT = re.compile(r'"result"\s*:\s*\[')
+    RESULT_TYPE = re.compile(r'"resultType"\s*:\s*"(\w+)"')
+    SEPARATORS = ' \t\r\n,'
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._in_result = False
+        self._done = False
+
+    def feed(self, text):
+        """Decode the series completed by text
+
+        Args:
+            text: the next part of the response body
+
+        Returns:
+            A list of series dictionaries, with metric and values keys
+        """
+        self._buffer += text
+        if not self._in_result:
+            match = MatrixDecoder.RESULT.search(self._buffer)
+            if match is None:
+                return []
+            result_type = MatrixDecoder.RESULT_TYPE.search(self._buffer[:match.start()])
+            if result_type is None or result_type.group(1) != 'matrix':
+                raise PrometheusException.QueryFailed(
+                    "Prometheus did not return a matrix result, is the query a range vector?"
+                    )
+            self._buffer = self._buffer[match.end():]
+            self._in_result = True
+
+        buffer = self._buffer
+        position = 0
+        series = []
+        while not self._done:
+            while position < len(buffer) and buffer[position] in MatrixDecoder.SEPARATORS:
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                self._done = True
+                position += 1
+                break
+            try:
+                value, position = self._decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The series is not complete yet
+                break
+            series.append(value)
+        self._buffer = buffer[position:]
+        return series
+
+    def close(self):
+        """Check the response was a complete matrix
+
+        Raises:
+            PrometheusException.QueryFailed with the Prometheus error message
+            if the response had no result, or if it was cut short
+        """
+        if self._in_result and self._done:
+            return
+        if not self._in_result:
+            try:
+                body = json.loads(self._buffer)
+            except ValueError:
+                body = {}
+            if isinstance(body, dict) and body.get('status') == 'error':
+                raise PrometheusException.QueryFailed(
+                    f"{body.get('errorType')}: {body.get('error')}"
+                    )
+        raise PrometheusException.QueryFailed("Incomplete query_range response")
+
+
+class PrometheusMetricClient(MetricClient):
+    """Prometheus Metric Client
+
+    This client retrieves the points of a PromQL expression with range
+    queries. Long windows are split into query_range requests of at most
+    max_points steps, aligned to multiples of step so the same points are
+    returned whatever the window.
+
+    Series labels become metric label columns, named with prepend_key, e.g.
+    metric__instance. The __name__ label is dropped.
+
+    Attributes:
+        url:            base url of the Prometheus server, e.g. http://localhost:9090
+        query:          PromQL expression, e.g. up{job="api"}
+        step:           seconds between the points of a series. default = 60
+        max_points:     maximum number of steps per query_range request. Prometheus
+                        refuses more than 11000. default = 10000
+        block_size:     bytes read from the response at a time. default = 65536
+        value_type:     pyslo.metric_client.ValueType of the values. BOOL and INT64
+                        values are returned as int64 unless there are NaN values,
+                        anything else as float64. default = None
+        pool:           ConnectionPool the requests are made on
+
+    Args:
+        url:            base url of the Prometheus server
+        query:          Optional. PromQL expression
+        pool_size:      Optional. Number of idle keep-alive connections kept. default = 4
+        timeout:        Optional. Socket timeout in seconds. default = 60
+    """
+
+    def __init__(self, url, query=None, pool_size=4, timeout=60):
+        self.url = url
+        self.query = query
+        self.step = 60
+        self.max_points = 10000
+        self.block_size = 2**16
+        self.pool = ConnectionPool(url, size=pool_size, timeout=timeout)
+
+    def cache_key(self):
+        """Identify the data this client retrieves, for caching
+
+        Returns:
+            A string made of the url, query, step and value type
+        """
+        return f'{self.url}|{self.query}|{self.step}|{self.value_type}'
+
+    def timeseries_dataframe(self, end, end_nanos=0, duration=3600):
+        """Fetches and returns a dataframe of timeseries data
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. default = 0
+            duration:   Optional. An integer length of the period to retrieve in seconds.
+                        default = 3600s
+
+        Returns:
+            A dataframe with end_timestamp and value columns, plus a pandas
+            Categorical column per label.
+        """
+        return self.cached_dataframe(
+            self.fetch_dataframe, end=end, end_nanos=end_nanos, duration=duration
+            )
+
+    def fetch_dataframe(self, end, end_nanos=0, duration=3600):
+        """Fetch a period from Prometheus, bypassing result_cache
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Optional. Integer number of nano seconds added to end
+            duration:   Optional. Length of the period to retrieve in seconds
+
+        Returns:
+            A dataframe as returned by timeseries_dataframe
+        """
+        end = end + end_nanos / 10**9
+        series_ids = dict()
+        series_labels = []
+        buffers = {'end_timestamp': [], 'value': [], 'series_id': []}
+        chunks = PrometheusMetricClient.step_chunks(
+            end - duration, end, self.step, self.max_points
+            )
+        for chunk_start, chunk_end in chunks:
+            for series in self.query_range(chunk_start, chunk_end):
+                labels = {
+                    self.prepend_key(key, 'metric'): value
+                    for key, value in series['metric'].items() if key != '__name__'
+                    }
+                series_id = series_ids.setdefault(tuple(sorted(labels.items())), len(series_ids))
+                if series_id == len(series_labels):
+                    series_labels.append(labels)
+                samples = series.get('values', [])
+                if len(samples) == 0:
+                    continue
+                timestamps, values = zip(*samples)
+                buffers['end_timestamp'].append(
+                    np.rint(np.array(timestamps, dtype=np.float64) * 1000).astype(np.int64)
+                    )
+                buffers['value'].append(np.array(values, dtype=np.float64))
+                buffers['series_id'].append(np.full(len(samples), series_id, dtype=np.int32))
+        if len(buffers['value']) == 0:
+            raise NoMetricDataAvailable
+
+        buffers = {key: np.concatenate(value) for key, value in buffers.items()}
+        values = buffers['value']
+        if self.value_type in (ValueType.BOOL, ValueType.INT64) and np.isfinite(values).all():
+            values = values.astype(np.int64)
+        points = pd.DataFrame({
+            'end_timestamp': pd.to_datetime(buffers['end_timestamp'], unit='ms', utc=True),
+            'value': values,
+            'series_id': buffers['series_id']
+            })
+        series = pd.DataFrame(
+            series_labels, columns=self.label_keys(series_labels), dtype=object
+            )
+        return self.join_series_table(points, series)
+
+    def query_range(self, start, end):
+        """Stream the series of a single query_range request
+
+        Args:
+            start:  start of the range, in seconds since the epoch
+            end:    end of the range, in seconds since the epoch
+
+        Yields:
+            Series dictionaries with metric and values keys, as they are decoded
+
+        Raises:
+            PrometheusException.QueryFailed if Prometheus returns an error
+        """
+        params = {'query': self.query, 'start': start, 'end': end, 'step': self.step}
+        connection, response = self.pool.request('/api/v1/query_range', params)
+        try:
+            text = codecs.getincrementaldecoder('utf-8')()
+            decoder = MatrixDecoder()
+            while True:
+                block = response.read(self.block_size)
+                if not block:
+                    break
+                for series in decoder.feed(text.decode(block)):
+                    yield series
+            decoder.feed(text.decode(b'', final=True))
+            decoder.close()
+        finally:
+            self.pool.release(connection, response)
+
+    @staticmethod
+    def step_chunks(start, end, step, max_points):
+        """Split a period into query_range ranges aligned to step
+
+        Args:
+            start:      start of the period, in seconds since the epoch
+            end:        end of the period, in seconds since the epoch
+            step:       seconds between points
+            max_points: maximum number of points per range
+
+        Returns:
+            A list of (start, end) tuples, oldest first, whose bounds are multiples
+            of step within the period. Consecutive ranges do not share a step.
+        """
+        first = math.ceil(start / step) * step
+        last = math.floor(end / step) * step
+        span = step * (max_points - 1)
+        chunks = []
+        chunk_start = first
+        while chunk_start <= last:
+            chunk_end = min(chunk_start + span, last)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + step
+        return chunks
@@ -0,0 +1,481 @@
+"""Local fakes of the Stackdriver monitoring clients
+
+These serve a fixed list of TimeSeries from memory, so that fetching can be
+exercised and tested without network access or credentials.
+
+FakeMetricServiceServer goes further and serves the list from an in-process
+gRPC server, so a real MetricServiceClient fetches it: requests, paging and
+protobuf decoding are the same as against the API.
+
+Both versions 1 and 2 of google-cloud-monitoring are supported. Series are
+built and served as protobuf messages, see raw_message.
+"""
+# pylint: disable=redefined-builtin
+
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import grpc
+from google.cloud import monitoring_v3
+from .stackdriver_metric_client import message_class
+from .stackdriver_metric_client import monitoring_enum
+from .stackdriver_metric_client import raw_message
+
+
+def new_time_series():
+    """An empty TimeSeries protobuf message
+    """
+    return raw_message(monitoring_v3.types.TimeSeries())  # pylint: disable=no-member
+
+
+def grpc_transport(channel):
+    """A MetricServiceClient transport over a gRPC channel
+
+    The transport classes of versions 1 and 2 are in different modules, so
+    are imported here rather than with this module.
+
+    Args:
+        channel: a grpc.Channel
+
+    Returns:
+        A MetricServiceGrpcTransport
+    """
+    # pylint: disable=import-outside-toplevel,no-name-in-module,import-error
+    try:
+        from google.cloud.monitoring_v3.gapic.transports import metric_service_grpc_transport
+        return metric_service_grpc_transport.MetricServiceGrpcTransport(channel=channel)
+    except ImportError:
+        from google.cloud.monitoring_v3.services.metric_service.transports import (
+            MetricServiceGrpcTransport
+            )
+        return MetricServiceGrpcTransport(channel=channel)
+
+
+def select_points(time_series, interval):
+    """Copy time series keeping only points that end within interval
+
+    Both ends of the interval are inclusive.
+
+    Args:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries
+        interval:       google.cloud.monitoring_v3.types.TimeInterval
+
+    Returns:
+        A list of google.cloud.monitoring_v3.types.TimeSeries, without series
+        that have no points in the interval.
+    """
+    interval = raw_message(interval)
+    start = interval.start_time.seconds + interval.start_time.nanos / 10**9
+    end = interval.end_time.seconds + interval.end_time.nanos / 10**9
+    results = []
+    for series in time_series:
+        series = raw_message(series)
+        result = new_time_series()
+        result.resource.CopyFrom(series.resource)
+        result.metric.CopyFrom(series.metric)
+        result.metric_kind = series.metric_kind
+        result.value_type = series.value_type
+        for point in series.points:
+            point_end = point.interval.end_time.seconds + point.interval.end_time.nanos / 10**9
+            if start <= point_end <= end:
+                result.points.add().CopyFrom(point)
+        if len(result.points) > 0:
+            results.append(result)
+    return results
+
+
+def align_points(time_series, interval, aggregation):
+    """Apply a counting Aggregation to time series, as the API would
+
+    Supports the ALIGN_COUNT and ALIGN_COUNT_TRUE aligners with the points
+    summed across series by aggregation.group_by_fields. Alignment periods
+    end at the end of the interval. Series without a group by label are
+    grouped together, without that label.
+
+    Args:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries
+        interval:       google.cloud.monitoring_v3.types.TimeInterval
+        aggregation:    google.cloud.monitoring_v3.types.Aggregation
+
+    Returns:
+        A list of google.cloud.monitoring_v3.types.TimeSeries, one per group,
+        with INT64 points newest first.
+    """
+    aligner = monitoring_enum('Aggregation', 'Aligner')
+    interval, aggregation = raw_message(interval), raw_message(aggregation)
+    if aggregation.per_series_aligner not in (aligner.ALIGN_COUNT, aligner.ALIGN_COUNT_TRUE):
+        raise NotImplementedError(f"Aligner {aggregation.per_series_aligner} is not faked")
+    period = aggregation.alignment_period.seconds
+    end = interval.end_time.seconds + interval.end_time.nanos / 10**9
+    fields = list(aggregation.group_by_fields)
+    counts = defaultdict(lambda: defaultdict(int))
+    for series in time_series:
+        group = []
+        for field in fields:
+            kind, _, key = field.split('.', 2)
+            labels = series.resource.labels if kind == 'resource' else series.metric.labels
+            group.append(labels.get(key))
+        for point in series.points:
+            point_end = point.interval.end_time.seconds + point.interval.end_time.nanos / 10**9
+            bucket = int((end - point_end) // period)
+            if aggregation.per_series_aligner == aligner.ALIGN_COUNT_TRUE:
+                counts[tuple(group)][bucket] += int(point.value.bool_value)
+            else:
+                counts[tuple(group)][bucket] += 1
+
+    results = []
+    for group, buckets in counts.items():
+        result = new_time_series()
+        result.metric_kind = monitoring_enum('MetricDescriptor', 'MetricKind').GAUGE
+        result.value_type = monitoring_enum('MetricDescriptor', 'ValueType').INT64
+        for field, value in zip(fields, group):
+            kind, _, key = field.split('.', 2)
+            labels = result.resource.labels if kind == 'resource' else result.metric.labels
+            if value is not None:
+                labels[key] = value
+        for bucket in sorted(buckets):
+            point = result.points.add()
+            point.interval.end_time.seconds = int(end - bucket * period)
+            point.interval.start_time.seconds = int(end - bucket * period)
+            point.value.int64_value = buckets[bucket]
+        results.append(result)
+    return results
+
+
+def serve_points(time_series, interval, aggregation=None, view=None):
+    """The TimeSeries a list_time_series request would return
+
+    With the HEADERS view the series active in the interval are returned
+    without their points.
+
+    Args:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries
+        interval:       google.cloud.monitoring_v3.types.TimeInterval
+        aggregation:    Optional. google.cloud.monitoring_v3.types.Aggregation
+        view:           Optional. ListTimeSeriesRequest.TimeSeriesView, see monitoring_enum
+
+    Returns:
+        A list of google.cloud.monitoring_v3.types.TimeSeries
+    """
+    results = select_points(time_series, interval)
+    if aggregation is not None:
+        results = align_points(results, interval, aggregation)
+    if view == monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').HEADERS:
+        for result in results:
+            del result.points[:]
+    return results
+
+
+class FakeMetricServiceClient():
+    """Stands in for monitoring_v3.MetricServiceClient
+
+    Attributes:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries served
+                        by list_time_series
+        latency:        seconds each list_time_series call takes. default = 0
+        requests:       list of the keyword arguments of each list_time_series call
+        max_in_flight:  highest number of list_time_series calls running at once
+    """
+
+    def __init__(self, time_series, latency=0):
+        self.time_series = time_series
+        self.latency = latency
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def project_path(project):
+        """Resource name of a project
+        """
+        return f'projects/{project}'
+
+    def list_time_series(self, name, filter_, interval, view, aggregation=None, **kwargs):
+        """Serve the points of time_series within interval
+
+        With the HEADERS view the series active in the interval are served
+        without their points.
+
+        Returns:
+            A list of google.cloud.monitoring_v3.types.TimeSeries
+        """
+        with self._lock:
+            self.requests.append(dict(
+                name=name, filter_=filter_, interval=interval, view=view,
+                aggregation=aggregation, **kwargs
+                ))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return serve_points(self.time_series, interval, aggregation, view)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FakeAsyncPager():
+    """Async iterator over TimeSeries, served a page at a time
+
+    Args:
+        results:    list of google.cloud.monitoring_v3.types.TimeSeries
+        page_size:  number of TimeSeries per page
+        latency:    seconds awaited before each page is served
+        on_done:    Optional. function called once the last page is served
+    """
+
+    def __init__(self, results, page_size, latency, on_done=None):
+        self.results = results
+        self.page_size = page_size
+        self.latency = latency
+        self.on_done = on_done
+
+    async def __aiter__(self):
+        try:
+            for start in range(0, len(self.results), self.page_size):
+                await asyncio.sleep(self.latency)
+                for result in self.results[start:start + self.page_size]:
+                    yield result
+        finally:
+            if self.on_done is not None:
+                self.on_done()
+
+
+class FakeAsyncMetricServiceClient():
+    """Stands in for monitoring_v3.MetricServiceAsyncClient
+
+    list_time_series has the signature of the version 2 client, and builds
+    a ListTimeSeriesRequest from its arguments as that client does, so calls
+    with fields or values the API does not accept fail.
+
+    Attributes:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries served
+                        by list_time_series
+        page_size:      number of TimeSeries per page. default = 100
+        latency:        seconds awaited before each page. default = 0
+        requests:       list of the ListTimeSeriesRequest of each list_time_series call
+        max_in_flight:  highest number of list_time_series results being paged
+                        through at once
+    """
+
+    def __init__(self, time_series, page_size=100, latency=0):
+        self.time_series = time_series
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def list_time_series(self, request=None, *, name=None, filter=None, interval=None,
+                               view=None, retry=None, timeout=None, metadata=()):
+        """Serve the points of time_series within interval
+
+        Raises:
+            ValueError if both request and any of the fields are given
+
+        Returns:
+            A FakeAsyncPager
+        """
+        fields = dict(name=name, filter=filter, interval=interval, view=view)
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if request is not None and fields:
+            raise ValueError(
+                "If the `request` argument is set, then none of the individual field "
+                "arguments should be set."
+                )
+        if request is None:
+            request = monitoring_v3.types.ListTimeSeriesRequest(**fields)  # pylint: disable=no-member
+        elif isinstance(request, dict):
+            request = monitoring_v3.types.ListTimeSeriesRequest(**request)  # pylint: disable=no-member
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return FakeAsyncPager(
+            select_points(self.time_series, raw_message(request).interval), self.page_size,
+            self.latency,
+            on_done=self.done
+            )
+
+    def done(self):
+        """Called by a FakeAsyncPager once its last page is served
+        """
+        self.in_flight -= 1
+
+
+class FakeMetricServiceServicer():
+    """Serves ListTimeSeries pages of a fixed list of TimeSeries
+
+    Pages hold at most the request page_size series, or page_size when the
+    request has none, and at most max_page_bytes of serialized series,
+    though always at least one series. The next page token is the index of
+    the first series of the next page.
+
+    Every page of a query is built and serialized by the first request for
+    it, and later requests are served the serialized bytes, so that serving
+    costs little next to the client decoding the pages.
+
+    Attributes:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries served
+        page_size:      default number of series per page. default = 100
+        max_page_bytes: Optional. Maximum size of a page. default = None, no limit
+        latency:        seconds each page takes to serve. default = 0
+        requests:       list of the ListTimeSeriesRequest received, one per page
+        bytes_served:   total size of the pages served, in bytes
+    """
+
+    def __init__(self, time_series, page_size=100, max_page_bytes=None, latency=0):
+        self.time_series = time_series
+        self.page_size = page_size
+        self.max_page_bytes = max_page_bytes
+        self.latency = latency
+        self.requests = []
+        self.bytes_served = 0
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def pages(self, request):
+        """Serialized pages of the query of a request, built once
+
+        Args:
+            request: a ListTimeSeriesRequest
+
+        Returns:
+            A dictionary of serialized ListTimeSeriesResponse keyed by page token
+        """
+        query = message_class(monitoring_v3.types.ListTimeSeriesRequest)()  # pylint: disable=no-member
+        query.CopyFrom(request)
+        query.page_token = ''
+        query.page_size = 0
+        page_size = request.page_size or self.page_size
+        key = (query.SerializeToString(deterministic=True), page_size, self.max_page_bytes)
+        with self._lock:
+            if key not in self._pages:
+                aggregation = request.aggregation if request.HasField('aggregation') else None
+                results = serve_points(
+                    self.time_series, request.interval, aggregation, request.view
+                    )
+                self._pages[key] = self.paginate(results, page_size)
+            return self._pages[key]
+
+    def paginate(self, results, page_size):
+        """Split results into serialized pages
+
+        Args:
+            results:    list of google.cloud.monitoring_v3.types.TimeSeries
+            page_size:  maximum number of series per page
+
+        Returns:
+            A dictionary of serialized ListTimeSeriesResponse keyed by page token
+        """
+        pages = {}
+        start = 0
+        while True:
+            end = min(start + page_size, len(results))
+            response = message_class(monitoring_v3.types.ListTimeSeriesResponse)()  # pylint: disable=no-member
+            for position in range(start, end):
+                response.time_series.add().CopyFrom(results[position])
+                if (self.max_page_bytes is not None and position > start and
+                        response.ByteSize() > self.max_page_bytes):
+                    del response.time_series[-1]
+                    end = position
+                    break
+            if end < len(results):
+                response.next_page_token = str(end)
+            pages[str(start) if start > 0 else ''] = response.SerializeToString()
+            if end >= len(results):
+                return pages
+            start = end
+
+    def ListTimeSeries(self, request, context):  # pylint: disable=invalid-name
+        """Serve a page of the series within the request interval
+
+        Returns:
+            The serialized ListTimeSeriesResponse
+        """
+        with self._lock:
+            self.requests.append(request)
+        time.sleep(self.latency)
+        page = self.pages(request)[request.page_token]
+        with self._lock:
+            self.bytes_served += len(page)
+        return page
+
+
+class FakeMetricServiceServer():
+    """In-process gRPC server of a FakeMetricServiceServicer
+
+    Used as a context manager, the server listens on a free local port
+    until the block exits::
+
+        with FakeMetricServiceServer(time_series, page_size=10) as server:
+            metric_client = StackdriverMetricClient('project', client=server.client())
+
+    Attributes:
+        servicer:   the FakeMetricServiceServicer, whose attributes can be changed
+                    while the server runs
+        port:       the port listened on, once started
+
+    Args:
+        time_series:    list of google.cloud.monitoring_v3.types.TimeSeries served
+        page_size:      Optional. default = 100
+        max_page_bytes: Optional. default = None
+        latency:        Optional. default = 0
+        max_workers:    Optional. Number of requests served at once. default = 4
+    """
+
+    def __init__(self, time_series, page_size=100, max_page_bytes=None, latency=0,
+                 max_workers=4):
+        self.servicer = FakeMetricServiceServicer(time_series, page_size, max_page_bytes, latency)
+        self.max_workers = max_workers
+        self.port = None
+        self._server = None
+        self._channels = []
+
+    def start(self):
+        """Start serving
+
+        Only ListTimeSeries is served. Its responses are already serialized.
+        """
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=self.max_workers))
+        handler = grpc.method_handlers_generic_handler('google.monitoring.v3.MetricService', {
+            'ListTimeSeries': grpc.unary_unary_rpc_method_handler(
+                self.servicer.ListTimeSeries,
+                request_deserializer=message_class(
+                    monitoring_v3.types.ListTimeSeriesRequest  # pylint: disable=no-member
+                    ).FromString,
+                response_serializer=lambda page: page,
+                ),
+            })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port('127.0.0.1:0')
+        self._server.start()
+
+    def stop(self):
+        """Close the clients' channels and stop serving
+        """
+        for channel in self._channels:
+            channel.close()
+        self._channels = []
+        if self._server is not None:
+            self._server.stop(None)
+            self._server = None
+
+    def client(self):
+        """A MetricServiceClient connected to the server, without credentials
+
+        Returns:
+            A google.cloud.monitoring_v3.MetricServiceClient
+        """
+        channel = grpc.insecure_channel(f'127.0.0.1:{self.port}')
+        self._channels.append(channel)
+        return monitoring_v3.MetricServiceClient(transport=grpc_transport(channel))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
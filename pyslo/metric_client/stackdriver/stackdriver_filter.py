@@ -8,15 +8,17 @@ class StackDriverFilter():
     Args:
         metric_type: string. e.g. composer.googleapis.com/environment/healthy
         resource_type: string. e.g. cloud_composer_environment
-        resource_labels: Not implemented
-        metric_labels: Not implemented
+        resource_labels: dict. Resource label values the series must match,
+            e.g. {'project_id': 'my-project'}
+        metric_labels: dict. Metric label values the series must match,
+            e.g. {'response_code_class': '2xx'}
     """
 
     def __init__(self):
         self.metric_type = None
         self.resource_type = None
-        self.resource_labels = []
-        self.metric_labels = []
+        self.resource_labels = dict()
+        self.metric_labels = dict()
 
     @property
     def string(self):
@@ -38,6 +40,10 @@ class StackDriverFilter():
             filter_string += f'metric.type="{self.metric_type}" '
         if self.resource_type:
             filter_string += f'resource.type="{self.resource_type}" '
+        for key, value in self.resource_labels.items():
+            filter_string += f'resource.labels.{key}="{value}" '
+        for key, value in self.metric_labels.items():
+            filter_string += f'metric.labels.{key}="{value}" '
         return filter_string
 
     def validate_types_set(self):
@@ -2,15 +2,138 @@
 """
 
 import time
+import inspect
 import datetime
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import pytz
+import numpy as np
 import pandas as pd
-from google.cloud import monitoring_v3
 from ..metric_client import MetricClient
+from ..metric_client import MetricKind
 from ..metric_client import NoMetricDataAvailable
+from ..metric_client import Preflight
+from ..metric_client import ValueType
 from .stackdriver_filter import StackDriverFilter
 
-MetricDescriptor = monitoring_v3.enums.MetricDescriptor
+# google.cloud.monitoring_v3, imported by load_monitoring when the first client
+# is constructed rather than when pyslo is imported, as it also loads grpc.
+monitoring_v3 = None  # pylint: disable=invalid-name
+
+
+def load_monitoring():
+    """Import google.cloud.monitoring_v3 on first use
+
+    Returns:
+        The google.cloud.monitoring_v3 module
+    """
+    global monitoring_v3  # pylint: disable=global-statement,invalid-name
+    if monitoring_v3 is None:
+        from google.cloud import monitoring_v3 as module  # pylint: disable=import-outside-toplevel
+        monitoring_v3 = module
+    return monitoring_v3
+
+
+def monitoring_enum(message, enum):
+    """An enum of the installed google-cloud-monitoring
+
+    Version 1 defines enums in monitoring_v3.enums, version 2 on the
+    message types of monitoring_v3, e.g. for ListTimeSeriesRequest and
+    TimeSeriesView monitoring_v3.enums.ListTimeSeriesRequest.TimeSeriesView
+    or monitoring_v3.ListTimeSeriesRequest.TimeSeriesView. Version 2 takes
+    MetricDescriptor from google.api.metric_pb2.
+
+    Args:
+        message:    name of the message type defining the enum
+        enum:       name of the enum
+
+    Returns:
+        The enum class
+    """
+    module = load_monitoring()
+    module = getattr(module, 'enums', module)
+    if not hasattr(module, message):
+        from google.api import metric_pb2 as module  # pylint: disable=import-outside-toplevel
+    return getattr(getattr(module, message), enum)
+
+
+def raw_message(message):
+    """The protobuf message of a google-cloud-monitoring type
+
+    Version 2 wraps protobuf messages in proto-plus types, which convert
+    timestamps to datetimes. pb returns the wrapped protobuf message, which
+    has the same fields as the version 1 types.
+
+    Args:
+        message: a message, e.g. a TimeSeries returned by the API
+
+    Returns:
+        The protobuf message, or message itself if it is not wrapped
+    """
+    if hasattr(type(message), 'pb'):
+        return type(message).pb(message)
+    return message
+
+
+def message_class(message_type):
+    """The protobuf class of a google-cloud-monitoring type
+
+    See raw_message.
+
+    Args:
+        message_type: a message type, e.g. monitoring_v3.types.ListTimeSeriesRequest
+
+    Returns:
+        The protobuf message class, or message_type itself if it is not wrapped
+    """
+    if hasattr(message_type, 'pb'):
+        return message_type.pb()
+    return message_type
+
+
+def page_results(page):
+    """The TimeSeries of a page of results
+
+    Version 1 pages iterate over their TimeSeries, version 2 pages are
+    ListTimeSeriesResponse messages holding them.
+
+    Args:
+        page: a page of a results iterator, or a list of TimeSeries
+
+    Returns:
+        An iterable of TimeSeries protobuf messages
+    """
+    if hasattr(page, 'time_series'):
+        return raw_message(page).time_series
+    return page
+
+
+def list_time_series(client, name, filter_, interval, view, aggregation=None):
+    """Call list_time_series of a version 1 or version 2 MetricServiceClient
+
+    Version 2 clients take a request, as their keyword arguments do not
+    include aggregation, version 1 clients take the fields positionally.
+
+    Args:
+        client:         a MetricServiceClient, or a fake of either version
+        name:           resource name of the project, e.g. projects/my-project
+        filter_:        the filter string
+        interval:       google.cloud.monitoring_v3.types.TimeInterval()
+        view:           ListTimeSeriesRequest.TimeSeriesView, see monitoring_enum
+        aggregation:    Optional. google.cloud.monitoring_v3.types.Aggregation()
+
+    Returns:
+        A page or results iterator.
+    """
+    if 'request' in inspect.signature(client.list_time_series).parameters:
+        request = dict(name=name, filter=filter_, interval=interval, view=view)
+        if aggregation is not None:
+            request['aggregation'] = aggregation
+        return client.list_time_series(request=request)
+    kwargs = dict()
+    if aggregation is not None:
+        kwargs['aggregation'] = aggregation
+    return client.list_time_series(name, filter_, interval, view, **kwargs)
 
 
 class StackdriverMetricClient(MetricClient):
@@ -26,19 +149,84 @@ class StackdriverMetricClient(MetricClient):
                         This is most easily found by locating the metric in StackDriver Metrics
                         Explorer, then viewing as JSON.
                         The metric type is found as part of the timeSeriesFilter.
-        value_type:     metric type, as a type defined in google.cloud.monitoring_v3
-                        e.g. monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+        resource_labels: dict. Resource label values the series must match,
+                        e.g. {'project_id': 'my-project'}
+        metric_labels:  dict. Metric label values the series must match,
+                        e.g. {'response_code_class': '2xx'}
+        value_type:     metric type, as a pyslo.metric_client.ValueType or the equal
+                        type defined in google.cloud.monitoring_v3
+                        e.g. ValueType.BOOL
+        columnar:       bool. When True (default) to_df fills preallocated numpy column
+                        buffers per TimeSeries and builds the dataframe in one step.
+                        When False the original dict-per-point path is used.
+        gauge_start_timestamp:  bool. When False, start times of GAUGE series are not
+                        decoded, as they equal the end time. If every series is a GAUGE
+                        the start_timestamp column is omitted from the dataframe.
+                        default = True
+        shards:         int. Number of sub-intervals timeseries_dataframe splits the
+                        period into, fetched concurrently. default = 1
+        max_workers:    int. Maximum number of shards fetched at the same time.
+                        default = 4
+        sample_period:  int. Seconds between points of a series, used by preflight
+                        to estimate point counts. default = 60
+
+    Args:
+        project:        string. id of the GCP project hosting Stackdriver
+        async_client:   Optional. Client used by the async methods, e.g. a
+                        monitoring_v3.MetricServiceAsyncClient or
+                        pyslo.metric_client.stackdriver.fake.FakeAsyncMetricServiceClient.
+                        If not given, a MetricServiceAsyncClient is created on first use.
+        client:         Optional. Client used by the other methods, e.g. a
+                        monitoring_v3.MetricServiceClient with its own transport or
+                        credentials, or one connected to a
+                        pyslo.metric_client.stackdriver.fake.FakeMetricServiceServer.
+                        If not given, a MetricServiceClient is created with the
+                        default credentials.
 
     """
 
-    def __init__(self, project):
+    # numpy dtype of the value column buffer for each supported value type
+    VALUE_DTYPES = {
+        ValueType.BOOL: np.int64,
+        ValueType.INT64: np.int64,
+        ValueType.DOUBLE: np.float64,
+        ValueType.DISTRIBUTION: np.int64,
+    }
+
+    def __init__(self, project, async_client=None, client=None):
         self.project = project
         self._metric_type = None
         self._resource_type = None
         self.value_type = None
+        self.columnar = True
+        self.gauge_start_timestamp = True
+        self.shards = 1
+        self.max_workers = 4
+        self.sample_period = 60
         self._filter = StackDriverFilter()
 
-        self._client = monitoring_v3.MetricServiceClient()
+        if client is None:
+            client = load_monitoring().MetricServiceClient()
+        else:
+            load_monitoring()
+        self._client = client
+        self._async_client = async_client
+
+    @property
+    def async_client(self):
+        """Client used by the async methods, created on first use
+
+        Raises:
+            NotImplementedError if the installed google-cloud-monitoring has
+            no async client.
+        """
+        if self._async_client is None:
+            if not hasattr(monitoring_v3, 'MetricServiceAsyncClient'):
+                raise NotImplementedError(
+                    "The installed google-cloud-monitoring has no MetricServiceAsyncClient"
+                    )
+            self._async_client = monitoring_v3.MetricServiceAsyncClient()  # pylint: disable=no-member
+        return self._async_client
 
     @property
     def metric_type(self):
@@ -58,6 +246,34 @@ class StackdriverMetricClient(MetricClient):
         self._filter.resource_type = resource_type
         self._resource_type = resource_type
 
+    @property
+    def resource_labels(self):
+        return self._filter.resource_labels
+
+    @resource_labels.setter
+    def resource_labels(self, resource_labels):
+        self._filter.resource_labels = dict(resource_labels)
+
+    @property
+    def metric_labels(self):
+        return self._filter.metric_labels
+
+    @metric_labels.setter
+    def metric_labels(self, metric_labels):
+        self._filter.metric_labels = dict(metric_labels)
+
+    def cache_key(self):
+        """Identify the data this client retrieves, for caching
+
+        Returns:
+            A string made of the project, the filter string, the value type and
+            the settings that change the dataframe returned
+        """
+        return (
+            f'{self.project}|{self._filter.string}|{self.value_type}|shards={self.shards}|'
+            f'gauge_start_timestamp={self.gauge_start_timestamp}|columnar={self.columnar}'
+            )
+
     def timeseries_dataframe(self, end=time.time(), end_nanos=0, duration=3600):
         """Fetches and returns a dataframe of timeseries data
 
@@ -74,31 +290,344 @@ class StackdriverMetricClient(MetricClient):
             duration:   Optional. An integer length of the period to retrieve in seconds.
                         default = 3600s
 
+        Returns:
+            A pandas dataframe. If result_cache is set, a cached dataframe may be
+            returned.
+        """
+        return self.cached_dataframe(self.fetch_dataframe, end, end_nanos, duration)
+
+    def fetch_dataframe(self, end, end_nanos=0, duration=3600):
+        """Fetch a period from Stackdriver, bypassing result_cache
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. deafult = 0
+            duration:   Optional. An integer length of the period to retrieve in seconds.
+                        default = 3600s
+
         Returns:
             A pandas dataframe
         """
+        if self.shards > 1:
+            return self.timeseries_dataframe_sharded(end, end_nanos, duration)
         interval = self.set_interval(end, end_nanos, start_time=(end - duration))
         iterator = self.get_timeseries_iter(interval)
         return self.to_df(iterator)
 
+    def timeseries_dataframe_sharded(self, end, end_nanos=0, duration=3600):
+        """Fetch a period as several sub-intervals on a bounded thread pool
 
-    def get_timeseries_iter(self, interval):
-        """Retrieves timeseries data from Stackdriver
+        The period is split into self.shards sub-intervals which are fetched
+        with at most self.max_workers concurrent requests. Shards are
+        concatenated newest first, matching the newest first order of points
+        within a series returned by the API, and points returned by both
+        shards either side of a boundary are kept once.
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. deafult = 0
+            duration:   Optional. An integer length of the period to retrieve in seconds.
+                        default = 3600s
+
+        Returns:
+            A pandas dataframe
+        """
+        intervals = self.shard_intervals(end, end_nanos, duration, self.shards)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(intervals))) as executor:
+            frames = list(executor.map(self.fetch_interval, intervals))
+        return StackdriverMetricClient.merge_shards(frames, intervals)
+
+    @staticmethod
+    def merge_shards(frames, intervals):
+        """Concatenate shard dataframes and drop points duplicated on boundaries
+
+        Args:
+            frames:     list of dataframes, or None for shards without points,
+                        in the same order as intervals
+            intervals:  list of the TimeInterval of each shard, newest first
+
+        Returns:
+            A pandas dataframe
+        """
+        frames = [frame for frame in frames if frame is not None]
+        if len(frames) == 0:
+            raise NoMetricDataAvailable
+
+        data = StackdriverMetricClient.sort_label_columns(
+            StackdriverMetricClient.concat_frames(frames)
+            )
+        boundaries = pd.to_datetime(
+            [interval.start_time.seconds for interval in intervals], unit='s', utc=True
+            )
+        on_boundary = data['end_timestamp'].isin(boundaries).to_numpy()
+        if on_boundary.any():
+            duplicated = np.zeros(data.shape[0], dtype=bool)
+            duplicated[on_boundary] = data[on_boundary].duplicated().to_numpy()
+            data = data[~duplicated].reset_index(drop=True)
+        return data
+
+    @staticmethod
+    def sort_label_columns(data):
+        """Move the label columns to the end of a dataframe, sorted by name
+
+        Frames built from series with different labels, e.g. shards, list
+        label columns in the order they are first seen. Sorting them gives
+        every fetch the same columns as decode_series.
+
+        Args:
+            data: pandas dataframe
+
+        Returns:
+            The dataframe with its columns reordered
+        """
+        labels = sorted(
+            column for column in data.columns if column.startswith(('resource__', 'metric__'))
+            )
+        return data[[column for column in data.columns if column not in labels] + labels]
+
+    def fetch_interval(self, interval):
+        """Fetch a single interval as a dataframe
 
         Args:
             interval: google.cloud.monitoring_v3.types.TimeInterval()
 
         Returns:
-            A page or results iterator.
+            A pandas dataframe, or None if the interval holds no points
+        """
+        try:
+            return self.to_df(self.get_timeseries_iter(interval))
+        except NoMetricDataAvailable:
+            return None
+
+    @staticmethod
+    def shard_intervals(end, end_nanos, duration, shards):
+        """Split a period into contiguous sub-intervals, newest first
+
+        Args:
+            end:        the end of the period, as the time in seconds since the epoch
+            end_nanos:  Integer number of nano seconds added to end
+            duration:   length of the period in seconds
+            shards:     number of sub-intervals
+
+        Returns:
+            A list of google.cloud.monitoring_v3.types.TimeInterval(), the first
+            ending at end and each one starting where the next one ends.
+        """
+        edges = np.linspace(int(end) - duration, int(end), shards + 1).astype(np.int64)
+        edges = np.unique(edges)
+        intervals = []
+        for i in range(len(edges) - 1, 0, -1):
+            nanos = end_nanos if i == len(edges) - 1 else 0
+            intervals.append(
+                StackdriverMetricClient.set_interval(edges[i], nanos, start_time=edges[i - 1])
+                )
+        return intervals
+
+    async def atimeseries_dataframe(self, end, end_nanos=0, duration=3600):
+        """Async counterpart of timeseries_dataframe
+
+        Pages are consumed with async for on async_client, so many fetches can
+        interleave on one event loop. With shards > 1 the sub-intervals are
+        fetched concurrently, at most max_workers at a time.
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. deafult = 0
+            duration:   Optional. An integer length of the period to retrieve in seconds.
+                        default = 3600s
+
+        Returns:
+            A pandas dataframe
         """
-        project_name = self._client.project_path(self.project)
-        results_iter = self._client.list_time_series(
-            project_name,
-            self._filter.string,
-            interval,
-            monitoring_v3.enums.ListTimeSeriesRequest.TimeSeriesView.FULL
+        if self.shards > 1:
+            intervals = self.shard_intervals(end, end_nanos, duration, self.shards)
+            semaphore = asyncio.Semaphore(self.max_workers)
+
+            async def fetch(interval):
+                async with semaphore:
+                    return await self.afetch_interval(interval)
+
+            frames = await asyncio.gather(*[fetch(interval) for interval in intervals])
+            return StackdriverMetricClient.merge_shards(frames, intervals)
+        interval = self.set_interval(end, end_nanos, start_time=(end - duration))
+        return self.to_df(await self.aget_time_series(interval))
+
+    async def afetch_interval(self, interval):
+        """Async counterpart of fetch_interval
+        """
+        try:
+            return self.to_df(await self.aget_time_series(interval))
+        except NoMetricDataAvailable:
+            return None
+
+    async def aget_time_series(self, interval):
+        """Retrieves timeseries data from Stackdriver with the async client
+
+        Args:
+            interval: google.cloud.monitoring_v3.types.TimeInterval()
+
+        Returns:
+            A list of google.cloud.monitoring_v3.types.TimeSeries, collected
+            from the pages of results with async for.
+        """
+        pager = await self.async_client.list_time_series(
+            name=f'projects/{self.project}',
+            filter=self._filter.string,
+            interval=interval,
+            view=monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').FULL
         )
-        return results_iter
+        results = []
+        async for result in pager:
+            results.append(raw_message(result))
+        return results
+
+    def timeseries_chunks(self, end, end_nanos=0, duration=3600):
+        """Fetches timeseries data one page of results at a time
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. deafult = 0
+            duration:   Optional. An integer length of the period to retrieve in seconds.
+                        default = 3600s
+
+        Returns:
+            A generator of pandas dataframes, one per page of results. Pages without
+            points are skipped.
+        """
+        interval = self.set_interval(end, end_nanos, start_time=(end - duration))
+        iterator = self.get_timeseries_iter(interval)
+        for page in iterator.pages:
+            try:
+                yield self.to_df(page_results(page))
+            except NoMetricDataAvailable:
+                continue
+
+    def preflight(self, end, end_nanos=0, duration=3600):
+        """Summarise the series in a period using the HEADERS view
+
+        Only the series labels are listed, not their points. Point counts are
+        estimated from the duration and sample_period.
+
+        Args:
+            end:        A float that represents the end of the period, as the time in
+                        seconds since the epoch.
+            end_nanos:  Optional. Integer number of nano seconds that will be added to the end
+                        value. default = 0
+            duration:   Optional. An integer length of the period in seconds.
+                        default = 3600s
+
+        Returns:
+            A pyslo.metric_client.Preflight
+        """
+        interval = self.set_interval(end, end_nanos, start_time=(end - duration))
+        iterator = self.get_timeseries_iter(
+            interval, view=monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').HEADERS
+            )
+        values = dict()
+        n_series = 0
+        for result in iterator:
+            n_series += 1
+            for key, value in self.get_labels(raw_message(result)).items():
+                values.setdefault(key, set()).add(value)
+        cardinality = {key: len(label_values) for key, label_values in values.items()}
+        points_per_series = max(int(duration // self.sample_period), 1)
+        return Preflight(n_series, cardinality, n_series * points_per_series)
+
+    def get_timeseries_iter(self, interval, aggregation=None, view=None):
+        """Retrieves timeseries data from Stackdriver
+
+        Args:
+            interval:       google.cloud.monitoring_v3.types.TimeInterval()
+            aggregation:    Optional. google.cloud.monitoring_v3.types.Aggregation()
+                            applied by the API before points are returned
+            view:           Optional. ListTimeSeriesRequest.TimeSeriesView, see
+                            monitoring_enum. default FULL
+
+        Returns:
+            A page or results iterator.
+        """
+        if view is None:
+            view = monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').FULL
+        return list_time_series(
+            self._client, f'projects/{self.project}', self._filter.string, interval, view,
+            aggregation
+            )
+
+    def aligned_counts(self, end, end_nanos=0, duration=3600, alignment_period=3600,
+                       resource_labels=(), metric_labels=()):
+        """Fetch good and valid counts of a BOOL metric, aligned by the API
+
+        Rather than returning every point, the API counts the true points
+        (ALIGN_COUNT_TRUE) and all points (ALIGN_COUNT) of each series per
+        alignment period, and sums them across series sharing the given labels.
+        This reduces the data transferred by the number of points per period.
+
+        Args:
+            end:                A float that represents the end of the period, as the time
+                                in seconds since the epoch.
+            end_nanos:          Optional. Integer number of nano seconds that will be added
+                                to the end value. deafult = 0
+            duration:           Optional. An integer length of the period to retrieve in
+                                seconds. default = 3600s
+            alignment_period:   Optional. Seconds per aligned count. default = 3600s
+            resource_labels:    Optional. Resource label names to group counts by
+            metric_labels:      Optional. Metric label names to group counts by
+
+        Returns:
+            A dataframe with a column per group by label, prepended as in
+            get_labels, plus end_timestamp, count_good and count_valid.
+        """
+        interval = self.set_interval(end, end_nanos, start_time=(end - duration))
+        group_by_fields = [f'resource.label.{label}' for label in resource_labels] + \
+            [f'metric.label.{label}' for label in metric_labels]
+        label_columns = [self.prepend_key(label, 'resource') for label in resource_labels] + \
+            [self.prepend_key(label, 'metric') for label in metric_labels]
+        counts = []
+        for aligner, column in [
+                (monitoring_enum('Aggregation', 'Aligner').ALIGN_COUNT_TRUE, 'count_good'),
+                (monitoring_enum('Aggregation', 'Aligner').ALIGN_COUNT, 'count_valid')]:
+            aggregation = StackdriverMetricClient.aggregation(
+                aligner, alignment_period, group_by_fields
+                )
+            points, series = self.to_series_table(
+                self.get_timeseries_iter(interval, aggregation),
+                value_type=ValueType.INT64
+                )
+            series = series.reindex(columns=label_columns)
+            data = points[['end_timestamp', 'value']].rename(columns={'value': column})
+            for label in label_columns:
+                data[label] = series[label].to_numpy()[points['series_id'].to_numpy()]
+            counts.append(data.set_index(label_columns + ['end_timestamp']))
+        data = counts[0].join(counts[1], how='outer').fillna(0).astype(np.int64)
+        return data.reset_index()[label_columns + ['end_timestamp', 'count_good', 'count_valid']]
+
+    @staticmethod
+    def aggregation(aligner, alignment_period, group_by_fields):
+        """Create an Aggregation that aligns each series then sums across series
+
+        Args:
+            aligner:            an Aggregation.Aligner, see monitoring_enum
+            alignment_period:   seconds per aligned point
+            group_by_fields:    list of fields to preserve when summing across series,
+                                e.g. resource.label.project_id
+
+        Returns:
+            An instance of google.cloud.monitoring_v3.types.Aggregation()
+        """
+        aggregation = raw_message(load_monitoring().types.Aggregation())  # pylint: disable=no-member
+        aggregation.alignment_period.seconds = int(alignment_period)
+        aggregation.per_series_aligner = aligner
+        aggregation.cross_series_reducer = monitoring_enum('Aggregation', 'Reducer').REDUCE_SUM
+        aggregation.group_by_fields.extend(group_by_fields)
+        return aggregation
 
     @staticmethod
     def get_labels(result):
@@ -108,7 +637,8 @@ class StackdriverMetricClient(MetricClient):
             result:
 
         Returns:
-            a dict type object with the labels. 
+            a dict type object with the labels, sorted by key, as the order of
+            protobuf maps is not deterministic.
             Resource labels have the key resource__labelname.
             Metric labels have the key metric__labelname.
         """
@@ -117,7 +647,7 @@ class StackdriverMetricClient(MetricClient):
         r = StackdriverMetricClient.prepend_label_names(resource_labels, 'resource')
         m = StackdriverMetricClient.prepend_label_names(metric_labels, 'metric')
 
-        return {**r, **m}
+        return dict(sorted({**r, **m}.items()))
 
     @staticmethod
     def prepend_label_names(labels, prepend):
@@ -133,19 +663,6 @@ class StackdriverMetricClient(MetricClient):
         x = [(StackdriverMetricClient.prepend_key(k, prepend), v) for k, v in labels.items()]
         return dict(x)
 
-    @staticmethod
-    def prepend_key(key, prepend):
-        """Prepends a key
-
-        Args:
-            key: string value of the dictionary key
-            prepend: string value to be prepended to the key
-        
-        Returns:
-            A string
-        """
-        return f'{prepend}__{key}'
-
     def to_df(self, iterator):
         """Transform a results iterator to a Dataframe.
 
@@ -154,6 +671,20 @@ class StackdriverMetricClient(MetricClient):
         columns. To prevent possible conflicts, resource labels are prepended with
         resource__ and metrics with metric__.
 
+        Args:
+            iterator: google.api_core.page_iterator.GRPCIterator that gets returned
+            from the Stackdriver API
+
+        Returns:
+            A Dataframe containing the timeseries data and metric/resource labels.
+        """
+        if self.columnar:
+            return self.to_df_columnar(iterator)
+        return self.to_df_records(iterator)
+
+    def to_df_records(self, iterator):
+        """Transform a results iterator to a Dataframe, one dict per point.
+
         Args:
             iterator: google.api_core.page_iterator.GRPCIterator that gets returned
             from the Stackdriver API
@@ -162,15 +693,200 @@ class StackdriverMetricClient(MetricClient):
             A Dataframe containing the timeseries data and metric/resource labels.
         """
         points = list()
+        kinds = set()
         for result in iterator:
+            result = raw_message(result)
+            kinds.add(result.metric_kind)
             labels = self.get_labels(result)
             for point in result.points:
                 points.append(self.point_dict(point, labels))
+        self.observe_metric_kind(kinds)
         if len(points) == 0:
             raise NoMetricDataAvailable
 
-        return pd.DataFrame(points)
+        return StackdriverMetricClient.sort_label_columns(pd.DataFrame(points))
+
+    def to_df_columnar(self, iterator):
+        """Transform a results iterator to a Dataframe using column buffers.
 
+        Builds the points and series tables with to_series_table and joins
+        them, so resource and metric label columns are pandas Categoricals
+        whose codes index a single copy of each label value.
+
+        Args:
+            iterator: google.api_core.page_iterator.GRPCIterator that gets returned
+            from the Stackdriver API
+
+        Returns:
+            A Dataframe containing the timeseries data and metric/resource labels.
+        """
+        points, series = self.to_series_table(iterator)
+        with self.instrumentation.span('join', client=type(self).__name__) as span:
+            data = self.join_series_table(points, series)
+            span.count('rows', data.shape[0])
+        return data
+
+    def to_series_table(self, iterator, value_type=None):
+        """Transform a results iterator to a points table and a series table.
+
+        Each TimeSeries fills preallocated numpy buffers for the start/end
+        timestamp seconds and nanos, values and series id. Timestamps are
+        converted once per column to datetime64[ns, UTC], so unlike
+        to_df_records nanosecond precision is kept. Labels are stored once
+        per series in the series table rather than once per point.
+
+        This is timed as a decode span of instrumentation, in which each page
+        of results is requested in an api span and the tables are built in a
+        frame span.
+
+        Args:
+            iterator: google.api_core.page_iterator.GRPCIterator that gets returned
+            from the Stackdriver API
+            value_type: Optional. Decode point values as this value type rather than
+            self.value_type, e.g. for aligned points.
+
+        Returns:
+            A tuple of two dataframes. The points dataframe has the timestamp and
+            value columns plus an integer series_id column. The series dataframe
+            is indexed by series_id and has a column per resource/metric label,
+            sorted by name so that every fetch has the same columns.
+        """
+        with self.instrumentation.span('decode', client=type(self).__name__) as span:
+            if span.recording:
+                iterator = self.instrumented_results(iterator, span)
+            tables = self.decode_series(iterator, value_type)
+            span.count('series', tables[1].shape[0])
+            span.count('points', tables[0].shape[0])
+        return tables
+
+    def instrumented_results(self, iterator, span):
+        """Yield the TimeSeries of a results iterator, timing each page request
+
+        Each page is fetched in an api span, counting its series and their
+        serialized bytes, which are also counted in span along with the pages.
+
+        Args:
+            iterator:   google.api_core.page_iterator.GRPCIterator, a page of it,
+                        or a list of TimeSeries
+            span:       the pyslo.instrumentation.Span of the decode stage
+
+        Returns:
+            A generator of google.cloud.monitoring_v3.types.TimeSeries
+        """
+        pages = iter(iterator.pages) if hasattr(iterator, 'pages') else iter([iterator])
+        while True:
+            with self.instrumentation.span('api', client=type(self).__name__) as api:
+                page = next(pages, None)
+                results = [] if page is None else list(page_results(page))
+                api.count('series', len(results))
+                api.count('bytes', sum(result.ByteSize() for result in results))
+            if page is None:
+                return
+            span.count('pages')
+            span.count('bytes', api.counters['bytes'])
+            yield from results
+
+    def decode_series(self, iterator, value_type=None):
+        """Decode a results iterator to a points table and a series table
+
+        See to_series_table, which times this as the decode stage. Decoding
+        the client's own metric, i.e. without value_type, sets metric_kind,
+        see observe_metric_kind.
+        """
+        own_metric = value_type is None
+        value_type = self.value_type if value_type is None else value_type
+        value_dtype = self.VALUE_DTYPES.get(value_type, object)
+        buffers = {
+            'start_seconds': [], 'start_nanos': [], 'end_seconds': [], 'end_nanos': [],
+            'value': [], 'series_id': []
+            }
+        series_labels = []
+        all_gauge = True
+        distribution = value_type == ValueType.DISTRIBUTION
+        buckets, bucket_bounds = [], None
+        kinds = set()
+        for result in iterator:
+            result = raw_message(result)
+            kinds.add(result.metric_kind)
+            points = result.points
+            n_points = len(points)
+            if n_points == 0:
+                continue
+            end_seconds = np.fromiter(
+                (p.interval.end_time.seconds for p in points), np.int64, n_points)
+            end_nanos = np.fromiter(
+                (p.interval.end_time.nanos for p in points), np.int64, n_points)
+            if not self.gauge_start_timestamp and \
+                    result.metric_kind == MetricKind.GAUGE:
+                start_seconds, start_nanos = end_seconds, end_nanos
+            else:
+                all_gauge = False
+                start_seconds = np.fromiter(
+                    (p.interval.start_time.seconds for p in points), np.int64, n_points)
+                start_nanos = np.fromiter(
+                    (p.interval.start_time.nanos for p in points), np.int64, n_points)
+            buffers['start_seconds'].append(start_seconds)
+            buffers['start_nanos'].append(start_nanos)
+            buffers['end_seconds'].append(end_seconds)
+            buffers['end_nanos'].append(end_nanos)
+            buffers['value'].append(np.fromiter(
+                (self.get_point_value(p.value, value_type) for p in points),
+                value_dtype,
+                n_points
+                ))
+            buffers['series_id'].append(np.full(n_points, len(series_labels), dtype=np.int32))
+            if distribution:
+                bounds, counts = StackdriverMetricClient.bucket_counts(points)
+                if bucket_bounds is None:
+                    bucket_bounds = bounds
+                elif not np.array_equal(bounds, bucket_bounds):
+                    raise ValueError("Series have different distribution bucket bounds")
+                buckets.append(counts)
+            series_labels.append(self.get_labels(result))
+        if own_metric:
+            self.observe_metric_kind(kinds)
+        if len(series_labels) == 0:
+            raise NoMetricDataAvailable
+
+        with self.instrumentation.span('frame', client=type(self).__name__) as span:
+            buffers = {key: np.concatenate(value) for key, value in buffers.items()}
+            columns = dict()
+            if not all_gauge:
+                columns['start_timestamp'] = StackdriverMetricClient.convert_point_times(
+                    buffers['start_seconds'], buffers['start_nanos'])
+            columns['end_timestamp'] = StackdriverMetricClient.convert_point_times(
+                buffers['end_seconds'], buffers['end_nanos'])
+            columns['value'] = buffers['value']
+            if distribution:
+                columns.update(StackdriverMetricClient.bucket_frame_columns(
+                    bucket_bounds, np.concatenate(buckets)
+                    ))
+            columns['series_id'] = buffers['series_id']
+            points = pd.DataFrame(columns)
+
+            series = pd.DataFrame(
+                series_labels,
+                columns=sorted(StackdriverMetricClient.label_keys(series_labels)),
+                dtype=object
+                )
+            series.index.name = 'series_id'
+            span.count('rows', points.shape[0])
+        return points, series
+
+    def observe_metric_kind(self, kinds):
+        """Set metric_kind from the kinds of the series decoded
+
+        The API reports the kind of every TimeSeries, so the kind of a
+        CUMULATIVE metric is known without being set by hand. Series of
+        unspecified kind are ignored, and metric_kind is left as it is
+        unless the series agree.
+
+        Args:
+            kinds: set of the metric_kind of each TimeSeries
+        """
+        kinds = set(kinds) - {MetricKind.METRIC_KIND_UNSPECIFIED}
+        if len(kinds) == 1:
+            self.metric_kind = MetricKind(kinds.pop())
 
     def point_dict(self, point, labels):
         """Convert Point object to dictionary
@@ -194,21 +910,102 @@ class StackdriverMetricClient(MetricClient):
                 ),
             'value': self.get_point_value(point.value)
             }
+        if self.value_type == ValueType.DISTRIBUTION:
+            bounds, counts = StackdriverMetricClient.bucket_counts([point])
+            point_dict.update({
+                key: column[0]
+                for key, column in StackdriverMetricClient.bucket_frame_columns(
+                    bounds, counts).items()
+                })
         point_dict.update(labels)
         return point_dict
 
-    def get_point_value(self, point_value):
+    def get_point_value(self, point_value, value_type=None):
         """EXtract value from point_value object
 
         Args:
             point_value: instance of google.cloud.monitoring_v3.types.TypedValue
+            value_type: Optional. Value type to decode, default self.value_type
         Returns:
             The value of the TypedValue object
         """
-        if self.value_type == MetricDescriptor.ValueType.BOOL:
+        value_type = self.value_type if value_type is None else value_type
+        if value_type == ValueType.BOOL:
             return int(point_value.bool_value)
+        elif value_type == ValueType.INT64:
+            return point_value.int64_value
+        elif value_type == ValueType.DOUBLE:
+            return point_value.double_value
+        elif value_type == ValueType.DISTRIBUTION:
+            return point_value.distribution_value.count
         else:
-            raise Exception
+            raise NotImplementedError(f"Value type {value_type} is not supported")
+
+    @staticmethod
+    def bucket_bounds(bucket_options):
+        """Finite bucket boundaries of a distribution
+
+        Args:
+            bucket_options: google.api.distribution_pb2.Distribution.BucketOptions
+
+        Returns:
+            A float64 numpy array of the boundaries. There is one more bucket
+            than boundaries, the first being the underflow bucket and the last
+            the overflow bucket.
+        """
+        options = bucket_options.WhichOneof('options')
+        if options == 'linear_buckets':
+            linear = bucket_options.linear_buckets
+            return linear.offset + linear.width * np.arange(
+                linear.num_finite_buckets + 1, dtype=np.float64)
+        if options == 'exponential_buckets':
+            exponential = bucket_options.exponential_buckets
+            return exponential.scale * exponential.growth_factor ** np.arange(
+                exponential.num_finite_buckets + 1, dtype=np.float64)
+        if options == 'explicit_buckets':
+            return np.array(bucket_options.explicit_buckets.bounds, dtype=np.float64)
+        return np.zeros(0)
+
+    @staticmethod
+    def bucket_counts(points):
+        """Bucket counts of the distribution points of a series
+
+        The bucket bounds are taken from the first point. Trailing buckets
+        omitted by the API are filled with zeros.
+
+        Args:
+            points: sequence of google.cloud.monitoring_v3.types.Point with
+                    distribution values
+
+        Returns:
+            A tuple of the bucket bounds, see bucket_bounds, and an int64 numpy
+            array of the counts, with a row per point and a column per bucket.
+        """
+        bounds = StackdriverMetricClient.bucket_bounds(
+            points[0].value.distribution_value.bucket_options
+            )
+        counts = np.zeros((len(points), len(bounds) + 1), dtype=np.int64)
+        for row, point in enumerate(points):
+            bucket_counts = point.value.distribution_value.bucket_counts
+            counts[row, :len(bucket_counts)] = bucket_counts
+        return bounds, counts
+
+    @staticmethod
+    def bucket_frame_columns(bounds, counts):
+        """Name the bucket count columns by their upper bound
+
+        Args:
+            bounds: numpy array of finite bucket boundaries
+            counts: numpy array with a row per point and a column per bucket
+
+        Returns:
+            A dictionary of the bucket column names, see MetricClient.bucket_key,
+            and count arrays, in bucket order.
+        """
+        upper_bounds = list(bounds) + [np.inf]
+        return {
+            MetricClient.bucket_key(upper): counts[:, i] for i, upper in enumerate(upper_bounds)
+            }
 
     @staticmethod
     def convert_point_time(point_time, as_timestamp):
@@ -229,6 +1026,21 @@ class StackdriverMetricClient(MetricClient):
             return datetime.datetime.fromtimestamp(seconds + nanos/10**9, tz=pytz.UTC)
 
 
+    @staticmethod
+    def convert_point_times(seconds, nanos):
+        """Convert arrays of seconds and nanos to a datetime column
+
+        Args:
+            seconds: numpy int64 array of seconds since the epoch
+            nanos: numpy int64 array of nano seconds to add to seconds
+
+        Returns:
+            A pandas DatetimeIndex with dtype datetime64[ns, UTC]. Unlike
+            convert_point_time, nanosecond precision is kept.
+        """
+        return pd.to_datetime(seconds * 10**9 + nanos, unit='ns', utc=True)
+
+
     @staticmethod
     def set_interval(end_time, end_time_nanos=0, start_time=None):
         """Create a TimeInterval object based on input start and end times
@@ -251,7 +1063,7 @@ class StackdriverMetricClient(MetricClient):
         Returns:
             An instance of google.cloud.monitoring_v3.types.TimeInterval()
         """
-        interval = monitoring_v3.types.TimeInterval()  # pylint: disable=no-member
+        interval = raw_message(load_monitoring().types.TimeInterval())  # pylint: disable=no-member
         interval.end_time.seconds = int(end_time)
         interval.end_time.nanos = int(end_time_nanos)
         if start_time:
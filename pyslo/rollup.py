@@ -0,0 +1,356 @@
+"""Rollup
+
+RollupStore keeps good and valid event counts per group and time bucket
+on local disk, in minute, hour and day tiers, so that long windows can be
+answered without fetching or aggregating their points again. It is fed
+with the dataframes of successive fetches, and records which periods it
+has counted in the same way as DiskCacheMetricClient.
+
+A window is answered by summing the day buckets it covers, then the hour
+buckets between those and its edges, then the minute buckets, so a 30
+day window reads at most a few hundred buckets per group.
+
+Typical usage example::
+
+    from pyslo.rollup import RollupStore
+
+    sli.rollup_store = RollupStore('/var/lib/pyslo/my-slo', sli.group_by_labels)
+    sli.calculate_rollup()
+"""
+
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from .aggregator import Aggregator
+from .aggregator import PartialCounts
+from .metric_client import MetricClient
+from .metric_client import NoMetricDataAvailable
+from .metric_client.cache import DiskCacheMetricClient
+
+
+class RollupStore():
+    """Persistent good and valid counts per group and time bucket
+
+    Buckets are labelled by their end and hold the points ending within
+    (end - size, end], e.g. the minute bucket 12:01 holds the points after
+    12:00 up to and including 12:01. Only whole minutes within a fetched
+    period are counted, and counting a period again replaces its buckets,
+    so refetched points are not counted twice.
+
+    Each tier is saved as a numpy .npz file of four columns sorted by
+    bucket and group: the bucket end in seconds since the epoch, the
+    group id, the sum of good values and the number of valid values. Group
+    label values and the coverage are saved as json.
+
+    Attributes:
+        path:               directory the store is written to
+        group_by_labels:    list of label columns the counts are grouped by
+        refetch_margin:     seconds before the fetch time of a period that gaps
+                            treats as not yet counted, for points the backend
+                            writes late. default = 300
+        clock:              function returning the current time in seconds since
+                            the epoch. default = time.time
+        groups:             list of the label values of each group id
+        coverage:           list of [start, end, fetched_at] periods counted
+        value_dtype:        dtype name of the values counted, None until the first update
+
+    Args:
+        path:               directory of the store, created if missing. An existing
+                            store is loaded.
+        group_by_labels:    list of label columns, as named in metric_data
+
+    Raises:
+        ValueError if an existing store has other group by labels
+    """
+
+    # name: bucket size in seconds, finest first
+    TIERS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+    def __init__(self, path, group_by_labels, refetch_margin=300):
+        self.path = path
+        self.group_by_labels = list(group_by_labels)
+        self.refetch_margin = refetch_margin
+        self.clock = time.time
+        self.groups = []
+        self.coverage = []
+        self.value_dtype = None
+        self.tiers = {tier: RollupStore.empty_tier() for tier in RollupStore.TIERS}
+        self._group_ids = dict()
+        os.makedirs(path, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def empty_tier():
+        """Columns of a tier without buckets
+        """
+        return {
+            'bucket': np.zeros(0, dtype=np.int64),
+            'group': np.zeros(0, dtype=np.int64),
+            'good': np.zeros(0, dtype=np.float64),
+            'valid': np.zeros(0, dtype=np.int64),
+            }
+
+    @staticmethod
+    def floor(seconds, size):
+        """Round a time down to a whole number of size seconds
+        """
+        return int(np.floor(seconds / size)) * size
+
+    @staticmethod
+    def ceil(seconds, size):
+        """Round a time up to a whole number of size seconds
+        """
+        return int(np.ceil(seconds / size)) * size
+
+    def load(self):
+        """Load the store from path, if it has been saved
+
+        Raises:
+            ValueError if the saved store has other group by labels
+        """
+        metadata_path = os.path.join(self.path, 'rollup.json')
+        if not os.path.exists(metadata_path):
+            return
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata['group_by_labels'] != self.group_by_labels:
+            raise ValueError(
+                f"The store at {self.path} is grouped by {metadata['group_by_labels']}, "
+                f"not {self.group_by_labels}"
+                )
+        self.groups = [tuple(group) for group in metadata['groups']]
+        self._group_ids = {group: i for i, group in enumerate(self.groups)}
+        self.coverage = metadata['coverage']
+        self.value_dtype = metadata['value_dtype']
+        for tier in RollupStore.TIERS:
+            with np.load(os.path.join(self.path, f'{tier}.npz')) as columns:
+                self.tiers[tier] = {name: columns[name] for name in columns.files}
+
+    def save(self):
+        """Write the store to path
+        """
+        for tier, columns in self.tiers.items():
+            np.savez_compressed(os.path.join(self.path, f'{tier}.npz'), **columns)
+        with open(os.path.join(self.path, 'rollup.json'), 'w') as metadata_file:
+            json.dump({
+                'group_by_labels': self.group_by_labels,
+                'groups': [list(group) for group in self.groups],
+                'coverage': self.coverage,
+                'value_dtype': self.value_dtype,
+                }, metadata_file)
+
+    def group_ids(self, keys):
+        """Store group ids of group label values, adding new groups
+
+        Args:
+            keys: dataframe of group label values, as returned by Aggregator.factorize
+
+        Returns:
+            An int64 numpy array of the group id of each row of keys. Without
+            group by labels every row is in group 0.
+        """
+        ids = np.zeros(keys.shape[0], dtype=np.int64)
+        if len(self.group_by_labels) == 0:
+            return ids
+        for i, row in enumerate(keys.itertuples(index=False)):
+            group = tuple(value.item() if hasattr(value, 'item') else value for value in row)
+            if group not in self._group_ids:
+                self._group_ids[group] = len(self.groups)
+                self.groups.append(group)
+            ids[i] = self._group_ids[group]
+        return ids
+
+    def update(self, data, start, end, fetched_at=None):
+        """Count the points of a fetched period, replacing its buckets
+
+        Only the whole minutes within (start, end] are counted. Hour and day
+        buckets overlapping them are recalculated from the finer tier. The
+        store is saved afterwards.
+
+        Args:
+            data:       dataframe of metric data fetched for the period, or None if
+                        the period has no points
+            start:      start of the period in seconds since the epoch
+            end:        end of the period in seconds since the epoch
+            fetched_at: Optional. time the period was fetched. default = clock()
+        """
+        lower = RollupStore.ceil(start, 60)
+        upper = RollupStore.floor(end, 60)
+        if upper <= lower:
+            return
+        fetched_at = self.clock() if fetched_at is None else fetched_at
+
+        minutes = RollupStore.empty_tier()
+        if data is not None and data.shape[0] > 0:
+            if self.value_dtype is None:
+                self.value_dtype = str(data['value'].dtype)
+            group_codes, keys = Aggregator.factorize(data, self.group_by_labels)
+            ends = MetricClient.epoch_nanos(data['end_timestamp'])
+            buckets = -(-ends // (60 * 10**9)) * 60
+            keep = (group_codes >= 0) & (buckets > lower) & (buckets <= upper)
+            values = data['value'].to_numpy(np.float64)[keep]
+            not_null = ~np.isnan(values)
+            minutes = RollupStore.reduce(
+                buckets[keep], self.group_ids(keys)[group_codes[keep]],
+                np.where(not_null, values, 0), not_null.astype(np.int64), 60
+                )
+        self.replace('minute', lower, upper, minutes)
+
+        tiers = list(RollupStore.TIERS.items())
+        for (finer, _), (tier, size) in zip(tiers[:-1], tiers[1:]):
+            lower, upper = RollupStore.floor(lower, size), RollupStore.ceil(upper, size)
+            columns = self.tiers[finer]
+            first, last = np.searchsorted(columns['bucket'], [lower, upper], side='right')
+            self.replace(tier, lower, upper, RollupStore.reduce(
+                -(-columns['bucket'][first:last] // size) * size,
+                columns['group'][first:last],
+                columns['good'][first:last],
+                columns['valid'][first:last],
+                size
+                ))
+
+        self.coverage = DiskCacheMetricClient.add_coverage(
+            self.coverage, [RollupStore.ceil(start, 60), RollupStore.floor(end, 60), fetched_at],
+            self.refetch_margin
+            )
+        self.save()
+
+    @staticmethod
+    def reduce(buckets, groups, good, valid, size):
+        """Sum counts by bucket and group
+
+        Args:
+            buckets:    int64 array of bucket ends, multiples of size
+            groups:     int64 array of group ids
+            good:       float64 array of good counts
+            valid:      int64 array of valid counts
+            size:       bucket size in seconds
+
+        Returns:
+            A dictionary of the bucket, group, good and valid columns, sorted by
+            bucket and group
+        """
+        if len(buckets) == 0:
+            return RollupStore.empty_tier()
+        n_groups = int(groups.max()) + 1
+        first = buckets.min()
+        combined = ((buckets - first) // size) * n_groups + groups
+        present, inverse = np.unique(combined, return_inverse=True)
+        return {
+            'bucket': first + (present // n_groups) * size,
+            'group': present % n_groups,
+            'good': np.bincount(inverse, weights=good, minlength=len(present)),
+            'valid': np.rint(np.bincount(
+                inverse, weights=valid, minlength=len(present))).astype(np.int64),
+            }
+
+    def replace(self, tier, lower, upper, columns):
+        """Replace the buckets of a tier ending within (lower, upper]
+
+        Args:
+            tier:       name of the tier
+            lower:      buckets ending after lower are replaced
+            upper:      buckets ending at or before upper are replaced
+            columns:    dictionary of the new bucket, group, good and valid columns
+        """
+        current = self.tiers[tier]
+        keep = (current['bucket'] <= lower) | (current['bucket'] > upper)
+        merged = {
+            name: np.concatenate([current[name][keep], columns[name]]) for name in current
+            }
+        order = np.lexsort((merged['group'], merged['bucket']))
+        self.tiers[tier] = {name: column[order] for name, column in merged.items()}
+
+    def gaps(self, start, end):
+        """The parts of a window that are not counted yet
+
+        The window is rounded down to whole minutes. Periods counted less than
+        refetch_margin seconds after their end are only trusted up to
+        refetch_margin before they were fetched.
+
+        Args:
+            start:  start of the window in seconds since the epoch
+            end:    end of the window in seconds since the epoch
+
+        Returns:
+            A list of [start, end] periods, in time order
+        """
+        trusted = [
+            [c_start, min(c_end, RollupStore.floor(c_fetched - self.refetch_margin, 60))]
+            for c_start, c_end, c_fetched in self.coverage
+            ]
+        return DiskCacheMetricClient.gaps(
+            RollupStore.floor(start, 60), RollupStore.floor(end, 60), trusted
+            )
+
+    def cover(self, start, end, sizes=None):
+        """Fewest buckets covering a period
+
+        Args:
+            start:  start of the period, a whole minute
+            end:    end of the period, a whole minute
+            sizes:  Optional. list of (tier, size) to use, coarsest first.
+                    default = every tier
+
+        Returns:
+            A list of (tier, lower, upper) tuples, the tier buckets ending within
+            (lower, upper] making up the period
+        """
+        if sizes is None:
+            sizes = list(reversed(list(RollupStore.TIERS.items())))
+        if end <= start or len(sizes) == 0:
+            return []
+        (tier, size), finer = sizes[0], sizes[1:]
+        lower, upper = RollupStore.ceil(start, size), RollupStore.floor(end, size)
+        if lower >= upper:
+            return self.cover(start, end, finer)
+        return self.cover(start, lower, finer) + [(tier, lower, upper)] + \
+            self.cover(upper, end, finer)
+
+    def counts(self, start, end):
+        """Good and valid counts per group over a window
+
+        The window, (start, end], is rounded down to whole minutes.
+
+        Args:
+            start:  start of the window in seconds since the epoch
+            end:    end of the window in seconds since the epoch
+
+        Returns:
+            A dataframe with a column per group by label, plus count_good and
+            count_valid, as returned by Aggregator.aggregate
+
+        Raises:
+            NoMetricDataAvailable if no group has points in the window
+        """
+        # Without group by labels there are no stored groups, but one group id
+        n_groups = max(len(self.groups), 1)
+        count_good = np.zeros(n_groups, dtype=np.float64)
+        count_valid = np.zeros(n_groups, dtype=np.int64)
+        present = np.zeros(n_groups, dtype=bool)
+        for tier, lower, upper in self.cover(
+                RollupStore.floor(start, 60), RollupStore.floor(end, 60)):
+            columns = self.tiers[tier]
+            first, last = np.searchsorted(columns['bucket'], [lower, upper], side='right')
+            groups = columns['group'][first:last]
+            count_good += np.bincount(
+                groups, weights=columns['good'][first:last], minlength=n_groups
+                )
+            count_valid += np.bincount(
+                groups, weights=columns['valid'][first:last], minlength=n_groups
+                ).astype(np.int64)
+            present[groups] = True
+        if not present.any():
+            raise NoMetricDataAvailable
+
+        ids = np.flatnonzero(present)
+        if len(self.group_by_labels) == 0:
+            keys = pd.DataFrame(index=range(len(ids)))
+        else:
+            keys = pd.DataFrame([self.groups[i] for i in ids], columns=self.group_by_labels)
+        counts = Aggregator.counts_frame(
+            keys, count_good[ids], count_valid[ids], np.dtype(self.value_dtype)
+            )
+        return PartialCounts.merge([counts], self.group_by_labels)
@@ -6,7 +6,7 @@ in common backends in accordance with the logic set out in the
 
 Typical usage example::
 
-    from google.cloud import monitoring_v3
+    from pyslo.metric_client import ValueType
     from pyslo.metric_client.stackdriver import StackdriverMetricClient
     from pyslo.sli import Sli
 
@@ -15,7 +15,7 @@ Typical usage example::
     metric_client = StackdriverMetricClient(project=PROJECT)
     metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
     metric_client.resource_type = 'cloud_composer_environment'
-    metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    metric_client.value_type = ValueType.BOOL
 
     sli = Sli(metric_client)
 
@@ -38,13 +38,18 @@ Typical usage example::
 """
 
 import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
-from google.cloud import monitoring_v3
+import numpy as np
 import pandas as pd
 from .metric_client import MetricClient
-
-MetricDescriptor = monitoring_v3.enums.MetricDescriptor
+from .metric_client import MetricKind
+from .metric_client import NoMetricDataAvailable
+from .metric_client import ValueType
+from .aggregator import FactorizedAggregator
+from .aggregator import PartialCounts
 
 
 class SliException():
@@ -63,6 +68,19 @@ class SliException():
         """
 
 
+    class ParityCheckFailed(Exception):
+        """Parity Check Failed exception
+        Used when counts aligned by the metric backend do not match the counts
+        calculated from the raw points
+        """
+
+
+    class MemoryBudgetExceeded(Exception):
+        """Memory Budget Exceeded exception
+        Used when the preflight estimate of a fetch is larger than memory_budget
+        """
+
+
 class Sli():
     """Sli object for calculating sli/slo data
 
@@ -71,23 +89,107 @@ class Sli():
                             to retrieve timeseries data.
         metric_data:        dataframe containing timeseries metric data. Either
                             provided manually or by the get_metric_data method
+        total_metric_client:    if set, a MetricClient retrieving the valid events of
+                            a ratio SLI, whose good events are retrieved by
+                            metric_client. default = None
+        total_metric_data:  dataframe of the total_metric_client timeseries data, set
+                            by get_metric_data
         window_end:         End of the window used to retrieve timeseries data
                             and calculate the sli. As seconds from the epoch,
                             eg time.time()
         window_length:      number of days over which to calculate the sli
         slo:                The service level objective e.g. 0.999
         group_by_labels:    metric labels by which to group sli calculation
+        aggregator:         An instance of an Aggregator backend used to count good
+                            and valid events. default = FactorizedAggregator()
+        alignment_period:   seconds per count when the metric backend aligns points,
+                            see calculate_aligned. default = 3600
+        parity_check_seconds:   if set, calculate_aligned compares the aligned counts of
+                            the last parity_check_seconds of the window with counts from
+                            the raw points. default = None
+        parity_tolerance:   relative difference allowed by the parity check. default = 0
+        threshold:          for DISTRIBUTION, INT64 and DOUBLE metrics, values that
+                            compare to threshold with comparator, e.g. a latency at
+                            or below it, are good events. A list of thresholds is
+                            calculated in one pass, with a row per threshold and
+                            group. default = None
+        comparator:         one of '<', '<=', '>', '>=', the comparison of a value
+                            with threshold that makes a good event. default = '<='
+        group_by_sets:      list of group by sets, each calculated as a level by
+                            calculate_lattice. A set is a dict of the label names
+                            under 'resource' and 'metric', named as in
+                            group_by_resource_labels and group_by_metric_labels,
+                            e.g. [{}, {'resource': ['project_id']}]. default = []
+        memory_budget:      if set, the bytes of metric data get_metric_data may fetch,
+                            checked against the metric client's preflight estimate.
+                            Also the bytes calculate_chunked sizes its chunks and
+                            running counts to. default = None
+        memory_budget_action:   'raise' to refuse fetches over memory_budget, or 'warn'
+                            to warn and fetch anyway. default = 'raise'
+        chunk_seconds:      if set, the length of the chunks of calculate_chunked,
+                            rather than sizing them to memory_budget. default = None
+        spill_path:         directory in which calculate_chunked spills running counts
+                            that outgrow memory_budget. default = None, the system
+                            temporary directory
+        rollup_store:       if set, a pyslo.rollup.RollupStore that get_metric_data
+                            counts metric_data into, and calculate_rollup answers
+                            from. default = None
+        instrumentation:    pyslo.instrumentation.Instrumentation that the fetch and
+                            calculate stages are timed and counted with.
+                            default = the instrumentation of metric_client
     """
 
-    def __init__(self, metric_client=MetricClient()):
-        self.metric_client = metric_client
+    # Peak memory of fetching a chunk relative to the preflight estimate of its
+    # dataframe, as decode buffers are held alongside the dataframe being built
+    CHUNK_OVERHEAD = 3
+
+    # Vectorized comparisons for the comparator attribute
+    COMPARATORS = {
+        '<': np.less,
+        '<=': np.less_equal,
+        '>': np.greater,
+        '>=': np.greater_equal,
+    }
+
+    def __init__(self, metric_client=None):
+        self.metric_client = MetricClient() if metric_client is None else metric_client
         self.metric_data = None
+        self.total_metric_client = None
+        self.total_metric_data = None
         self.window_end = time.time()
         self.window_length = 0
         self.slo = None
         self.slo_data = None
         self.group_by_resource_labels = []
         self.group_by_metric_labels = []
+        self.aggregator = FactorizedAggregator()
+        self.alignment_period = 3600
+        self.parity_check_seconds = None
+        self.parity_tolerance = 0
+        self.threshold = None
+        self.comparator = '<='
+        self.group_by_sets = []
+        self.memory_budget = None
+        self.memory_budget_action = 'raise'
+        self.chunk_seconds = None
+        self.spill_path = None
+        self.rollup_store = None
+        self._instrumentation = None
+
+    @property
+    def instrumentation(self):
+        """Instrumentation of the Sli, or else of its metric client
+
+        Returns:
+            A pyslo.instrumentation.Instrumentation
+        """
+        if self._instrumentation is None:
+            return self.metric_client.instrumentation
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, instrumentation):
+        self._instrumentation = instrumentation
 
     @property
     def group_by_labels(self):
@@ -99,13 +201,41 @@ class Sli():
             During the combination of the lists, the label names are prepended,
             according to the prepend_key function in the associated metric client.
         """
-        resource_labels = [
-            self.metric_client.prepend_key(l, 'resource') for l in self.group_by_resource_labels
-            ]
-        metric_labels = [
-            self.metric_client.prepend_key(l, 'metric') for l in self.group_by_metric_labels
+        return self.prepend_labels({
+            'resource': self.group_by_resource_labels,
+            'metric': self.group_by_metric_labels,
+            })
+
+    def prepend_labels(self, group_by_set):
+        """Label columns of a group by set
+
+        Args:
+            group_by_set: dict of label names under 'resource' and 'metric'
+
+        Returns:
+            A list of the resource then metric labels, prepended according to
+            the prepend_key function in the associated metric client.
+
+        Raises:
+            ValueError if the set has other keys
+        """
+        unknown = set(group_by_set) - {'resource', 'metric'}
+        if unknown:
+            raise ValueError(f"Group by sets only have resource and metric labels, not {unknown}")
+        return [
+            self.metric_client.prepend_key(label, prepend)
+            for prepend in ('resource', 'metric')
+            for label in group_by_set.get(prepend, [])
             ]
-        return resource_labels + metric_labels
+
+    @property
+    def group_by_set_labels(self):
+        """Label columns of each set in group_by_sets
+
+        Returns:
+            A list of lists of prepended label names
+        """
+        return [self.prepend_labels(group_by_set) for group_by_set in self.group_by_sets]
 
     @staticmethod
     def days_to_seconds(days):
@@ -140,33 +270,521 @@ class Sli():
     def get_metric_data(self):
         """Retrieve metric data from the metric_client
 
+        For ratio SLIs the good and total metrics are fetched concurrently and
+        the total assigned to total_metric_data.
+
+        If rollup_store is set, metric_data is also counted into it.
+
         Returns:
             None. Assigns timeseries data to attribute metric_data
         """
         if self.window_length is None:
             raise SliException.ValueNotSet("window_length cannot be None")
-        self.metric_data = self.metric_client.timeseries_dataframe(
+        with self.instrumentation.span('get_metric_data') as span:
+            if self.memory_budget is not None:
+                self.check_memory_budget()
+            if self.total_metric_client is None:
+                self.metric_data = self.metric_client.timeseries_dataframe(
+                    **self.fetch_arguments(self.metric_client)
+                    )
+            else:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    good, total = [
+                        executor.submit(
+                            client.timeseries_dataframe, **self.fetch_arguments(client)
+                            )
+                        for client in (self.metric_client, self.total_metric_client)
+                        ]
+                    self.metric_data = good.result()
+                    self.total_metric_data = total.result()
+                span.count('rows', self.total_metric_data.shape[0])
+            span.count('rows', self.metric_data.shape[0])
+        if self.rollup_store is not None and self.total_metric_client is None:
+            self.rollup_store.update(self.metric_data, self.window_start, self.window_end)
+
+    @property
+    def label_columns(self):
+        """Label columns needed by the calculations
+
+        Returns:
+            A list of group_by_labels followed by any other label in group_by_sets
+        """
+        labels = self.group_by_labels
+        for group_by_set in self.group_by_set_labels:
+            labels += [label for label in group_by_set if label not in labels]
+        return labels
+
+    def fetch_arguments(self, metric_client):
+        """Keyword arguments to fetch the window from a metric client
+
+        Clients that support projection are only asked for label_columns.
+
+        Args:
+            metric_client: the MetricClient the window is fetched from
+
+        Returns:
+            A dictionary of keyword arguments for timeseries_dataframe or
+            timeseries_chunks
+        """
+        arguments = dict(end=self.window_end, duration=self.window_length_seconds)
+        if metric_client.supports_projection:
+            arguments['label_columns'] = self.label_columns
+        return arguments
+
+    def check_memory_budget(self):
+        """Compare the preflight estimate of fetching the window with memory_budget
+
+        Returns:
+            The metric client's Preflight, or None if the client does not
+            support preflight, in which case nothing is checked.
+
+        Raises:
+            SliException.MemoryBudgetExceeded if the estimate is over memory_budget
+            and memory_budget_action is 'raise'
+        """
+        preflight = self.metric_client.preflight(
+            end=self.window_end, duration=self.window_length_seconds
+            )
+        if preflight is None or preflight.estimated_bytes <= self.memory_budget:
+            return preflight
+        message = (
+            f"Fetching the window is estimated to need {preflight.estimated_bytes} bytes, "
+            f"over the memory budget of {self.memory_budget}: {preflight.series} series, "
+            f"{preflight.estimated_points} points, "
+            f"{preflight.estimated_groups(self.group_by_labels)} groups. "
+            f"Label cardinalities: {preflight.cardinality}"
+            )
+        if self.memory_budget_action == 'warn':
+            warnings.warn(message)
+        else:
+            raise SliException.MemoryBudgetExceeded(message)
+        return preflight
+
+    async def aget_metric_data(self):
+        """Async counterpart of get_metric_data
+
+        Returns:
+            None. Assigns timeseries data to attribute metric_data
+        """
+        if self.window_length is None:
+            raise SliException.ValueNotSet("window_length cannot be None")
+        self.metric_data = await self.metric_client.atimeseries_dataframe(
             end=self.window_end, duration=self.window_length_seconds
             )
 
     def calculate(self):
         """Calculate SLI based on metric type
 
-        Only boolean is supported right now
+        Boolean metrics are supported, distribution, int64 and double metrics
+        against threshold, and ratio SLIs if total_metric_client is set.
         Returns:
             None. Assigns the calculate slo data to attribute slo_data
         """
-        if self.metric_client.value_type == MetricDescriptor.ValueType.BOOL:
-            self.calc_bool()
+        with self.instrumentation.span('calculate') as span:
+            if self.total_metric_client is not None:
+                self.calc_ratio()
+            elif self.metric_client.value_type == ValueType.BOOL:
+                self.calc_bool()
+            elif self.metric_client.value_type == ValueType.DISTRIBUTION:
+                self.calc_distribution()
+            elif self.metric_client.value_type in (
+                    ValueType.INT64, ValueType.DOUBLE):
+                self.calc_threshold()
+            else:
+                raise SliException.UnsupportedMetricType
             self.add_period()
             self.add_slo()
-            return self.slo_data
-        elif self.metric_client.value_type == 'Some other type':
-            # TODO
-            pass
+            span.count('rows', self.metric_data.shape[0])
+            span.count('groups', self.slo_data.shape[0])
+        return self.slo_data
+
+    def calculate_streaming(self):
+        """Calculate SLI and error budget without materializing metric_data
+
+        Chunks of the window are fetched with the metric client's
+        timeseries_chunks, reduced to good and valid counts per group and
+        merged into running totals, so memory grows with the number of groups
+        rather than the number of points. metric_data is left untouched.
+
+        Only boolean is supported right now
+        Returns:
+            Dataframe of SLO data, the same as calculate followed by error_budget.
+            Attribute slo_data is also assigned return value
+        """
+        if self.window_length is None:
+            raise SliException.ValueNotSet("window_length cannot be None")
+        if self.metric_client.value_type != ValueType.BOOL:
+            raise SliException.UnsupportedMetricType
+
+        with self.instrumentation.span('calculate_streaming') as span:
+            counts = PartialCounts(self.group_by_labels)
+            chunks = self.metric_client.timeseries_chunks(
+                **self.fetch_arguments(self.metric_client)
+                )
+            for chunk in chunks:
+                counts.update(self.aggregator.aggregate(chunk, self.group_by_labels))
+                span.count('chunks')
+                span.count('rows', chunk.shape[0])
+            if counts.counts is None:
+                raise NoMetricDataAvailable
+            span.count('groups', counts.counts.shape[0])
+
+        slo_data = counts.counts
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+        self.slo_data = slo_data
+        self.add_period()
+        self.add_slo()
+        return self.error_budget()
+
+    def calculate_chunked(self):
+        """Calculate SLI fetching the window in chunks sized to memory_budget
+
+        The window is split into time chunks, each fetched with
+        timeseries_dataframe, reduced to good and valid counts per group with
+        aggregator and discarded before the next is fetched. Half of
+        memory_budget is given to fetching a chunk and half to the running
+        counts, which are spilled to spill_path if they outgrow it.
+        metric_data is left untouched, and slo_data is the same as
+        get_metric_data followed by calculate.
+
+        Only boolean is supported right now
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+
+        Raises:
+            SliException.ValueNotSet if neither memory_budget nor chunk_seconds is
+            set, or only memory_budget is set and the metric client has no preflight
+        """
+        if self.window_length is None:
+            raise SliException.ValueNotSet("window_length cannot be None")
+        if self.metric_client.value_type != ValueType.BOOL:
+            raise SliException.UnsupportedMetricType
+
+        max_bytes = None if self.memory_budget is None else self.memory_budget // 2
+        counts = PartialCounts(self.group_by_labels, max_bytes, self.spill_path)
+        with self.instrumentation.span('calculate_chunked') as span:
+            for start, end in self.chunk_intervals():
+                arguments = self.fetch_arguments(self.metric_client)
+                arguments.update(end=end, duration=end - start)
+                try:
+                    chunk = self.metric_client.timeseries_dataframe(**arguments)
+                except NoMetricDataAvailable:
+                    continue
+                # Points on the boundary with the previous chunk were counted there
+                if start > self.window_start:
+                    boundary = pd.Timestamp(start, unit='s', tz='UTC')
+                    chunk = chunk[chunk['end_timestamp'] > boundary]
+                counts.update(self.aggregator.aggregate(chunk, self.group_by_labels))
+                span.count('chunks')
+                span.count('rows', chunk.shape[0])
+                del chunk
+            # result resets the spill count
+            spills = counts.spills
+            slo_data = counts.result()
+            if slo_data is None:
+                raise NoMetricDataAvailable
+            span.count('spills', spills)
+            span.count('groups', slo_data.shape[0])
+
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+        self.slo_data = slo_data
+        self.add_period()
+        self.add_slo()
+        return self.slo_data
+
+    def chunk_intervals(self):
+        """Split the window into the chunks of calculate_chunked
+
+        Chunks are chunk_seconds long, or else as many as needed for the
+        preflight estimate of each, times CHUNK_OVERHEAD, to fit in half of
+        memory_budget. Boundaries between chunks are whole seconds.
+
+        Returns:
+            A list of (start, end) tuples in seconds since the epoch, oldest first
+
+        Raises:
+            SliException.ValueNotSet if the chunk length cannot be determined
+        """
+        if self.chunk_seconds is not None:
+            n_chunks = int(np.ceil(self.window_length_seconds / self.chunk_seconds))
+        elif self.memory_budget is not None:
+            preflight = self.metric_client.preflight(
+                end=self.window_end, duration=self.window_length_seconds
+                )
+            if preflight is None:
+                raise SliException.ValueNotSet(
+                    "chunk_seconds must be set as the metric client has no preflight"
+                    )
+            n_chunks = int(np.ceil(
+                preflight.estimated_bytes * Sli.CHUNK_OVERHEAD / (self.memory_budget / 2)
+                ))
+        else:
+            raise SliException.ValueNotSet("memory_budget or chunk_seconds must be set")
+
+        n_chunks = max(n_chunks, 1)
+        edges = np.unique(np.linspace(
+            int(self.window_start), int(self.window_end), n_chunks + 1
+            ).astype(np.int64))[1:-1].tolist()
+        edges = [self.window_start] + [edge for edge in edges if edge > self.window_start]
+        return list(zip(edges, edges[1:] + [self.window_end]))
+
+    def calculate_rollup(self):
+        """Calculate SLI from the counts of rollup_store
+
+        Only the parts of the window not yet counted by rollup_store are
+        fetched and counted, then the window is answered from its day, hour
+        and minute buckets. The window is rounded down to whole minutes, and
+        excludes points ending exactly at window_start. metric_data is left
+        untouched.
+
+        Only boolean is supported right now
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+
+        Raises:
+            SliException.ValueNotSet if rollup_store is not set
+            ValueError if rollup_store is grouped by other labels than group_by_labels
+        """
+        if self.window_length is None:
+            raise SliException.ValueNotSet("window_length cannot be None")
+        if self.rollup_store is None:
+            raise SliException.ValueNotSet("rollup_store has not been defined")
+        if self.metric_client.value_type != ValueType.BOOL:
+            raise SliException.UnsupportedMetricType
+        if self.rollup_store.group_by_labels != self.group_by_labels:
+            raise ValueError(
+                f"rollup_store is grouped by {self.rollup_store.group_by_labels}, "
+                f"not {self.group_by_labels}"
+                )
+
+        with self.instrumentation.span('calculate_rollup') as span:
+            for start, end in self.rollup_store.gaps(self.window_start, self.window_end):
+                fetched_at = self.rollup_store.clock()
+                arguments = self.fetch_arguments(self.metric_client)
+                arguments.update(end=end, duration=end - start)
+                try:
+                    data = self.metric_client.timeseries_dataframe(**arguments)
+                except NoMetricDataAvailable:
+                    data = None
+                self.rollup_store.update(data, start, end, fetched_at)
+                span.count('gaps')
+            slo_data = self.rollup_store.counts(self.window_start, self.window_end)
+            span.count('groups', slo_data.shape[0])
+
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+        self.slo_data = slo_data
+        self.add_period()
+        self.add_slo()
+        return self.slo_data
+
+    def calculate_aligned(self):
+        """Calculate SLI from good and valid counts aligned by the metric backend
+
+        Only the per alignment_period counts are transferred, not the raw
+        points. metric_data is left untouched. If parity_check_seconds is
+        set, check_parity is run first.
+
+        Only boolean is supported right now
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+        """
+        if self.window_length is None:
+            raise SliException.ValueNotSet("window_length cannot be None")
+        if self.metric_client.value_type != ValueType.BOOL:
+            raise SliException.UnsupportedMetricType
+        if self.parity_check_seconds:
+            self.check_parity()
+
+        with self.instrumentation.span('calculate_aligned') as span:
+            slo_data = self.aligned_counts(self.window_length_seconds)
+            span.count('groups', slo_data.shape[0])
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+        self.slo_data = slo_data
+        self.add_period()
+        self.add_slo()
+        return self.slo_data
+
+    def aligned_counts(self, duration):
+        """Fetch aligned counts for the end of the window and total them by group
+
+        Args:
+            duration: seconds back from window_end to count
+
+        Returns:
+            A dataframe with a column per group by label, plus count_good and count_valid
+        """
+        counts = self.metric_client.aligned_counts(
+            end=self.window_end,
+            duration=duration,
+            alignment_period=self.alignment_period,
+            resource_labels=self.group_by_resource_labels,
+            metric_labels=self.group_by_metric_labels
+            )
+        return PartialCounts.merge([counts], self.group_by_labels)
+
+    def check_parity(self):
+        """Compare aligned counts with counts calculated from raw points
+
+        The last parity_check_seconds of the window are fetched both ways.
+
+        Returns:
+            Dataframe of the aligned and raw counts per group
+
+        Raises:
+            SliException.ParityCheckFailed if any count differs by more than
+            parity_tolerance
+        """
+        aligned = self.aligned_counts(self.parity_check_seconds)
+        raw = self.aggregator.aggregate(
+            self.metric_client.timeseries_dataframe(
+                end=self.window_end, duration=self.parity_check_seconds
+                ),
+            self.group_by_labels
+            )
+        if len(self.group_by_labels) > 0:
+            parity = aligned.merge(
+                raw, how='outer', on=self.group_by_labels, suffixes=('_aligned', '_raw')
+                ).fillna(0)
         else:
+            parity = aligned.join(raw, lsuffix='_aligned', rsuffix='_raw')
+        for column in ['count_good', 'count_valid']:
+            expected = parity[f'{column}_raw']
+            difference = (parity[f'{column}_aligned'] - expected).abs()
+            if (difference > self.parity_tolerance * expected).any():
+                raise SliException.ParityCheckFailed(
+                    f"Aligned {column} differs from raw points:\n{parity}"
+                    )
+        return parity
+
+    def calculate_lattice(self):
+        """Calculate SLI for every group by set in group_by_sets in one pass
+
+        metric_data is aggregated once by the union of the labels of every
+        set, with missing label values kept as their own group. Each set is
+        then rolled up from those counts, like a cube or rollup, and groups
+        with a missing label in the set are dropped as in calculate.
+
+        Only boolean is supported right now
+        Returns:
+            Dataframe of SLO data with a level column, the comma separated label
+            columns of the set each row belongs to ('' for no grouping), a column per
+            label column in any set, null where not in the row's set, plus count_good,
+            count_valid and sli. Attribute slo_data is also assigned return value
+        """
+        if self.metric_client.value_type != ValueType.BOOL:
             raise SliException.UnsupportedMetricType
 
+        with self.instrumentation.span('calculate_lattice') as span:
+            slo_data = self.lattice_counts()
+            span.count('rows', self.metric_data.shape[0])
+            span.count('groups', slo_data.shape[0])
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+        self.slo_data = slo_data
+        self.add_period()
+        self.add_slo()
+        return self.slo_data
+
+    def lattice_counts(self):
+        """Good and valid counts of every group by set, see calculate_lattice
+
+        Returns:
+            Dataframe with a level column, a column per label in any set, plus
+            count_good and count_valid
+        """
+        group_by_sets = self.group_by_set_labels
+        labels = []
+        for group_by_set in group_by_sets:
+            labels += [label for label in group_by_set if label not in labels]
+
+        # Replace labels with their codes shifted by one, so missing values are
+        # the valid code 0 at the finest level.
+        codes = pd.DataFrame(index=self.metric_data.index)
+        uniques = dict()
+        for label in labels:
+            label_codes, uniques[label] = self.aggregator.factorize_column(
+                self.metric_data[label]
+                )
+            codes[label] = label_codes + 1
+        codes['value'] = self.metric_data['value']
+        finest = self.aggregator.aggregate(codes, labels)
+
+        levels = []
+        for group_by_set in group_by_sets:
+            level = PartialCounts.merge([finest], group_by_set)
+            level = level[(level[group_by_set] > 0).all(axis=1)]
+            for label in group_by_set:
+                level[label] = np.asarray(uniques[label].take(level[label].to_numpy() - 1))
+            level.insert(0, 'level', ','.join(group_by_set))
+            levels.append(level)
+
+        slo_data = pd.concat(levels, ignore_index=True)
+        return slo_data[['level'] + labels + ['count_good', 'count_valid']]
+
+    def burn_rates(self, windows):
+        """Calculate burn rates over several lookback windows from metric_data
+
+        Points are sorted once by group and end timestamp. Good and valid
+        counts for every window are then differences of cumulative sums,
+        located per group with a binary search, so one fetch of the longest
+        window serves every shorter window. metric_data should cover the
+        longest window, which is counted back from window_end.
+
+        Only boolean is supported right now
+        Args:
+            windows: list of lookback windows in seconds, e.g. [3600, 6 * 3600]
+
+        Returns:
+            Dataframe with a column per group by label, plus window (seconds),
+            count_good, count_valid, sli and burn_rate, the rate the error budget
+            is consumed relative to slo. Groups with no points in a window have a
+            count_valid of 0 and a null sli and burn_rate.
+
+        Raises:
+            SliException.ValueNotSet if metric_data or slo is not set
+        """
+        if self.metric_data is None:
+            raise SliException.ValueNotSet("metric_data has not been retrieved")
+        if not self.slo:
+            raise SliException.ValueNotSet("slo has not been defined")
+        if self.metric_client.value_type != ValueType.BOOL:
+            raise SliException.UnsupportedMetricType
+
+        data = self.metric_data
+        group_codes, keys = self.aggregator.factorize(data, self.group_by_labels)
+        values = data['value'].to_numpy(np.float64)
+        timestamps = MetricClient.epoch_nanos(data['end_timestamp'])
+        keep = (group_codes >= 0) & ~np.isnan(values)
+        group_codes, values, timestamps = group_codes[keep], values[keep], timestamps[keep]
+
+        # Rank the timestamps so that (group, time) packs into a single sortable
+        # int64 without overflowing.
+        times = np.unique(timestamps)
+        n_ranks = len(times) + 1
+        composite = group_codes * n_ranks + np.searchsorted(times, timestamps)
+        order = np.argsort(composite, kind='stable')
+        composite = composite[order]
+        cum_good = np.concatenate(([0], np.cumsum(values[order])))
+
+        groups = np.arange(keys.shape[0], dtype=np.int64) * n_ranks
+        end = pd.Timestamp(self.window_end, unit='s', tz='UTC').value
+        upper = np.searchsorted(composite, groups + np.searchsorted(times, end, side='right'))
+        frames = []
+        for window in windows:
+            start = pd.Timestamp(self.window_end - window, unit='s', tz='UTC').value
+            lower = np.searchsorted(
+                composite, groups + np.searchsorted(times, start, side='left')
+                )
+            frame = self.aggregator.counts_frame(
+                keys, cum_good[upper] - cum_good[lower], upper - lower, data['value'].dtype
+                )
+            frame.insert(len(keys.columns), 'window', window)
+            frames.append(frame)
+
+        burn_rates = pd.concat(frames, ignore_index=True)
+        burn_rates['sli'] = burn_rates['count_good']/burn_rates['count_valid']
+        burn_rates['burn_rate'] = (1 - burn_rates['sli'])/(1 - self.slo)
+        return burn_rates
+
     def calc_bool(self):
         """Run the bool calculation depending on presence of group bys
 
@@ -184,45 +802,276 @@ class Sli():
         Returns:
             Dataframe of SLO data. Attribute slo_data is also assigned return value
         """
-        good_events = self.metric_data.groupby(
-            self.group_by_labels
-            ).sum().reset_index().rename(columns={'value': 'count_good'})
+        slo_data = self.aggregate(self.group_by_labels)
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
 
-        valid_events = self.metric_data.groupby(
-            self.group_by_labels
-            ).count().reset_index().rename(
-                columns={'value': 'count_valid'}
-                )['count_valid']
+        self.slo_data = slo_data
+        return self.slo_data
 
-        slo_data = good_events.merge(
-            valid_events,
-            how='left',
-            left_index=True,
-            right_index=True)
+    def calc_bool_simple(self):
+        """Calculate sli over the entire dataframe with no aggregation by labels
 
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+        """
+        slo_data = self.aggregate([])
         slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
 
         self.slo_data = slo_data
         return self.slo_data
 
-    def calc_bool_simple(self):
-        """Calculate sli over the entire dataframe with no aggregation by labels
+    def aggregate(self, group_by_labels):
+        """Count good and valid events of metric_data with aggregator
+
+        Timed as an aggregate span of instrumentation.
+
+        Args:
+            group_by_labels: list of label columns to group by
+
+        Returns:
+            A dataframe with a column per group by label, plus count_good and count_valid
+        """
+        with self.instrumentation.span(
+                'aggregate', aggregator=type(self.aggregator).__name__) as span:
+            counts = self.aggregator.aggregate(self.metric_data, group_by_labels)
+            span.count('rows', self.metric_data.shape[0])
+            span.count('groups', counts.shape[0])
+        return counts
+
+    def calc_ratio(self):
+        """Calculate sli of a ratio SLI, summing ratio_counts over the window
 
         Returns:
             Dataframe of SLO data. Attribute slo_data is also assigned return value
         """
-        valid_events = self.metric_data.shape[0]
-        good_events = self.metric_data['value'].sum()
-        self.slo_data = pd.DataFrame([
-            {
-                'count_good': good_events,
-                'count_valid': valid_events,
-                'sli': good_events/valid_events
-                }
+        slo_data = PartialCounts.merge([self.ratio_counts()], self.group_by_labels)
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+
+        self.slo_data = slo_data
+        return self.slo_data
+
+    def ratio_counts(self):
+        """Align good and total metric data by group and alignment_period bucket
+
+        Both frames are factorized together on the group by labels and the
+        alignment bucket of each point, so each row is mapped to a shared
+        (group, bucket) code, then the values of each frame are summed per
+        code with bincount. No merge of the frames is made.
+
+        Returns:
+            Dataframe with a column per group by label, plus end_timestamp, the
+            end of the alignment bucket, count_good, the sum of metric_data values,
+            and count_valid, the sum of total_metric_data values. Buckets ending at
+            window_end.
+        """
+        labels = self.group_by_labels
+        end = pd.Timestamp(self.window_end, unit='s', tz='UTC').value
+        period = int(self.alignment_period * 10**9)
+        frames = []
+        for data in (self.metric_data, self.total_metric_data):
+            ages = end - MetricClient.epoch_nanos(data['end_timestamp'])
+            frame = data[labels].copy()
+            frame['end_timestamp'] = end - (ages // period) * period
+            frames.append(frame)
+        n_good = frames[0].shape[0]
+        group_codes, keys = self.aggregator.factorize(
+            MetricClient.concat_frames(frames), labels + ['end_timestamp']
+            )
+        keys['end_timestamp'] = pd.to_datetime(keys['end_timestamp'], unit='ns', utc=True)
+
+        count_good, _ = FactorizedAggregator.reduce(
+            group_codes[:n_good], self.metric_data['value'].to_numpy(), keys.shape[0]
+            )
+        count_valid, _ = FactorizedAggregator.reduce(
+            group_codes[n_good:], self.total_metric_data['value'].to_numpy(), keys.shape[0]
+            )
+        return self.aggregator.counts_frame(
+            keys, count_good, np.rint(count_valid), self.metric_data['value'].dtype
+            )
+
+    def calc_threshold(self):
+        """Calculate sli of an INT64 or DOUBLE metric against threshold
+
+        The labels are factorized once, then each threshold takes a single
+        vectorized comparison of the values and a bincount per group.
+
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+
+        Raises:
+            SliException.ValueNotSet if threshold is not defined
+        """
+        thresholds = self.threshold_values()
+        compare = Sli.COMPARATORS[self.comparator]
+        group_codes, keys = self.aggregator.factorize(self.metric_data, self.group_by_labels)
+        values = self.metric_data['value'].to_numpy(np.float64)
+        missing = np.isnan(values)
+
+        counts = []
+        for threshold in thresholds:
+            good = compare(values, threshold).astype(np.float64)
+            good[missing] = np.nan
+            counts.append(FactorizedAggregator.reduce(group_codes, good, keys.shape[0]))
+        return self.threshold_slo_data(keys, thresholds, counts)
+
+    def calc_distribution(self):
+        """Calculate sli of a DISTRIBUTION metric against threshold
+
+        Bucket counts are summed per group, then the samples at or below
+        each threshold are the counts of the buckets below it plus a linearly
+        interpolated share of the bucket it falls in, see bucket_weights.
+        Samples are never expanded from the histograms. If the metric client's
+        metric_kind is CUMULATIVE, the bucket counts of each point are first
+        replaced by their increase since the previous point of its series,
+        see cumulative_increases. If metric_kind is not set, a warning is
+        issued and points are counted as DELTA points.
+
+        Returns:
+            Dataframe of SLO data. Attribute slo_data is also assigned return value
+
+        Raises:
+            SliException.ValueNotSet if threshold is not defined
+        """
+        thresholds = self.threshold_values()
+        columns, upper_bounds = self.metric_client.bucket_columns(self.metric_data)
+        group_codes, keys = self.aggregator.factorize(self.metric_data, self.group_by_labels)
+        bins = group_codes + 1
+        buckets = self.metric_data[columns].to_numpy(np.float64)
+        if self.metric_client.metric_kind is None:
+            warnings.warn(
+                "metric_kind of the metric client is not set, so DISTRIBUTION points "
+                "are counted as DELTA points. Set it to MetricKind.CUMULATIVE if they "
+                "count every event since their start_timestamp"
+                )
+        if self.metric_client.metric_kind == MetricKind.CUMULATIVE:
+            buckets = self.cumulative_increases(buckets)
+        bucket_sums = np.column_stack([
+            np.bincount(bins, weights=buckets[:, i], minlength=keys.shape[0] + 1)[1:]
+            for i in range(len(columns))
+            ])
+
+        count_valid = np.rint(bucket_sums.sum(axis=1))
+        counts = []
+        for threshold in thresholds:
+            below = bucket_sums @ Sli.bucket_weights(upper_bounds, threshold)
+            count_good = below if self.comparator in ('<', '<=') else count_valid - below
+            counts.append((count_good, count_valid))
+        return self.threshold_slo_data(keys, thresholds, counts)
+
+    def cumulative_increases(self, values):
+        """Increase of cumulative values since the previous point of each series
+
+        A series is identified by every label column of metric_data and its
+        start_timestamp, so a series that restarts counting is a new series.
+        The points of a series are differenced in end_timestamp order. The
+        first point of a series that started before the window counts
+        nothing, as it includes events from before the window, whereas one
+        that started within the window counts all of its value.
+
+        Args:
+            values: float64 numpy array with a row per row of metric_data, e.g.
+                    the bucket counts of a DISTRIBUTION metric
+
+        Returns:
+            A float64 numpy array of the increase of each row
+
+        Raises:
+            SliException.UnsupportedMetricType if metric_data has no start_timestamp
+        """
+        data = self.metric_data
+        if 'start_timestamp' not in data:
+            raise SliException.UnsupportedMetricType(
+                "CUMULATIVE metrics need a start_timestamp column"
+                )
+        starts = MetricClient.epoch_nanos(data['start_timestamp'])
+        series = [
+            self.aggregator.factorize_column(data[label])[0]
+            for label in data.columns if label.startswith(('resource__', 'metric__'))
             ]
-        )
+        series.append(starts)
+        # lexsort sorts by the last key first
+        order = np.lexsort([MetricClient.epoch_nanos(data['end_timestamp'])] + series[::-1])
+        same_series = np.ones(max(len(order) - 1, 0), dtype=bool)
+        for key in series:
+            ordered_key = key[order]
+            same_series &= ordered_key[1:] == ordered_key[:-1]
+        first = np.concatenate(([True], ~same_series))[:len(order)]
+
+        ordered = values[order]
+        increases = np.empty_like(ordered)
+        increases[1:] = ordered[1:] - ordered[:-1]
+        window_start = pd.Timestamp(self.window_start, unit='s', tz='UTC').value
+        started = (starts[order] >= window_start)[:, np.newaxis]
+        increases[first] = np.where(started[first], ordered[first], 0)
+        increases = np.maximum(increases, 0)
+
+        result = np.empty_like(values)
+        result[order] = increases
+        return result
+
+    def threshold_values(self):
+        """The thresholds to calculate
+
+        Returns:
+            A list of thresholds
+
+        Raises:
+            SliException.ValueNotSet if threshold is not defined
+        """
+        if self.threshold is None:
+            raise SliException.ValueNotSet("threshold has not been defined")
+        if self.comparator not in Sli.COMPARATORS:
+            raise ValueError(f"comparator must be one of {list(Sli.COMPARATORS)}")
+        return list(np.atleast_1d(self.threshold))
+
+    def threshold_slo_data(self, keys, thresholds, counts):
+        """Assemble slo_data from the counts of each threshold
+
+        Args:
+            keys:       dataframe of group label values
+            thresholds: list of thresholds
+            counts:     list of (count_good, count_valid) arrays, one per threshold
+
+        Returns:
+            Dataframe of SLO data, with a threshold column if threshold is a list.
+            Attribute slo_data is also assigned return value
+        """
+        frames = []
+        for threshold, (count_good, count_valid) in zip(thresholds, counts):
+            frame = self.aggregator.counts_frame(keys, count_good, count_valid, np.float64)
+            if np.ndim(self.threshold) > 0:
+                frame.insert(len(keys.columns), 'threshold', threshold)
+            frames.append(frame)
+        slo_data = pd.concat(frames, ignore_index=True)
+        slo_data['sli'] = slo_data['count_good']/slo_data['count_valid']
+
+        self.slo_data = slo_data
         return self.slo_data
 
+    @staticmethod
+    def bucket_weights(upper_bounds, threshold):
+        """Share of each histogram bucket at or below threshold
+
+        Buckets are assumed to be uniformly filled between their bounds. The
+        first bucket is taken to start at 0, as for latencies, and the overflow
+        bucket is never good.
+
+        Args:
+            upper_bounds:   numpy array of the bucket upper bounds, in order
+            threshold:      the good event threshold
+
+        Returns:
+            A float64 numpy array of weights between 0 and 1, one per bucket
+        """
+        lower_bounds = np.concatenate(([min(0.0, upper_bounds[0])], upper_bounds[:-1]))
+        widths = upper_bounds - lower_bounds
+        interpolate = np.isfinite(widths) & (widths > 0)
+        weights = (threshold >= upper_bounds).astype(np.float64)
+        weights[interpolate] = np.clip(
+            (threshold - lower_bounds[interpolate]) / widths[interpolate], 0, 1
+            )
+        return weights
+
     def error_budget(self):
         """Calculate error budgets
 
@@ -0,0 +1,140 @@
+"""Tests for pyslo.aggregator
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+
+import numpy as np
+import pandas as pd
+import pytest
+from pyslo.aggregator import FactorizedAggregator, PandasAggregator, PartialCounts
+from pyslo.aggregator import ParallelAggregator
+
+DATA_PATH = './pyslo/tests/data'
+GROUP_BY = ['resource__environment_name', 'resource__project_id', 'metric__image_version']
+
+
+@pytest.fixture
+def sample_df():
+    return pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+
+
+@pytest.fixture
+def random_df():
+    """Random data with missing labels and values
+    """
+    rng = np.random.RandomState(0)
+    n_rows = 5000
+    data = pd.DataFrame({
+        'value': rng.randint(0, 2, n_rows).astype(float),
+        'a': rng.choice(['x', 'y', 'z', None], n_rows),
+        'b': rng.choice(['p', 'q'], n_rows),
+        'c': rng.randint(0, 50, n_rows)
+        })
+    data.loc[rng.rand(n_rows) < 0.05, 'value'] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('aggregator', [
+    FactorizedAggregator(), PandasAggregator(), ParallelAggregator(processes=2, min_rows=0)
+    ])
+def test_aggregate(aggregator, sample_df):
+    expected = pd.read_csv(
+        f'{DATA_PATH}/one_day_bool_agg_result.csv', parse_dates=[7, 8], index_col=0
+        )
+    expected = expected[GROUP_BY + ['count_good', 'count_valid']]
+
+    assert aggregator.aggregate(sample_df, GROUP_BY).equals(expected)
+
+    sample_df[GROUP_BY] = sample_df[GROUP_BY].astype('category')
+    assert aggregator.aggregate(sample_df, GROUP_BY).equals(expected)
+
+    simple = aggregator.aggregate(sample_df, [])
+    assert simple.to_dict('records') == [{'count_good': 3499, 'count_valid': 3501}]
+
+
+@pytest.mark.parametrize('aggregator', [
+    FactorizedAggregator(), PandasAggregator(), ParallelAggregator(processes=2, min_rows=0)
+    ])
+def test_aggregate_matches_groupby(aggregator, random_df):
+    group_by = ['a', 'b', 'c']
+    grouped = random_df.groupby(group_by)['value']
+    expected = grouped.sum().rename('count_good').to_frame()
+    expected['count_valid'] = grouped.count()
+    expected = expected.reset_index()
+
+    result = aggregator.aggregate(random_df, group_by)
+    pd.testing.assert_frame_equal(result, expected)
+
+    random_df[group_by] = random_df[group_by].astype('category')
+    result = aggregator.aggregate(random_df, group_by)
+    result['c'] = result['c'].astype(np.int64)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_parallel_aggregator(random_df):
+    aggregator = ParallelAggregator(processes=3, min_rows=0)
+    for group_by in [[], ['b'], ['a', 'b', 'c']]:
+        expected = FactorizedAggregator().aggregate(random_df, group_by)
+        pd.testing.assert_frame_equal(aggregator.aggregate(random_df, group_by), expected)
+
+    # Workers find different groups, which merge in category order
+    random_df.loc[:99, 'b'] = 'o'
+    random_df['b'] = pd.Categorical(random_df['b'], categories=['q', 'p', 'o', 'n'])
+    expected = FactorizedAggregator().aggregate(random_df, ['a', 'b'])
+    pd.testing.assert_frame_equal(aggregator.aggregate(random_df, ['a', 'b']), expected)
+    aggregator.shutdown()
+
+    # Small frames are aggregated without starting the pool
+    aggregator = ParallelAggregator(processes=3)
+    aggregator.aggregate(random_df, ['a'])
+    assert aggregator._executor is None  # pylint: disable=protected-access
+
+
+def test_factorize(random_df):
+    random_df.loc[3, 'a'] = None
+    group_codes, keys = FactorizedAggregator.factorize(random_df, ['a', 'b'])
+    assert group_codes[3] == -1
+    assert keys.to_dict('list') == {
+        'a': ['x', 'x', 'y', 'y', 'z', 'z'],
+        'b': ['p', 'q', 'p', 'q', 'p', 'q']
+        }
+    row = random_df['a'].first_valid_index()
+    assert (keys.loc[group_codes[row]] == random_df.loc[row, ['a', 'b']]).all()
+
+
+def test_factorize_sparse(random_df, monkeypatch):
+    dense_codes, dense_keys = FactorizedAggregator.factorize(random_df, ['a', 'b', 'c'])
+    monkeypatch.setattr(FactorizedAggregator, 'MAX_GROUP_CODE', 2)
+    sparse_codes, sparse_keys = FactorizedAggregator.factorize(random_df, ['a', 'b', 'c'])
+    np.testing.assert_array_equal(dense_codes, sparse_codes)
+    pd.testing.assert_frame_equal(dense_keys, sparse_keys)
+
+
+def test_partial_counts(random_df):
+    group_by = ['a', 'b']
+    expected = FactorizedAggregator().aggregate(random_df, group_by)
+
+    counts = PartialCounts(group_by)
+    for start in range(0, random_df.shape[0], 700):
+        chunk = random_df.iloc[start:start + 700]
+        counts.update(FactorizedAggregator().aggregate(chunk, group_by))
+    pd.testing.assert_frame_equal(counts.counts, expected)
+
+    counts = PartialCounts([])
+    counts.update(FactorizedAggregator().aggregate(random_df.iloc[:10], []))
+    counts.update(FactorizedAggregator().aggregate(random_df.iloc[10:], []))
+    pd.testing.assert_frame_equal(counts.counts, FactorizedAggregator().aggregate(random_df, []))
+
+
+def test_partial_counts_spill(random_df, tmp_path):
+    group_by = ['a', 'b', 'c']
+    expected = FactorizedAggregator().aggregate(random_df, group_by)
+
+    counts = PartialCounts(group_by, max_bytes=1, spill_path=tmp_path, partitions=4)
+    for start in range(0, random_df.shape[0], 700):
+        chunk = random_df.iloc[start:start + 700]
+        counts.update(FactorizedAggregator().aggregate(chunk, group_by))
+    assert counts.spills == 8
+    assert counts.counts is None
+    pd.testing.assert_frame_equal(counts.result(), expected)
+    assert list(tmp_path.iterdir()) == []
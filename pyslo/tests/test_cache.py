@@ -0,0 +1,212 @@
+"""Tests for pyslo.metric_client.cache
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+
+import os
+import datetime
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from pyslo.metric_client import MetricClient, NoMetricDataAvailable
+from pyslo.metric_client.cache import DiskCacheMetricClient, ResultCache
+
+DATA_PATH = './pyslo/tests/data'
+
+
+class RecordingMetricClient(MetricClient):
+    """Serves the sample data and records the periods requested
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def cache_key(self):
+        return 'metric.type="composer.googleapis.com/environment/healthy" |1'
+
+    def timeseries_dataframe(self, end, end_nanos=0, duration=3600):
+        end = end + end_nanos / 10**9
+        self.requests.append((end - duration, end))
+        window = self.data['end_timestamp'].between(
+            pd.Timestamp(end - duration, unit='s', tz='UTC'), pd.Timestamp(end, unit='s', tz='UTC')
+            )
+        if not window.any():
+            raise NoMetricDataAvailable
+        return self.data[window].reset_index(drop=True)
+
+
+@pytest.fixture
+def sample_df():
+    data = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    label_columns = [c for c in data.columns if '__' in c]
+    data[label_columns] = data[label_columns].astype('category')
+    return data
+
+
+def test_disk_cache(sample_df, tmp_path):
+    inner = RecordingMetricClient(sample_df)
+    cache = DiskCacheMetricClient(inner, str(tmp_path), refetch_margin=300)
+    window_end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    window_start = window_end - 12 * 3600
+    cache.clock = lambda: window_end - 3600
+
+    def sort(data):
+        sort_by = ['resource__environment_name', 'end_timestamp']
+        return data.sort_values(sort_by).reset_index(drop=True)
+
+    first = cache.timeseries_dataframe(end=window_end - 3600, duration=11 * 3600)
+    assert inner.requests == [(window_start, window_end - 3600)]
+    pd.testing.assert_frame_equal(
+        sort(first), sort(inner.timeseries_dataframe(end=window_end - 3600, duration=11 * 3600))
+        )
+
+    # An hour later only the tail and the refetch margin are requested
+    inner.requests = []
+    cache.clock = lambda: window_end
+    second = cache.timeseries_dataframe(end=window_end, duration=12 * 3600)
+    assert inner.requests == [(window_end - 3600 - 300, window_end)]
+    expected = inner.timeseries_dataframe(end=window_end, duration=12 * 3600)
+    pd.testing.assert_frame_equal(sort(second), sort(expected))
+
+    # A new client on the same directory reads the cache from disk
+    inner.requests = []
+    cache = DiskCacheMetricClient(inner, str(tmp_path), refetch_margin=300)
+    cache.clock = lambda: window_end + 3600
+    third = cache.timeseries_dataframe(end=window_end - 600, duration=6 * 3600)
+    assert inner.requests == []
+    assert third['end_timestamp'].max() <= pd.Timestamp(window_end - 600, unit='s', tz='UTC')
+
+
+def test_disk_cache_days(tmp_path):
+    day = DiskCacheMetricClient.DAY
+    start = 1584576000  # 2020-03-19T00:00:00Z
+    ends = pd.to_datetime(start + np.arange(0, 3 * day + 1, 3600), unit='s', utc=True)
+    inner = RecordingMetricClient(pd.DataFrame({
+        'end_timestamp': ends,
+        'value': np.ones(len(ends), dtype=np.int64),
+        'resource__environment_name': pd.Categorical(['env'] * len(ends)),
+        }))
+    cache = DiskCacheMetricClient(inner, str(tmp_path), refetch_margin=300)
+    cache.clock = lambda: start + 4 * day
+
+    # Points ending at the start of the period are excluded, fetched or cached
+    first = cache.timeseries_dataframe(end=start + 2 * day, duration=day)
+    assert first['end_timestamp'].min() == pd.Timestamp(start + day + 3600, unit='s', tz='UTC')
+    assert first.shape[0] == 24
+    assert sorted(os.listdir(cache.cache_dir())) == [
+        '2020-03-20.parquet', '2020-03-21.parquet', 'coverage.json'
+        ]
+    coverage_path = os.path.join(cache.cache_dir(), 'coverage.json')
+    written = os.stat(coverage_path).st_mtime_ns
+    inner.requests = []
+    cached = cache.timeseries_dataframe(end=start + day + 6 * 3600, duration=6 * 3600)
+    assert inner.requests == []
+    assert cached.shape[0] == 6
+    pd.testing.assert_frame_equal(cached, first.iloc[:6])
+    # Nothing was fetched so nothing is written
+    assert os.stat(coverage_path).st_mtime_ns == written
+
+    # Days before the retention are deleted when the cache is written
+    cache.retention = day
+    cache.clock = lambda: start + 3 * day + 3600
+    cache.timeseries_dataframe(end=start + 3 * day, duration=3 * day)
+    assert sorted(os.listdir(cache.cache_dir())) == [
+        '2020-03-21.parquet', '2020-03-22.parquet', 'coverage.json'
+        ]
+    assert cache.load_coverage()[0][0] == start + 2 * day
+
+
+def test_gaps():
+    assert DiskCacheMetricClient.gaps(0, 100, []) == [[0, 100]]
+    assert DiskCacheMetricClient.gaps(0, 100, [[10, 20], [50, 120]]) == [[0, 10], [20, 50]]
+    assert DiskCacheMetricClient.gaps(0, 100, [[-10, 40], [30, 60]]) == [[60, 100]]
+    assert DiskCacheMetricClient.gaps(0, 100, [[0, 100]]) == []
+
+
+def test_add_coverage():
+    coverage = DiskCacheMetricClient.add_coverage([], [0, 100, 1000], margin=10)
+    coverage = DiskCacheMetricClient.add_coverage(coverage, [90, 200, 1000], margin=10)
+    assert coverage == [[0, 200, 1000]]
+
+    # The tail was fetched within the margin so is kept apart
+    coverage = DiskCacheMetricClient.add_coverage(coverage, [195, 300, 305], margin=10)
+    assert coverage == [[0, 195, 1000], [195, 300, 305]]
+
+
+def test_result_cache(sample_df):
+    cache = ResultCache(max_bytes=10**9, ttl=60)
+    now = [0]
+    cache.clock = lambda: now[0]
+    clients = [RecordingMetricClient(sample_df) for _ in range(2)]
+    for client in clients:
+        client.result_cache = cache
+    fetches = []
+
+    def fetch(client, **kwargs):
+        fetches.append(kwargs)
+        return client.timeseries_dataframe(**kwargs)
+
+    def get(client, end=1584726153, duration=3600):
+        return client.cached_dataframe(
+            lambda **kwargs: fetch(client, **kwargs), end=end, duration=duration
+            )
+
+    first = get(clients[0])
+    second = get(clients[1])
+    assert len(fetches) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    pd.testing.assert_frame_equal(first, second)
+    # Changing a returned frame does not change the cached one
+    second['value'] = 0
+    assert get(clients[0])['value'].sum() == first['value'].sum()
+
+    get(clients[0], duration=7200)
+    assert len(fetches) == 2 and len(cache) == 2
+
+    now[0] = 61
+    get(clients[0])
+    assert len(fetches) == 3
+    assert cache.misses == 3
+
+
+def test_result_cache_eviction(sample_df):
+    client = RecordingMetricClient(sample_df)
+    one_frame = int(client.timeseries_dataframe(end=1584726153).memory_usage(deep=True).sum())
+    cache = ResultCache(max_bytes=int(2.5 * one_frame), ttl=60)
+
+    for key in ['a', 'b', 'c']:
+        cache.get(key, lambda: client.timeseries_dataframe(end=1584726153))
+    assert len(cache) == 2
+    assert cache.total_bytes == 2 * one_frame
+    cache.get('b', lambda: None)
+    assert cache.hits == 1
+    # 'a' was the least recently used so was evicted
+    cache.get('a', lambda: client.timeseries_dataframe(end=1584726153))
+    assert cache.misses == 4
+
+
+def test_result_cache_in_flight(sample_df):
+    cache = ResultCache()
+    client = RecordingMetricClient(sample_df)
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return client.timeseries_dataframe(end=1584726153)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get('key', slow_fetch)))
+        for _ in range(5)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert (cache.hits, cache.misses) == (4, 1)
@@ -0,0 +1,91 @@
+"""Tests for pyslo.metric_client.file
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+
+import datetime
+import pandas as pd
+import pytest
+from pyslo import sli
+from pyslo.metric_client import NoMetricDataAvailable
+from pyslo.metric_client import ValueType
+from pyslo.metric_client.file import FileMetricClient
+
+DATA_PATH = './pyslo/tests/data'
+METRIC = 'composer.googleapis.com/environment/healthy'
+
+
+@pytest.fixture
+def sample_df():
+    return pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+
+
+@pytest.fixture
+def file_metric_client(tmp_path, sample_df):
+    metric_client = FileMetricClient(str(tmp_path), metric=METRIC)
+    metric_client.value_type = ValueType.BOOL
+    metric_client.write(sample_df)
+    other = FileMetricClient(str(tmp_path), metric='other.googleapis.com/metric')
+    other.write(sample_df.assign(value=0))
+    return metric_client
+
+
+def test_write_partitions(file_metric_client, tmp_path, sample_df):
+    metric_dirs = sorted(path.name for path in tmp_path.iterdir())
+    assert metric_dirs == [
+        'metric=composer.googleapis.com%2Fenvironment%2Fhealthy',
+        'metric=other.googleapis.com%2Fmetric'
+        ]
+    dates = sorted(path.name for path in (tmp_path / metric_dirs[0]).iterdir())
+    assert dates == ['date=2020-03-19', 'date=2020-03-20']
+    assert file_metric_client.dataset().count_rows() == 2 * sample_df.shape[0]
+
+
+def test_timeseries_dataframe(file_metric_client, sample_df):
+    end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    df = file_metric_client.timeseries_dataframe(end=end, duration=6 * 3600)
+
+    start = pd.Timestamp(end - 6 * 3600, unit='s', tz='UTC')
+    expected = sample_df[sample_df['end_timestamp'] >= start]
+    assert df.shape[0] == expected.shape[0]
+    assert df['value'].sum() == expected['value'].sum()
+    assert list(df.columns) == list(sample_df.columns)
+    assert isinstance(df['resource__environment_name'].dtype, pd.CategoricalDtype)
+
+    with pytest.raises(NoMetricDataAvailable):
+        file_metric_client.timeseries_dataframe(end=end - 30 * 86400, duration=3600)
+
+
+def test_projection(file_metric_client, sample_df):
+    end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    df = file_metric_client.timeseries_dataframe(
+        end=end, duration=86400, label_columns=['resource__project_id']
+        )
+    assert list(df.columns) == [
+        'start_timestamp', 'end_timestamp', 'value', 'resource__project_id'
+        ]
+    chunks = list(file_metric_client.timeseries_chunks(
+        end=end, duration=86400, label_columns=[]
+        ))
+    assert sum(chunk.shape[0] for chunk in chunks) == df.shape[0]
+    assert list(chunks[0].columns) == ['start_timestamp', 'end_timestamp', 'value']
+
+
+def test_sli(file_metric_client, sample_df):
+    end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    sli_instance = sli.Sli(file_metric_client)
+    sli_instance.window_end = end
+    sli_instance.window_length = 1
+    sli_instance.slo = 0.99
+    sli_instance.group_by_resource_labels = ['environment_name']
+
+    sli_instance.get_metric_data()
+    assert list(sli_instance.metric_data.columns) == [
+        'start_timestamp', 'end_timestamp', 'value', 'resource__environment_name'
+        ]
+    result = sli_instance.calculate()
+    expected = sli_instance.aggregator.aggregate(sample_df, sli_instance.group_by_labels)
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+    streaming = sli_instance.calculate_streaming()
+    pd.testing.assert_frame_equal(streaming[expected.columns], expected)
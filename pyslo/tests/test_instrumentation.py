@@ -0,0 +1,137 @@
+"""Tests for pyslo.instrumentation
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+
+import tracemalloc
+import pytest
+from pyslo import sli
+from pyslo.instrumentation import NULL_SPAN
+from pyslo.instrumentation import CallbackInstrumentation
+from pyslo.instrumentation import Instrumentation
+from pyslo.metric_client import ValueType
+from pyslo.metric_client.stackdriver import StackdriverMetricClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceClient
+from pyslo.tests.test_stackdriver_metric_client import FakePageIterator
+from pyslo.tests.test_stackdriver_metric_client import make_time_series
+
+
+@pytest.fixture
+def metric_client():
+    metric_client = StackdriverMetricClient(None)
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    metric_client._client = FakeMetricServiceClient(make_time_series(6, 60, start=1584627000))
+    return metric_client
+
+
+def test_instrumentation_disabled():
+    instrumentation = Instrumentation()
+    with instrumentation.span('decode', client='test') as span:
+        span.count('rows', 10)
+    assert span is NULL_SPAN
+    assert not span.recording
+
+def test_callback_instrumentation(metric_client):
+    spans = []
+    metric_client.instrumentation = CallbackInstrumentation(spans.append)
+    sli_instance = sli.Sli(metric_client)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1 / 24
+    sli_instance.group_by_resource_labels = ['environment_name']
+
+    sli_instance.get_metric_data()
+    sli_instance.calculate()
+
+    # Nested spans finish before their parent
+    assert [span.name for span in spans] == [
+        'api', 'api', 'frame', 'decode', 'join', 'timeseries_dataframe', 'get_metric_data',
+        'aggregate', 'calculate'
+        ]
+    spans = {span.name: span for span in spans}
+    assert spans['decode'].counters['series'] == 6
+    assert spans['decode'].counters['points'] == 6 * 59
+    assert spans['decode'].counters['pages'] == 1
+    assert spans['decode'].counters['bytes'] > 0
+    assert spans['timeseries_dataframe'].attributes['client'] == 'StackdriverMetricClient'
+    assert spans['timeseries_dataframe'].counters['rows'] == 6 * 59
+    assert spans['get_metric_data'].counters['rows'] == 6 * 59
+    assert spans['aggregate'].counters == {'rows': 6 * 59, 'groups': 3}
+    assert spans['calculate'].counters == {'rows': 6 * 59, 'groups': 3}
+    assert all(span.duration >= 0 for span in spans.values())
+    assert spans['get_metric_data'].duration >= spans['decode'].duration
+    assert spans['decode'].peak_bytes is None
+
+@pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'), reason='needs Python 3.9')
+def test_callback_instrumentation_pages(metric_client):
+    spans = []
+    metric_client.instrumentation = CallbackInstrumentation(spans.append, trace_memory=True)
+    metric_client.to_df(FakePageIterator(make_time_series(5, 10), page_size=2))
+
+    api = [span for span in spans if span.name == 'api']
+    assert [span.counters['series'] for span in api] == [2, 2, 1, 0]
+    decode = [span for span in spans if span.name == 'decode'][0]
+    assert decode.counters['pages'] == 3
+    assert decode.counters['bytes'] == sum(span.counters['bytes'] for span in api)
+    assert all(span.peak_bytes > 0 for span in spans)
+    assert decode.peak_bytes >= max(span.peak_bytes for span in api)
+    assert not tracemalloc.is_tracing()
+
+@pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'), reason='needs Python 3.9')
+def test_callback_instrumentation_peak_bytes():
+    spans = []
+    instrumentation = CallbackInstrumentation(spans.append, trace_memory=True)
+    with instrumentation.span('outer'):
+        held = bytearray(10**6)
+        with instrumentation.span('inner'):
+            transient = bytearray(10**5)
+            del transient
+        del held
+    inner, outer = spans
+    # Peaks exclude the bytes already allocated when the span started
+    assert 9 * 10**4 < inner.peak_bytes < 10**6
+    assert outer.peak_bytes >= 10**6
+    assert not tracemalloc.is_tracing()
+
+    # Tracing started by the caller is left running
+    tracemalloc.start()
+    try:
+        with instrumentation.span('outer'):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    # A small span after a large one only reports its own peak
+    spans.clear()
+    with instrumentation.span('large'):
+        transient = bytearray(10**7)
+        del transient
+    with instrumentation.span('small'):
+        transient = bytearray(10**5)
+        del transient
+    large, small = spans
+    assert large.peak_bytes >= 10**7
+    assert small.peak_bytes < 10**6
+
+def test_callback_instrumentation_without_reset_peak(monkeypatch):
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    spans = []
+    instrumentation = CallbackInstrumentation(spans.append, trace_memory=True)
+    with instrumentation.span('outer'):
+        assert not tracemalloc.is_tracing()
+    assert spans[0].peak_bytes is None
+    assert spans[0].duration >= 0
+
+def test_sli_instrumentation(metric_client):
+    spans = []
+    sli_instance = sli.Sli(metric_client)
+    assert sli_instance.instrumentation is metric_client.instrumentation
+
+    sli_instance.instrumentation = CallbackInstrumentation(spans.append)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1 / 24
+    sli_instance.get_metric_data()
+    sli_instance.calculate()
+    assert [span.name for span in spans] == ['get_metric_data', 'aggregate', 'calculate']
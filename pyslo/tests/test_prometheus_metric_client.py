@@ -0,0 +1,169 @@
+"""Tests for prometheus metric client
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import pytest
+import pandas as pd
+from pyslo import sli
+from pyslo.metric_client import NoMetricDataAvailable
+from pyslo.metric_client import ValueType
+from pyslo.metric_client.prometheus import MatrixDecoder
+from pyslo.metric_client.prometheus import PrometheusException
+from pyslo.metric_client.prometheus import PrometheusMetricClient
+
+SERIES = [
+    {'__name__': 'up', 'job': 'api', 'instance': f'host{i}:9100'} for i in range(3)
+    ]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves query_range requests from the series of the server, in small
+    chunks of a chunked transfer encoding
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests.append(params)
+        if params['query'] == 'bad(':
+            status = 400
+            body = {'status': 'error', 'errorType': 'bad_data', 'error': 'parse error'}
+        else:
+            status = 200
+            start, end, step = (float(params[key]) for key in ('start', 'end', 'step'))
+            steps = int((end - start) // step) + 1
+            result = [
+                {
+                    'metric': labels,
+                    'values': [
+                        [start + n * step, str(int((i + n) % 4 != 0))]
+                        for n in range(steps)
+                        ]
+                    }
+                for i, labels in enumerate(SERIES)
+                ]
+            body = {'status': 'success', 'data': {'resultType': 'matrix', 'result': result}}
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for position in range(0, len(data), 100):
+            chunk = data[position:position + 100]
+            self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.connections = 0
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def prometheus_metric_client(stub_server):
+    metric_client = PrometheusMetricClient(f'http://127.0.0.1:{stub_server.server_port}')
+    metric_client.query = 'up{job="api"}'
+    metric_client.value_type = ValueType.BOOL
+    yield metric_client
+    metric_client.pool.close()
+
+
+def test_step_chunks():
+    assert PrometheusMetricClient.step_chunks(1030, 1400, 60, 3) == [
+        (1080, 1200), (1260, 1380)
+        ]
+    assert PrometheusMetricClient.step_chunks(1020, 1140, 60, 10) == [(1020, 1140)]
+    assert PrometheusMetricClient.step_chunks(1030, 1050, 60, 10) == []
+
+
+def test_matrix_decoder():
+    body = json.dumps({
+        'status': 'success',
+        'data': {
+            'resultType': 'matrix',
+            'result': [
+                {'metric': {'job': 'api', 'path': '/résult"]'}, 'values': [[1, '1']]},
+                {'metric': {}, 'values': [[1, 'NaN'], [2, '0']]}
+                ]
+            }
+        })
+    decoder = MatrixDecoder()
+    series = []
+    for character in body:
+        series += decoder.feed(character)
+    decoder.close()
+    assert series == json.loads(body)['data']['result']
+
+    decoder = MatrixDecoder()
+    decoder.feed(body[:len(body) // 2])
+    with pytest.raises(PrometheusException.QueryFailed):
+        decoder.close()
+
+
+def test_timeseries_dataframe(prometheus_metric_client, stub_server):
+    prometheus_metric_client.max_points = 50
+    end = 1584627000
+    df = prometheus_metric_client.timeseries_dataframe(end=end, duration=3 * 3600)
+
+    # 181 steps of a minute in three hours, split into ranges of 50 steps
+    assert len(stub_server.requests) == 4
+    assert stub_server.connections == 1
+    assert prometheus_metric_client.pool.created == 1
+    assert list(df.columns) == ['end_timestamp', 'value', 'metric__job', 'metric__instance']
+    assert isinstance(df['metric__instance'].dtype, pd.CategoricalDtype)
+    assert df['value'].dtype == 'int64'
+    assert df.shape[0] == 3 * 181
+    assert not df.duplicated(['end_timestamp', 'metric__instance']).any()
+    assert df['end_timestamp'].min() == pd.Timestamp(end - 3 * 3600, unit='s', tz='UTC')
+    assert df['end_timestamp'].max() == pd.Timestamp(end, unit='s', tz='UTC')
+
+    # The connection is reused by the next call
+    prometheus_metric_client.timeseries_dataframe(end=end, duration=600)
+    assert stub_server.connections == 1
+
+
+def test_query_failed(prometheus_metric_client):
+    prometheus_metric_client.query = 'bad('
+    with pytest.raises(PrometheusException.QueryFailed, match='parse error'):
+        prometheus_metric_client.timeseries_dataframe(end=1584627000, duration=600)
+
+    prometheus_metric_client.query = 'up'
+    with pytest.raises(NoMetricDataAvailable):
+        prometheus_metric_client.timeseries_dataframe(end=1584627030, duration=20)
+
+
+def test_sli(prometheus_metric_client):
+    sli_instance = sli.Sli(prometheus_metric_client)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1
+    sli_instance.slo = 0.9
+    sli_instance.group_by_metric_labels = ['instance']
+    sli_instance.get_metric_data()
+    slo_data = sli_instance.calculate()
+
+    assert slo_data['metric__instance'].tolist() == [labels['instance'] for labels in SERIES]
+    assert slo_data['count_valid'].tolist() == [1441] * 3
+    assert slo_data['count_good'].tolist() == [1080, 1081, 1081]
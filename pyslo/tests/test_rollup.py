@@ -0,0 +1,108 @@
+"""Tests for pyslo.rollup
+"""
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+
+import pytest
+import pandas as pd
+from pyslo import sli
+from pyslo.metric_client import ValueType
+from pyslo.rollup import RollupStore
+from pyslo.metric_client.stackdriver import StackdriverMetricClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceClient
+from pyslo.tests.test_stackdriver_metric_client import make_time_series
+
+END = 1584627000
+
+
+@pytest.fixture
+def sli_instance():
+    metric_client = StackdriverMetricClient(None)
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    metric_client._client = FakeMetricServiceClient(make_time_series(6, 3 * 24 * 60, start=END))
+    sli_instance = sli.Sli(metric_client)
+    sli_instance.window_end = END
+    sli_instance.window_length = 2
+    sli_instance.slo = 0.99
+    return sli_instance
+
+
+def test_cover(tmp_path):
+    store = RollupStore(tmp_path, [])
+    assert store.cover(86400 - 120, 3 * 86400 + 3600 + 60) == [
+        ('minute', 86400 - 120, 86400),
+        ('day', 86400, 3 * 86400),
+        ('hour', 3 * 86400, 3 * 86400 + 3600),
+        ('minute', 3 * 86400 + 3600, 3 * 86400 + 3600 + 60),
+        ]
+    assert store.cover(120, 300) == [('minute', 120, 300)]
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_calculate_rollup(sli_instance, group_by, tmp_path):
+    if group_by:
+        sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+        sli_instance.group_by_metric_labels = ['image_version']
+    fake_client = sli_instance.metric_client._client
+
+    # The window is fetched once, then answered from the store
+    sli_instance.rollup_store = RollupStore(tmp_path / 'fetched', sli_instance.group_by_labels)
+    sli_instance.rollup_store.clock = lambda: END + 3600
+    sli_instance.get_metric_data()
+    expected = sli_instance.calculate().copy()
+    n_requests = len(fake_client.requests)
+    pd.testing.assert_frame_equal(sli_instance.calculate_rollup(), expected)
+    assert len(fake_client.requests) == n_requests
+
+    # An empty store fetches the window, and is reloaded from disk
+    sli_instance.rollup_store = RollupStore(tmp_path / 'empty', sli_instance.group_by_labels)
+    sli_instance.rollup_store.clock = lambda: END + 3600
+    pd.testing.assert_frame_equal(sli_instance.calculate_rollup(), expected)
+    assert len(fake_client.requests) == n_requests + 1
+    store = RollupStore(tmp_path / 'empty', sli_instance.group_by_labels)
+    pd.testing.assert_frame_equal(
+        store.counts(sli_instance.window_start, END),
+        expected[sli_instance.group_by_labels + ['count_good', 'count_valid']]
+        )
+
+    # Moving the window back only fetches the part not counted yet
+    store, sli_instance.rollup_store = sli_instance.rollup_store, None
+    sli_instance.window_end = END - 5 * 3600
+    sli_instance.get_metric_data()
+    expected = sli_instance.calculate().copy()
+    sli_instance.rollup_store = store
+    n_requests = len(fake_client.requests)
+    pd.testing.assert_frame_equal(sli_instance.calculate_rollup(), expected)
+    assert len(fake_client.requests) == n_requests + 1
+
+def test_rollup_gaps(tmp_path):
+    store = RollupStore(tmp_path, [], refetch_margin=300)
+    store.update(None, 0, 7200, fetched_at=7200)
+    assert store.gaps(0, 7200) == [[6900, 7200]]
+    assert store.gaps(-59, 3601) == [[-60, 0]]
+
+    with pytest.raises(ValueError):
+        RollupStore(tmp_path, ['resource__project_id'])
+
+@pytest.mark.parametrize('unit', ['ns', 'us'])
+def test_rollup_ungrouped(unit, tmp_path):
+    if unit != 'ns' and not hasattr(pd.Timestamp, 'as_unit'):
+        pytest.skip('pandas < 2 only has ns')
+    data = pd.DataFrame({
+        'end_timestamp': pd.to_datetime(
+            [END + 30, END + 60, END + 90, END + 150], unit='s', utc=True
+            ).astype(f'datetime64[{unit}, UTC]'),
+        'value': [True, False, True, True],
+        })
+    store = RollupStore(tmp_path, [])
+    store.update(data, END, END + 180, fetched_at=END + 3600)
+    expected = pd.DataFrame({'count_good': [3], 'count_valid': [4]})
+
+    # Ungrouped counts are one row, and are read back after a reload
+    pd.testing.assert_frame_equal(store.counts(END, END + 180), expected, check_dtype=False)
+    store = RollupStore(tmp_path, [])
+    pd.testing.assert_frame_equal(store.counts(END, END + 180), expected, check_dtype=False)
+    # Points are counted in the minute they end in
+    expected = pd.DataFrame({'count_good': [2], 'count_valid': [2]})
+    pd.testing.assert_frame_equal(store.counts(END + 60, END + 180), expected, check_dtype=False)
@@ -3,16 +3,45 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=redefined-outer-name
 
+import sys
 import time
+import asyncio
+import subprocess
 import datetime
 import pytest
+import numpy as np
 import pandas as pd
-from google.cloud import monitoring_v3
 from pyslo import sli
+from pyslo.instrumentation import CallbackInstrumentation
+from pyslo.instrumentation import Instrumentation
+from pyslo.metric_client import MetricClient
+from pyslo.metric_client import MetricKind
+from pyslo.metric_client import ValueType
 from pyslo.metric_client.stackdriver import StackdriverMetricClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceClient
+from pyslo.tests.test_stackdriver_metric_client import make_distribution_series
+from pyslo.tests.test_stackdriver_metric_client import make_time_series
 
 DATA_PATH = './pyslo/tests/data'
 
+
+class ChunkedMetricClient(MetricClient):
+    """Metric client serving the sample data in chunks of rows
+    """
+
+    value_type = ValueType.BOOL
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def timeseries_dataframe(self, end=None, end_nanos=0, duration=None):
+        return self.data
+
+    def timeseries_chunks(self, end, end_nanos=0, duration=3600):
+        for start in range(0, self.data.shape[0], self.chunk_size):
+            yield self.data.iloc[start:start + self.chunk_size]
+
 @pytest.fixture
 def sli_instance():
     '''
@@ -60,14 +89,14 @@ def test_calculate(sli_instance):
 
     Also tests that slo and period fields are added properly to df
 
-    Currently only BOOL is supported
+    STRING is not supported
     """
     # Test that without initiaizing value type it throws
     with pytest.raises(sli.SliException.UnsupportedMetricType):
         sli_instance.calculate()
 
     # Set to unssuported type and check it throws
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.INT64
+    sli_instance.metric_client.value_type = ValueType.STRING
 
     with pytest.raises(sli.SliException.UnsupportedMetricType):
         sli_instance.calculate()
@@ -83,7 +112,7 @@ def test_calculate(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -119,7 +148,7 @@ def test_calc_bool(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -156,7 +185,7 @@ def test_calc_bool_simple(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -179,7 +208,7 @@ def test_calc_bool_agg(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -191,6 +220,30 @@ def test_calc_bool_agg(sli_instance):
 
     assert sli_instance.slo_data.equals(expected)
 
+def test_calc_bool_agg_categorical(sli_instance):
+    """sli.calc_bool_agg
+    Label columns stored as categoricals give the same result
+    """
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    expected = pd.read_csv(
+        f'{DATA_PATH}/one_day_bool_agg_result.csv', parse_dates=[7, 8], index_col=0
+        )
+    expected.drop(columns=['period_from', 'period_to', 'slo'], inplace=True)
+    label_columns = [c for c in sample_df.columns if '__' in c]
+    sample_df[label_columns] = sample_df[label_columns].astype('category')
+    # A point with a missing label is not part of any group
+    sample_df.loc[0, 'metric__image_version'] = None
+
+    sli_instance.metric_data = sample_df
+    sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+    sli_instance.group_by_metric_labels = ['image_version']
+    sli_instance.calc_bool_agg()
+    sli_instance.slo_data['sli'] = sli_instance.slo_data['sli'].round(decimals=9)
+    expected.loc[1, 'count_valid'] = 229
+    expected['sli'] = (expected['count_good']/expected['count_valid']).round(decimals=9)
+
+    assert sli_instance.slo_data.equals(expected)
+
 def test_group_by_labels(sli_instance):
     sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
     sli_instance.group_by_metric_labels = ['image_version']
@@ -213,7 +266,7 @@ def test_error_budget(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -246,7 +299,7 @@ def test_error_budget_agg(sli_instance):
     window_end = sample_df['end_timestamp'].max()
     sli_instance.window_end = datetime.datetime.timestamp(window_end)
     sli_instance.window_length = 1
-    sli_instance.metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    sli_instance.metric_client.value_type = ValueType.BOOL
     sli_instance.slo = 0.99
 
     sli_instance.metric_data = sample_df
@@ -257,3 +310,376 @@ def test_error_budget_agg(sli_instance):
 
     slo_data = sli_instance.slo_data
     assert pytest.approx(slo_data['error_budget'], 1E-10) == expected['error_budget']
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_calculate_streaming(group_by):
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    window_end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+
+    def make_sli(chunk_size):
+        sli_instance = sli.Sli(ChunkedMetricClient(sample_df, chunk_size))
+        sli_instance.window_end = window_end
+        sli_instance.window_length = 1
+        sli_instance.slo = 0.99
+        if group_by:
+            sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+            sli_instance.group_by_metric_labels = ['image_version']
+        return sli_instance
+
+    in_memory = make_sli(None)
+    in_memory.get_metric_data()
+    in_memory.calculate()
+    expected = in_memory.error_budget()
+
+    streaming = make_sli(500)
+    result = streaming.calculate_streaming()
+    assert streaming.metric_data is None
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_aget_metric_data():
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    sli_instance = sli.Sli(ChunkedMetricClient(sample_df, None))
+    sli_instance.window_length = 1
+    asyncio.run(sli_instance.aget_metric_data())
+    assert sli_instance.metric_data is sample_df
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_calculate_aligned(group_by, monkeypatch):
+    metric_client = StackdriverMetricClient(None)
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    metric_client._client = FakeMetricServiceClient(  # pylint: disable=protected-access
+        make_time_series(6, 24 * 60, start=1584627000)
+        )
+    sli_instance = sli.Sli(metric_client)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1
+    sli_instance.slo = 0.99
+    if group_by:
+        sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+        sli_instance.group_by_metric_labels = ['image_version']
+
+    sli_instance.get_metric_data()
+    expected = sli_instance.calculate().copy()
+
+    sli_instance.parity_check_seconds = 3 * 3600
+    result = sli_instance.calculate_aligned()
+    pd.testing.assert_frame_equal(result, expected)
+
+    original = metric_client.aligned_counts
+
+    def miscount(**kwargs):
+        counts = original(**kwargs)
+        counts['count_good'] += 1
+        return counts
+
+    monkeypatch.setattr(metric_client, 'aligned_counts', miscount)
+    with pytest.raises(sli.SliException.ParityCheckFailed):
+        sli_instance.calculate_aligned()
+
+def test_memory_budget():
+    metric_client = StackdriverMetricClient(None)
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    metric_client._client = FakeMetricServiceClient(  # pylint: disable=protected-access
+        make_time_series(6, 60, start=1584627000)
+        )
+    sli_instance = sli.Sli(metric_client)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1 / 24
+    sli_instance.memory_budget = 1000
+
+    with pytest.raises(sli.SliException.MemoryBudgetExceeded):
+        sli_instance.get_metric_data()
+    assert sli_instance.metric_data is None
+
+    sli_instance.memory_budget_action = 'warn'
+    with pytest.warns(UserWarning, match='memory budget'):
+        sli_instance.get_metric_data()
+    # The newest point of each series ends just after window_end
+    assert sli_instance.metric_data.shape[0] == 6 * 59
+
+    sli_instance.memory_budget = 10**6
+    sli_instance.get_metric_data()
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_calculate_chunked(group_by, tmp_path):
+    time_series = make_time_series(6, 24 * 60, start=1584627000)
+    # Points on whole minutes, so some fall on chunk boundaries
+    for result in time_series:
+        for point in result.points:
+            point.interval.end_time.nanos = 0
+            point.interval.start_time.nanos = 0
+    metric_client = StackdriverMetricClient(None)
+    metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    metric_client.value_type = ValueType.BOOL
+    metric_client._client = FakeMetricServiceClient(time_series)  # pylint: disable=protected-access
+    sli_instance = sli.Sli(metric_client)
+    sli_instance.window_end = 1584627000
+    sli_instance.window_length = 1
+    sli_instance.slo = 0.99
+    if group_by:
+        sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+        sli_instance.group_by_metric_labels = ['image_version']
+    sli_instance.get_metric_data()
+    expected = sli_instance.calculate().copy()
+    sli_instance.metric_data = None
+
+    with pytest.raises(sli.SliException.ValueNotSet):
+        sli_instance.calculate_chunked()
+
+    sli_instance.chunk_seconds = 5 * 3600
+    assert len(sli_instance.chunk_intervals()) == 5
+    pd.testing.assert_frame_equal(sli_instance.calculate_chunked(), expected)
+    assert sli_instance.metric_data is None
+
+    # Running counts over half the budget are spilled, then removed
+    spans = []
+    sli_instance.instrumentation = CallbackInstrumentation(spans.append)
+    sli_instance.memory_budget = 2
+    sli_instance.spill_path = tmp_path
+    pd.testing.assert_frame_equal(sli_instance.calculate_chunked(), expected)
+    assert list(tmp_path.iterdir()) == []
+    span = [span for span in spans if span.name == 'calculate_chunked'][0]
+    # Ungrouped counts are a single row, so they are never spilled
+    assert span.counters['chunks'] == 5
+    assert span.counters['spills'] == (5 if group_by else 0)
+    sli_instance.instrumentation = Instrumentation()
+
+    # Chunks sized from the preflight estimate
+    sli_instance.chunk_seconds = None
+    sli_instance.memory_budget = 10**5
+    assert len(sli_instance.chunk_intervals()) > 5
+    pd.testing.assert_frame_equal(sli_instance.calculate_chunked(), expected)
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_burn_rates(group_by):
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    sli_instance = sli.Sli(ChunkedMetricClient(sample_df, None))
+    sli_instance.window_end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    sli_instance.window_length = 1
+    sli_instance.slo = 0.99
+    if group_by:
+        sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+        sli_instance.group_by_metric_labels = ['image_version']
+    sli_instance.get_metric_data()
+
+    windows = [3600, 6 * 3600, 24 * 3600]
+    result = sli_instance.burn_rates(windows)
+    assert list(result['window'].unique()) == windows
+
+    for window in windows:
+        start = pd.Timestamp(sli_instance.window_end - window, unit='s', tz='UTC')
+        expected = sli_instance.aggregator.aggregate(
+            sample_df[sample_df['end_timestamp'] >= start], sli_instance.group_by_labels
+            )
+        counts = result[result['window'] == window]
+        counts = counts[counts['count_valid'] > 0].reset_index(drop=True)
+        pd.testing.assert_frame_equal(counts[expected.columns], expected)
+        burn_rate = (1 - expected['count_good']/expected['count_valid'])/(1 - 0.99)
+        assert counts['burn_rate'].tolist() == pytest.approx(burn_rate.tolist())
+
+@pytest.mark.skipif(not hasattr(pd.Timestamp, 'as_unit'), reason='pandas < 2 only has ns')
+@pytest.mark.parametrize('unit', ['us', 's'])
+def test_burn_rates_unit(unit):
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    sli_instance = sli.Sli(ChunkedMetricClient(sample_df, None))
+    sli_instance.window_end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+    sli_instance.slo = 0.99
+    sli_instance.metric_data = sample_df
+    windows = [3600, 24 * 3600]
+    expected = sli_instance.burn_rates(windows)
+    assert expected['count_valid'].min() > 0
+
+    # Timestamps in coarser units than nanoseconds count the same points
+    sli_instance.metric_data = sample_df.astype({'end_timestamp': f'datetime64[{unit}, UTC]'})
+    pd.testing.assert_frame_equal(sli_instance.burn_rates(windows), expected)
+
+def test_calculate_lattice():
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    sample_df.loc[sample_df.index[::7], 'metric__image_version'] = None
+    sli_instance = sli.Sli(ChunkedMetricClient(sample_df, None))
+    sli_instance.metric_data = sample_df
+    sli_instance.slo = 0.99
+    sli_instance.group_by_sets = [
+        {},
+        {'resource': ['project_id']},
+        {'resource': ['environment_name']},
+        {'resource': ['environment_name'], 'metric': ['image_version']}
+        ]
+
+    result = sli_instance.calculate_lattice()
+    assert list(result.columns[:4]) == [
+        'level', 'resource__project_id', 'resource__environment_name', 'metric__image_version'
+        ]
+    assert sli_instance.group_by_set_labels[3] == [
+        'resource__environment_name', 'metric__image_version'
+        ]
+    for group_by_set in sli_instance.group_by_set_labels:
+        level = result[result['level'] == ','.join(group_by_set)].reset_index(drop=True)
+        expected = sli_instance.aggregator.aggregate(sample_df, group_by_set)
+        pd.testing.assert_frame_equal(level[expected.columns], expected)
+        others = [label for label in result.columns[1:4] if label not in group_by_set]
+        assert level[others].isna().all().all()
+    assert result.loc[result['level'] == '', 'count_valid'].iloc[0] == sample_df.shape[0]
+
+    sli_instance.group_by_sets = [{'resource_labels': ['project_id']}]
+    with pytest.raises(ValueError):
+        sli_instance.calculate_lattice()
+
+def test_bucket_weights():
+    upper_bounds = np.array([1.0, 2.0, 4.0, np.inf])
+    assert sli.Sli.bucket_weights(upper_bounds, 3).tolist() == [1, 1, 0.5, 0]
+    assert sli.Sli.bucket_weights(upper_bounds, 0.25).tolist() == [0.25, 0, 0, 0]
+    assert sli.Sli.bucket_weights(upper_bounds, 10).tolist() == [1, 1, 1, 0]
+
+def test_calculate_distribution(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = \
+        ValueType.DISTRIBUTION
+    sli_instance = sli.Sli(stackdriver_metric_client)
+    sli_instance.metric_data = stackdriver_metric_client.to_df(
+        make_distribution_series(3, 4)
+        )
+    sli_instance.slo = 0.9
+    sli_instance.group_by_resource_labels = ['environment_name']
+
+    with pytest.raises(sli.SliException.ValueNotSet):
+        sli_instance.calculate()
+
+    sli_instance.threshold = 3
+    result = sli_instance.calculate()
+    # Series i has i samples under 1, j % 3 in (1, 2], 1 in (2, 4] and 2 over 4 on
+    # even points. Half of the (2, 4] samples are good at a threshold of 3.
+    assert result['resource__environment_name'].tolist() == ['env0', 'env1', 'env2']
+    assert result['count_valid'].tolist() == [4 * i + 3 + 4 + 4 for i in range(3)]
+    assert result['count_good'].tolist() == [4 * i + 3 + 2 for i in range(3)]
+
+def test_calculate_distribution_cumulative(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = \
+        ValueType.DISTRIBUTION
+    end = 1584627079
+    points = stackdriver_metric_client.to_df(make_distribution_series(3, 4, start=end))
+    columns, _ = stackdriver_metric_client.bucket_columns(points)
+
+    def make_sli(metric_data):
+        sli_instance = sli.Sli(stackdriver_metric_client)
+        sli_instance.metric_data = metric_data
+        sli_instance.window_end = end
+        sli_instance.window_length = 1
+        sli_instance.slo = 0.9
+        sli_instance.threshold = 3
+        sli_instance.group_by_resource_labels = ['environment_name']
+        return sli_instance
+
+    # Each series counts from two days ago, except that env0 restarts within the
+    # window after its oldest two points
+    cumulative = points.sort_values(['resource__environment_name', 'end_timestamp'])
+    cumulative['start_timestamp'] = pd.Timestamp(end - 2 * 86400, unit='s', tz='UTC')
+    restarted = (cumulative['resource__environment_name'] == 'env0') & \
+        (cumulative['end_timestamp'] > pd.Timestamp(end - 120, unit='s', tz='UTC'))
+    cumulative.loc[restarted, 'start_timestamp'] = pd.Timestamp(end - 120, unit='s', tz='UTC')
+    cumulative[columns] = cumulative.groupby(
+        ['resource__environment_name', 'start_timestamp'], observed=True
+        )[columns].cumsum()
+    cumulative = cumulative.sample(frac=1, random_state=0)
+
+    # The oldest point of each series only gives the count before the window
+    oldest = points['end_timestamp'] == points['end_timestamp'].min()
+    expected = make_sli(points[~oldest].reset_index(drop=True)).calculate()
+
+    stackdriver_metric_client.metric_kind = MetricKind.CUMULATIVE
+    result = make_sli(cumulative.reset_index(drop=True)).calculate()
+    pd.testing.assert_frame_equal(result, expected)
+
+    with pytest.raises(sli.SliException.UnsupportedMetricType):
+        make_sli(cumulative.drop(columns='start_timestamp')).calculate()
+
+    # Without a metric kind points are summed as DELTA points, with a warning
+    stackdriver_metric_client.metric_kind = None
+    with pytest.warns(UserWarning, match='metric_kind'):
+        make_sli(points).calculate()
+
+@pytest.mark.parametrize('group_by', [False, True])
+def test_calculate_ratio(group_by):
+    sample_df = pd.read_csv(f'{DATA_PATH}/one_day_bool.csv', parse_dates=[0, 1])
+    window_end = datetime.datetime.timestamp(sample_df['end_timestamp'].max())
+
+    def make_sli(metric_client):
+        sli_instance = sli.Sli(metric_client)
+        sli_instance.window_end = window_end
+        sli_instance.window_length = 1
+        sli_instance.slo = 0.99
+        if group_by:
+            sli_instance.group_by_resource_labels = ['environment_name', 'project_id']
+            sli_instance.group_by_metric_labels = ['image_version']
+        return sli_instance
+
+    bool_sli = make_sli(ChunkedMetricClient(sample_df, None))
+    bool_sli.get_metric_data()
+    expected = bool_sli.calculate()
+
+    # Good requests are the healthy points, total requests every point
+    good = sample_df[sample_df['value'] == 1].reset_index(drop=True)
+    total = sample_df.assign(value=1)
+    label_columns = [column for column in total.columns if column.startswith('resource__')]
+    total[label_columns] = total[label_columns].astype('category')
+    ratio_sli = make_sli(ChunkedMetricClient(good, None))
+    ratio_sli.total_metric_client = ChunkedMetricClient(total, None)
+    ratio_sli.get_metric_data()
+    assert ratio_sli.total_metric_data is total
+    result = ratio_sli.calculate()
+    pd.testing.assert_frame_equal(result, expected)
+
+    counts = ratio_sli.ratio_counts()
+    assert counts['end_timestamp'].nunique() == 24
+    assert counts['count_valid'].sum() == sample_df.shape[0]
+
+    # Frames with timestamps in different units share buckets
+    if hasattr(pd.Timestamp, 'as_unit'):
+        ratio_sli.total_metric_data = total.astype({'end_timestamp': 'datetime64[us, UTC]'})
+        pd.testing.assert_frame_equal(ratio_sli.ratio_counts(), counts)
+
+@pytest.mark.parametrize('comparator', ['<', '<=', '>', '>='])
+def test_calculate_threshold(stackdriver_metric_client, comparator):
+    stackdriver_metric_client.value_type = ValueType.DOUBLE
+    sli_instance = sli.Sli(stackdriver_metric_client)
+    sli_instance.metric_data = pd.DataFrame({
+        'end_timestamp': pd.date_range('2020-03-19', periods=8, freq='min', tz='UTC'),
+        'value': [0.1, 0.5, 0.9, None, 0.5, 0.2, 0.7, 0.95],
+        'resource__queue': ['a'] * 4 + ['b'] * 4
+        })
+    sli_instance.slo = 0.9
+    sli_instance.group_by_resource_labels = ['queue']
+    sli_instance.comparator = comparator
+
+    with pytest.raises(sli.SliException.ValueNotSet):
+        sli_instance.calculate()
+
+    sli_instance.threshold = 0.5
+    result = sli_instance.calculate()
+    good = {'<': [1, 1], '<=': [2, 2], '>': [1, 2], '>=': [2, 3]}[comparator]
+    assert list(result.columns[:3]) == ['resource__queue', 'count_good', 'count_valid']
+    assert result['count_good'].tolist() == good
+    assert result['count_valid'].tolist() == [3, 4]
+
+    sli_instance.threshold = [0.5, 0.8]
+    result = sli_instance.calculate()
+    assert result['threshold'].tolist() == [0.5, 0.5, 0.8, 0.8]
+    assert result['count_good'].tolist()[:2] == good
+    for threshold in [0.5, 0.8]:
+        sli_instance.threshold = threshold
+        single = sli_instance.calculate()
+        rows = result[result['threshold'] == threshold]
+        assert rows['count_good'].tolist() == single['count_good'].tolist()
+
+def test_import_without_provider_sdk():
+    script = (
+        'import sys, pyslo.sli, pyslo.metric_client.stackdriver; '
+        'print(any(m in sys.modules for m in ["google.cloud.monitoring_v3", "grpc"]))'
+        )
+    output = subprocess.run(
+        [sys.executable, '-c', script], check=True, stdout=subprocess.PIPE,
+        universal_newlines=True
+        ).stdout
+    assert output.strip() == 'False'
+    assert sli.Sli().metric_client.value_type is None
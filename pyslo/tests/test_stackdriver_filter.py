@@ -32,3 +32,14 @@ def test_string(stackdriver_filter):
     stackdriver_filter.metric_type = 'composer.googleapis.com/environment/healthy'
     expected_filter = 'metric.type="composer.googleapis.com/environment/healthy" resource.type="cloud_composer_environment" '  # pylint: disable=line-too-long
     assert stackdriver_filter.string == expected_filter
+
+def test_string_labels(stackdriver_filter):
+    stackdriver_filter.metric_type = 'loadbalancing.googleapis.com/https/request_count'
+    stackdriver_filter.resource_labels = {'project_id': 'prod'}
+    stackdriver_filter.metric_labels['response_code_class'] = 200
+    expected_filter = (
+        'metric.type="loadbalancing.googleapis.com/https/request_count" '
+        'resource.labels.project_id="prod" '
+        'metric.labels.response_code_class="200" '
+        )
+    assert stackdriver_filter.string == expected_filter
@@ -5,12 +5,26 @@
 # pylint: disable=protected-access
 # pylint: disable=no-member
 
+import asyncio
 import datetime
 import pytest
 import pytz
+import numpy as np
+import pandas as pd
+from google.api import distribution_pb2
 from google.cloud import monitoring_v3
 import google.protobuf as protobuf
+from pyslo.metric_client import MetricClient
+from pyslo.metric_client import MetricKind
+from pyslo.metric_client import NoMetricDataAvailable
+from pyslo.metric_client import ValueType
+from pyslo.metric_client.cache import ResultCache
 from pyslo.metric_client.stackdriver import StackdriverMetricClient
+from pyslo.metric_client.stackdriver.stackdriver_metric_client import monitoring_enum
+from pyslo.metric_client.stackdriver.stackdriver_metric_client import raw_message
+from pyslo.metric_client.stackdriver.fake import FakeAsyncMetricServiceClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceClient
+from pyslo.metric_client.stackdriver.fake import FakeMetricServiceServer
 
 
 @pytest.fixture
@@ -46,8 +60,8 @@ def test_set_interval(stackdriver_metric_client):
     assert interval.start_time.nanos == 0
 
 def test_get_point_value(stackdriver_metric_client):
-    stackdriver_metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
-    point_value = monitoring_v3.types.TypedValue()  # pylint: disable=no-member
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    point_value = raw_message(monitoring_v3.types.TypedValue())  # pylint: disable=no-member
 
     point_value.bool_value = True
     assert stackdriver_metric_client.get_point_value(point_value)
@@ -55,6 +69,14 @@ def test_get_point_value(stackdriver_metric_client):
     point_value.bool_value = False
     assert not stackdriver_metric_client.get_point_value(point_value)
 
+    stackdriver_metric_client.value_type = ValueType.DOUBLE
+    point_value.double_value = 0.25
+    assert stackdriver_metric_client.get_point_value(point_value) == 0.25
+
+    stackdriver_metric_client.value_type = ValueType.STRING
+    with pytest.raises(NotImplementedError):
+        stackdriver_metric_client.get_point_value(point_value)
+
 def test_convert_point_time():
     timestamp = protobuf.timestamp_pb2.Timestamp()
     timestamp.seconds = 1584627079
@@ -89,7 +111,7 @@ def test_prepend_key():
     assert StackdriverMetricClient.prepend_key(key, prepend) == expected
 
 def test_get_labels():
-    result = monitoring_v3.types.TimeSeries()  # pylint: disable=no-member
+    result = raw_message(monitoring_v3.types.TimeSeries())  # pylint: disable=no-member
     result.resource.labels['r1'] = 'r_value1'
     result.resource.labels['r2'] = 'r_value2'
     assert StackdriverMetricClient.get_labels(result) == {
@@ -107,7 +129,7 @@ def test_get_labels():
     }
 
 def test_point_dict(stackdriver_metric_client):
-    point = monitoring_v3.types.Point()
+    point = raw_message(monitoring_v3.types.Point())
     point.interval.end_time.seconds = 1584627079
     point.interval.end_time.nanos = 123456789
     point.interval.start_time.seconds = point.interval.end_time.seconds - (24*60*60)
@@ -116,7 +138,7 @@ def test_point_dict(stackdriver_metric_client):
 
     labels = {'label1':'some_value', 'label2':'some_other_value'}
 
-    stackdriver_metric_client.value_type = monitoring_v3.enums.MetricDescriptor.ValueType.BOOL
+    stackdriver_metric_client.value_type = ValueType.BOOL
 
     expected = {
         'start_timestamp': datetime.datetime(2020, 3, 18, 14, 11, 19, 123457, tzinfo=pytz.UTC),
@@ -127,3 +149,343 @@ def test_point_dict(stackdriver_metric_client):
         }
 
     assert stackdriver_metric_client.point_dict(point, labels) == expected
+
+def make_time_series(n_series, n_points, start=1584627079):
+    """Build a list of BOOL TimeSeries objects to stand in for an API iterator"""
+    time_series = []
+    for i in range(n_series):
+        result = raw_message(monitoring_v3.types.TimeSeries())
+        result.resource.labels['environment_name'] = f'env{i % 3}'
+        result.resource.labels['project_id'] = f'project{i % 2}'
+        if i % 2:
+            result.metric.labels['image_version'] = 'composer-1-8-2'
+        for j in range(n_points):
+            point = result.points.add()
+            point.interval.end_time.seconds = start - (60 * j)
+            point.interval.end_time.nanos = 123456789
+            point.interval.start_time.seconds = start - (60 * j)
+            point.interval.start_time.nanos = 123456789
+            point.value.bool_value = bool((i + j) % 5)
+        time_series.append(result)
+    return time_series
+
+class FakePageIterator():
+    """Stands in for a GRPCIterator, serving TimeSeries in pages
+    """
+
+    def __init__(self, time_series, page_size):
+        self.pages = [
+            time_series[i:i + page_size] for i in range(0, len(time_series), page_size)
+            ]
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+def test_timeseries_chunks(stackdriver_metric_client, monkeypatch):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    time_series = make_time_series(5, 4)
+    time_series.insert(2, raw_message(monitoring_v3.types.TimeSeries()))
+    monkeypatch.setattr(
+        stackdriver_metric_client,
+        'get_timeseries_iter',
+        lambda interval: FakePageIterator(time_series, 2)
+        )
+
+    chunks = list(stackdriver_metric_client.timeseries_chunks(end=1584627079, duration=3600))
+    assert [chunk.shape[0] for chunk in chunks] == [8, 4, 8]
+
+def test_to_df_columnar(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    time_series = make_time_series(4, 7)
+    time_series.append(raw_message(monitoring_v3.types.TimeSeries()))
+
+    columnar = stackdriver_metric_client.to_df_columnar(time_series)
+    records = stackdriver_metric_client.to_df_records(time_series)
+    assert str(columnar['end_timestamp'].dtype) == 'datetime64[ns, UTC]'
+    assert columnar['end_timestamp'][0] == pd.Timestamp(1584627079123456789, tz='UTC')
+
+    label_columns = [c for c in columnar.columns if '__' in c]
+    assert all(columnar[c].dtype.name == 'category' for c in label_columns)
+    columnar[label_columns] = columnar[label_columns].astype(object)
+
+    # The records path only has microsecond precision
+    columnar['start_timestamp'] = columnar['start_timestamp'].dt.round('us')
+    columnar['end_timestamp'] = columnar['end_timestamp'].dt.round('us')
+    pd.testing.assert_frame_equal(columnar, records)
+
+    stackdriver_metric_client.columnar = False
+    pd.testing.assert_frame_equal(stackdriver_metric_client.to_df(time_series), records)
+
+    with pytest.raises(NoMetricDataAvailable):
+        stackdriver_metric_client.to_df_columnar([raw_message(monitoring_v3.types.TimeSeries())])
+
+def test_to_series_table(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    time_series = make_time_series(4, 7)
+
+    points, series = stackdriver_metric_client.to_series_table(time_series)
+    assert list(points.columns) == ['start_timestamp', 'end_timestamp', 'value', 'series_id']
+    assert points.shape[0] == 28
+    assert list(points['series_id'].unique()) == [0, 1, 2, 3]
+    assert series.shape == (4, 3)
+    assert series.loc[1].to_dict() == {
+        'resource__environment_name': 'env1',
+        'resource__project_id': 'project1',
+        'metric__image_version': 'composer-1-8-2'
+        }
+    assert pd.isna(series.loc[0, 'metric__image_version'])
+
+    data = StackdriverMetricClient.join_series_table(points, series)
+    assert 'series_id' not in data
+    assert data['resource__environment_name'].cat.categories.tolist() == ['env0', 'env1', 'env2']
+    assert data['metric__image_version'].isna().sum() == 14
+
+def test_to_df_columnar_gauge(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    time_series = make_time_series(2, 3)
+    for result in time_series:
+        result.metric_kind = MetricKind.GAUGE
+
+    assert 'start_timestamp' in stackdriver_metric_client.to_df_columnar(time_series)
+
+    stackdriver_metric_client.gauge_start_timestamp = False
+    data = stackdriver_metric_client.to_df_columnar(time_series)
+    assert 'start_timestamp' not in data
+    assert list(data.columns[:2]) == ['end_timestamp', 'value']
+
+def test_convert_point_times():
+    seconds = np.array([1584627079, 1584627080], dtype=np.int64)
+    nanos = np.array([123456789, 1], dtype=np.int64)
+    times = StackdriverMetricClient.convert_point_times(seconds, nanos)
+    assert str(times.dtype) == 'datetime64[ns, UTC]'
+    assert times[0] == pd.Timestamp('2020-03-19 14:11:19.123456789', tz='UTC')
+    assert times[1].value == 1584627080000000001
+
+
+def test_timeseries_dataframe_sharded(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    time_series = make_time_series(3, 200, start=1584627000)
+    for result in time_series:
+        for point in result.points:
+            point.interval.end_time.nanos = 0
+    fake_client = FakeMetricServiceClient(time_series, latency=0.01)
+    stackdriver_metric_client._client = fake_client
+    stackdriver_metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    end, duration = 1584627000, 200 * 60
+
+    expected = stackdriver_metric_client.timeseries_dataframe(end=end, duration=duration)
+
+    stackdriver_metric_client.shards = 8
+    stackdriver_metric_client.max_workers = 3
+    fake_client.requests = []
+    data = stackdriver_metric_client.timeseries_dataframe(end=end, duration=duration)
+
+    intervals = [
+        (request['interval'].start_time.seconds, request['interval'].end_time.seconds)
+        for request in fake_client.requests
+        ]
+    assert len(intervals) == 8
+    assert min(intervals) == (end - duration, end - duration + 1500)
+    assert max(intervals) == (end - 1500, end)
+    assert 1 < fake_client.max_in_flight <= 3
+    # Points on the 7 inner boundaries are served twice but kept once
+    assert data.shape == expected.shape
+    for label, series in data.groupby('resource__environment_name'):
+        assert series['end_timestamp'].is_monotonic_decreasing, label
+    sort_by = ['resource__environment_name', 'end_timestamp']
+    pd.testing.assert_frame_equal(
+        data.sort_values(sort_by).reset_index(drop=True),
+        expected.sort_values(sort_by).reset_index(drop=True)
+        )
+
+def test_shard_intervals():
+    intervals = StackdriverMetricClient.shard_intervals(1000, 5, 100, 4)
+    assert [(i.start_time.seconds, i.end_time.seconds) for i in intervals] == [
+        (975, 1000), (950, 975), (925, 950), (900, 925)
+        ]
+    assert intervals[0].end_time.nanos == 5
+    assert intervals[1].end_time.nanos == 0
+
+def test_atimeseries_dataframe():
+    time_series = make_time_series(3, 200, start=1584627000)
+    fake_client = FakeAsyncMetricServiceClient(time_series, page_size=1, latency=0.01)
+    clients = []
+    for _ in range(20):
+        client = StackdriverMetricClient(None, async_client=fake_client)
+        client.metric_type = 'composer.googleapis.com/environment/healthy'
+        client.value_type = ValueType.BOOL
+        clients.append(client)
+
+    async def fetch_all():
+        return await asyncio.gather(*[
+            client.atimeseries_dataframe(end=1584627000, duration=100 * 60) for client in clients
+            ])
+
+    frames = asyncio.run(fetch_all())
+    # 20 fetches of 3 pages each interleave on the loop rather than queue up
+    assert fake_client.max_in_flight == 20
+    assert fake_client.in_flight == 0
+    assert len(fake_client.requests) == 20
+    assert fake_client.requests[0].name == 'projects/None'
+    assert fake_client.requests[0].view == \
+        monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').FULL
+    # Points end 123456789ns past the minute, so the newest one is after the end
+    assert all(frame.shape[0] == 3 * 100 for frame in frames)
+
+    expected = clients[0].to_df(time_series)
+    expected = expected[
+        expected['end_timestamp'].between(
+            pd.Timestamp(1584621000, unit='s', tz='UTC'),
+            pd.Timestamp(1584627000, unit='s', tz='UTC')
+            )
+        ].reset_index(drop=True)
+    pd.testing.assert_frame_equal(frames[0], expected)
+
+    clients[0].shards = 4
+    sharded = asyncio.run(clients[0].atimeseries_dataframe(end=1584627000, duration=100 * 60))
+    assert sharded.shape == frames[0].shape
+
+def test_result_cache_projects(monkeypatch):
+    cache = ResultCache(ttl=60)
+    monkeypatch.setattr(MetricClient, 'result_cache', cache)
+
+    def fetch(project, n_series):
+        client = StackdriverMetricClient(
+            project,
+            client=FakeMetricServiceClient(make_time_series(n_series, 10, start=1584627000))
+            )
+        client.metric_type = 'composer.googleapis.com/environment/healthy'
+        client.value_type = ValueType.BOOL
+        return client.timeseries_dataframe(end=1584627000, duration=3600)
+
+    # Clients that differ only in project do not share cached frames
+    first = fetch('proj-a', 2)
+    second = fetch('proj-b', 4)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert first.shape[0] == 2 * 9
+    assert second.shape[0] == 4 * 9
+    pd.testing.assert_frame_equal(fetch('proj-a', 4), first)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_aligned_counts(stackdriver_metric_client):
+    stackdriver_metric_client.value_type = ValueType.BOOL
+    stackdriver_metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    time_series = make_time_series(6, 240, start=1584627000)
+    fake_client = FakeMetricServiceClient(time_series)
+    stackdriver_metric_client._client = fake_client
+    end, duration = 1584627000, 4 * 3600
+
+    counts = stackdriver_metric_client.aligned_counts(
+        end=end, duration=duration, alignment_period=3600, resource_labels=['environment_name']
+        )
+    aggregations = [request['aggregation'] for request in fake_client.requests]
+    assert [a.per_series_aligner for a in aggregations] == [
+        monitoring_enum('Aggregation', 'Aligner').ALIGN_COUNT_TRUE,
+        monitoring_enum('Aggregation', 'Aligner').ALIGN_COUNT
+        ]
+    assert list(aggregations[0].group_by_fields) == ['resource.label.environment_name']
+    assert list(counts.columns) == [
+        'resource__environment_name', 'end_timestamp', 'count_good', 'count_valid'
+        ]
+    # 3 environments by 4 hourly alignment periods
+    assert counts.shape[0] == 12
+
+    raw = stackdriver_metric_client.timeseries_dataframe(end=end, duration=duration)
+    totals = counts.groupby('resource__environment_name')[['count_good', 'count_valid']].sum()
+    grouped = raw.groupby('resource__environment_name', observed=True)['value']
+    assert totals['count_good'].tolist() == grouped.sum().tolist()
+    assert totals['count_valid'].tolist() == grouped.count().tolist()
+
+def test_preflight(stackdriver_metric_client):
+    stackdriver_metric_client.metric_type = 'composer.googleapis.com/environment/healthy'
+    fake_client = FakeMetricServiceClient(make_time_series(6, 240, start=1584627000))
+    stackdriver_metric_client._client = fake_client
+
+    preflight = stackdriver_metric_client.preflight(end=1584627000, duration=3600)
+    assert fake_client.requests[0]['view'] == \
+        monitoring_enum('ListTimeSeriesRequest', 'TimeSeriesView').HEADERS
+    assert preflight.series == 6
+    assert preflight.cardinality == {
+        'resource__environment_name': 3,
+        'resource__project_id': 2,
+        'metric__image_version': 1
+        }
+    assert preflight.estimated_points == 6 * 60
+    assert preflight.estimated_bytes == 6 * 60 * (24 + 4 * 3)
+    assert preflight.estimated_groups(['resource__environment_name']) == 3
+    assert preflight.estimated_groups(
+        ['resource__environment_name', 'resource__project_id', 'metric__image_version']
+        ) == 6
+
+def make_distribution_series(n_series, n_points, start=1584627079):
+    """Build a list of DISTRIBUTION TimeSeries with explicit buckets [1, 2, 4]"""
+    time_series = []
+    for i in range(n_series):
+        result = raw_message(monitoring_v3.types.TimeSeries())
+        result.metric_kind = MetricKind.DELTA
+        result.resource.labels['environment_name'] = f'env{i % 3}'
+        for j in range(n_points):
+            point = result.points.add()
+            point.interval.end_time.seconds = start - (60 * j)
+            point.interval.start_time.seconds = start - (60 * j)
+            distribution = point.value.distribution_value
+            distribution.bucket_options.explicit_buckets.bounds.extend([1, 2, 4])
+            # Trailing empty buckets are omitted, as by the API
+            counts = [i, j % 3, 1] if j % 2 else [i, j % 3, 1, 2]
+            distribution.bucket_counts.extend(counts)
+            distribution.count = sum(counts)
+        time_series.append(result)
+    return time_series
+
+def test_bucket_bounds():
+    options = distribution_pb2.Distribution.BucketOptions()  # pylint: disable=no-member
+    options.linear_buckets.num_finite_buckets = 3
+    options.linear_buckets.width = 10
+    options.linear_buckets.offset = 5
+    assert StackdriverMetricClient.bucket_bounds(options).tolist() == [5, 15, 25, 35]
+
+    options.exponential_buckets.num_finite_buckets = 2
+    options.exponential_buckets.growth_factor = 2
+    options.exponential_buckets.scale = 3
+    assert StackdriverMetricClient.bucket_bounds(options).tolist() == [3, 6, 12]
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_to_df_distribution(stackdriver_metric_client, columnar):
+    stackdriver_metric_client.value_type = \
+        ValueType.DISTRIBUTION
+    stackdriver_metric_client.columnar = columnar
+    time_series = make_distribution_series(3, 4)
+
+    df = stackdriver_metric_client.to_df(time_series)
+    buckets = ['bucket__1.0', 'bucket__2.0', 'bucket__4.0', 'bucket__inf']
+    assert [column for column in df.columns if column.startswith('bucket__')] == buckets
+    assert df[buckets].sum(axis=1).tolist() == df['value'].tolist()
+    assert df['bucket__inf'].tolist() == [2, 0, 2, 0] * 3
+    assert df['bucket__1.0'].tolist() == [0] * 4 + [1] * 4 + [2] * 4
+
+    # The metric kind is read from the series
+    assert stackdriver_metric_client.metric_kind == MetricKind.DELTA
+    for result in time_series:
+        result.metric_kind = MetricKind.CUMULATIVE
+    stackdriver_metric_client.to_df(time_series)
+    assert stackdriver_metric_client.metric_kind == MetricKind.CUMULATIVE
+
+def test_fake_metric_service_server():
+    time_series = make_time_series(5, 120, start=1584627000)
+    with FakeMetricServiceServer(time_series, page_size=2) as server:
+        client = StackdriverMetricClient('fake', client=server.client())
+        client.metric_type = 'composer.googleapis.com/environment/healthy'
+        client.value_type = ValueType.BOOL
+        data = client.timeseries_dataframe(end=1584627001, duration=7200)
+
+        # 5 series in pages of 2, decoded from the wire by the real client
+        assert [request.page_token for request in server.servicer.requests] == ['', '2', '4']
+        assert server.servicer.requests[0].name == 'projects/fake'
+        assert server.servicer.requests[0].filter == client._filter.string
+        pd.testing.assert_frame_equal(data, client.to_df(time_series))
+
+        server.servicer.requests = []
+        server.servicer.max_page_bytes = 1
+        assert client.preflight(end=1584627000, duration=3600).series == 5
+        assert len(server.servicer.requests) == 5
@@ -36,5 +36,8 @@ setup(
         "pandas",
         "pytz"
     ],
+    extras_require={
+        "parquet": ["pyarrow"]
+    },
 
 )